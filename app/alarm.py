@@ -8,6 +8,10 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from config import ALARM_CONFIG, LIGHT_PATTERNS, TIME_FORMATS, PATHS
+from clock import SystemClock
+from scheduler import AlarmScheduler
+from recurrence import Recurrence
+from escalation import DEFAULT_STAGES
 
 logger = logging.getLogger(__name__)
 
@@ -15,14 +19,32 @@ logger = logging.getLogger(__name__)
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
 class AlarmManager:
-    def __init__(self):
-        """Initialize the alarm manager."""
+    def __init__(self, clock=None, store=None, device_id=None):
+        """Initialize the alarm manager.
+
+        With a store (AlarmRepository), self.alarms is a write-through cache
+        of the alarms assigned to device_id.
+        """
+        self.clock = clock or SystemClock()
+        self.store = store
+        self.device_id = device_id
         self.alarms = []
         self.events = []
+        self.scheduler = AlarmScheduler(self.clock)
+        self.rules = {}
+        self.last_fired = {}
+        # Called whenever the next fire time may have changed
+        self.on_schedule_change = None
+        self.holidays = set()
+        self.active_alarm = None
+        # Sunrise ramps that became due, for the runtime to start
+        self.pending_sunrises = []
         self.config = self._load_config()
         self.creds = self._get_google_credentials()
         self.last_sync = None
         self.sync_interval = timedelta(minutes=5)
+        # Alarms whose deadline passed during a loop stall still fire if this late
+        self.catch_up_window = timedelta(minutes=ALARM_CONFIG.get('CATCH_UP_MINUTES', 10))
         logger.info("Alarm manager initialized")
 
     def _load_config(self):
@@ -32,6 +54,8 @@ class AlarmManager:
                 'default_sound': ALARM_CONFIG['DEFAULT_SOUND'],
                 'rgb_enabled': True,
                 'rgb_pattern': LIGHT_PATTERNS['default'],
+                'sunrise_minutes': ALARM_CONFIG.get('SUNRISE_MINUTES', 0),
+                'escalation': ALARM_CONFIG.get('ESCALATION', DEFAULT_STAGES),
                 'time_format': TIME_FORMATS['24h'],
                 'sounds_dir': PATHS['SOUNDS_DIR']
             }
@@ -41,6 +65,8 @@ class AlarmManager:
                 'default_sound': 'standard_alarm.mp3',
                 'rgb_enabled': True,
                 'rgb_pattern': 'default',
+                'sunrise_minutes': 0,
+                'escalation': DEFAULT_STAGES,
                 'time_format': '24h',
                 'sounds_dir': 'sounds'
             }
@@ -77,9 +103,15 @@ class AlarmManager:
 
     def sync_calendar_events(self):
         """Sync events from Google Calendar."""
+        events = self.fetch_calendar_events()
+        if events is not None:
+            self.set_calendar_events(events)
+
+    def fetch_calendar_events(self):
+        """Fetch upcoming events from Google Calendar without touching the schedule."""
         if not self.creds:
             logger.error("No valid credentials available")
-            return
+            return None
 
         try:
             service = build('calendar', 'v3', credentials=self.creds)
@@ -100,7 +132,7 @@ class AlarmManager:
             events = events_result.get('items', [])
             
             # Process events
-            self.events = []
+            processed = []
             for event in events:
                 start = event['start'].get('dateTime', event['start'].get('date'))
                 
@@ -110,129 +142,316 @@ class AlarmManager:
                 else:  # Date only
                     start_time = datetime.strptime(start, '%Y-%m-%d')
                 
-                self.events.append({
+                processed.append({
                     'id': event['id'],
                     'title': event['summary'],
                     'start_time': start_time,
                     'description': event.get('description', ''),
                     'has_alarm': bool(event.get('reminders', {}).get('useDefault', True))
                 })
-            
-            self.last_sync = datetime.now()
-            logger.info(f"Synced {len(self.events)} calendar events")
+            return processed
             
         except Exception as e:
             logger.error(f"Error syncing calendar events: {str(e)}")
+            return None
 
-    def check_alarms(self):
-        """Check if any alarms should be triggered."""
-        now = datetime.now()
-        
-        # Sync calendar if needed
-        if not self.last_sync or (now - self.last_sync) > self.sync_interval:
-            self.sync_calendar_events()
-        
-        # Check regular alarms
-        for alarm in self.alarms:
-            if self._should_trigger_alarm(alarm, now):
-                return True
-        
-        # Check calendar events
+    def set_calendar_events(self, events):
+        """Replace the calendar events and reschedule their reminders."""
+        for old_event in self.events:
+            self.scheduler.cancel(('event', old_event['id']))
+        self.events = events
         for event in self.events:
-            if event['has_alarm']:
-                # Trigger 15 minutes before event
-                trigger_time = event['start_time'] - timedelta(minutes=15)
-                if self._is_trigger_time(trigger_time, now):
-                    return True
+            self._schedule_event(event)
         
-        return False
+        self.last_sync = self.clock.now()
+        self._notify_schedule_change()
+        logger.info(f"Synced {len(self.events)} calendar events")
 
-    def _should_trigger_alarm(self, alarm, current_time):
-        """Check if a specific alarm should be triggered."""
-        if not alarm.get('enabled', False):
-            return False
+    def fetch_alarms(self):
+        """Fetch this device's alarms from the store without touching the schedule."""
+        if not self.store or not self.device_id:
+            return None
+        try:
+            return self.store.list_for_device(self.device_id)
+        except Exception as e:
+            logger.error(f"Error loading alarms: {str(e)}")
+            return None
+
+    def set_alarms(self, alarms):
+        """Reconcile the cached alarms with the stored ones; only changed alarms are rescheduled."""
+        stored = {alarm['id']: alarm for alarm in alarms}
+        for alarm in list(self.alarms):
+            if alarm.get('id') not in stored:
+                self._forget_alarm(alarm.get('id'))
+        for alarm_id, alarm in stored.items():
+            cached = self._find_alarm(alarm_id)
+            if cached is None:
+                self._cache_alarm(alarm)
+            elif cached.get('updated_at') != alarm.get('updated_at'):
+                self._recache_alarm(cached, alarm)
+
+    def check_alarms(self):
+        """Check if any alarms should be triggered."""
+        now = self.clock.now()
+        triggered = False
+        for fire_time, key in self.scheduler.pop_due():
+            kind, item_id = key
+            if kind == 'sunrise':
+                self._start_sunrise(item_id, fire_time)
+                continue
+            # Real elapsed time, so a DST shift is not mistaken for lateness
+            late = timedelta(seconds=self.clock.time() - fire_time.timestamp())
+            on_time = late <= self.catch_up_window
+            if not on_time:
+                logger.warning(f"Missed {kind} {item_id} due at {fire_time} ({late} late), not firing")
+            elif late.total_seconds() >= 60:
+                logger.info(f"Catching up {kind} {item_id} due at {fire_time} ({late} late)")
             
-        alarm_time = datetime.strptime(alarm['time'], '%H:%M').time()
-        current_time = current_time.time()
+            if kind == 'alarm':
+                alarm = self._find_alarm(item_id)
+                if alarm is None:
+                    continue
+                # Each occurrence fires once: the next one is strictly after this one
+                self.last_fired[item_id] = fire_time
+                self._schedule_alarm(alarm, after=max(fire_time, now - self.catch_up_window))
+                if on_time:
+                    self.active_alarm = alarm
+                    triggered = True
+            elif on_time:
+                self.active_alarm = None
+                triggered = True
         
-        # Check if it's time to trigger
-        if self._is_trigger_time(alarm_time, current_time):
-            # Check recurrence
-            if alarm.get('recurring', False):
-                # Check if today is in recurring days
-                if current_time.strftime('%A').lower() in alarm.get('days', []):
-                    return True
-            else:
-                # One-time alarm
-                if alarm.get('date'):
-                    alarm_date = datetime.strptime(alarm['date'], '%Y-%m-%d').date()
-                    if alarm_date == current_time.date():
-                        return True
-                else:
-                    return True
-        
-        return False
-
-    def _is_trigger_time(self, alarm_time, current_time):
-        """Check if current time matches trigger time."""
-        # Convert to comparable format
-        if isinstance(alarm_time, datetime):
-            alarm_time = alarm_time.time()
-        if isinstance(current_time, datetime):
-            current_time = current_time.time()
-            
-        return (alarm_time.hour == current_time.hour and
-                alarm_time.minute == current_time.minute)
+        return triggered
+
+    def seconds_until_next_alarm(self):
+        """Seconds until the next scheduled alarm or event, or None."""
+        return self.scheduler.seconds_until_next()
+
+    def _find_alarm(self, alarm_id):
+        """Find an alarm dict by ID."""
+        return next((a for a in self.alarms if a.get('id') == alarm_id), None)
+
+    def _compile_alarm(self, alarm):
+        """Compile an alarm's recurrence rule once, when it is added or changed."""
+        try:
+            self.rules[alarm.get('id')] = Recurrence.from_alarm(alarm, holidays=self.holidays)
+        except (KeyError, ValueError) as e:
+            logger.error(f"Error compiling alarm {alarm.get('id')}: {str(e)}")
+            self.rules.pop(alarm.get('id'), None)
+
+    def _schedule_alarm(self, alarm, after=None):
+        """Schedule the next fire time for an alarm from its compiled rule."""
+        key = ('alarm', alarm.get('id'))
+        rule = self.rules.get(alarm.get('id'))
+        if not alarm.get('enabled', False) or rule is None:
+            self.scheduler.cancel(key)
+            self.scheduler.cancel(('sunrise', alarm.get('id')))
+            self._notify_schedule_change()
+            return
+        after = after or self.clock.now()
+        last_fired = self.last_fired.get(alarm.get('id'))
+        if last_fired and last_fired > after:
+            after = last_fired
+        fire_time = rule.next_occurrence(after)
+        self.scheduler.schedule(key, fire_time)
+        self._schedule_sunrise(alarm, fire_time)
+        self._notify_schedule_change()
 
-    def get_current_alarm_config(self):
-        """Get configuration for currently triggering alarm."""
-        return {
-            'sound_file': self.config.get('default_sound', 'standard_alarm.mp3'),
+    def _sunrise_minutes(self, alarm):
+        """Length of an alarm's sunrise ramp in minutes (0 = no sunrise)."""
+        if not self.config.get('rgb_enabled', True):
+            return 0
+        minutes = alarm.get('sunrise_minutes')
+        return minutes if minutes is not None else self.config.get('sunrise_minutes', 0)
+
+    def _schedule_sunrise(self, alarm, fire_time):
+        """Schedule the sunrise ramp that leads up to an alarm's next occurrence."""
+        key = ('sunrise', alarm.get('id'))
+        minutes = self._sunrise_minutes(alarm)
+        if not minutes or fire_time is None or fire_time <= self.clock.now():
+            self.scheduler.cancel(key)
+            return
+        # Already inside the window: start now, part-way through the ramp
+        self.scheduler.schedule(key, max(fire_time - timedelta(minutes=minutes), self.clock.now()))
+
+    def _start_sunrise(self, alarm_id, start_time):
+        """Queue the sunrise for an alarm whose ramp start is due."""
+        alarm = self._find_alarm(alarm_id)
+        fire_time = self.scheduler.next_fire_time(('alarm', alarm_id))
+        if alarm is None or fire_time is None:
+            return
+        remaining = fire_time.timestamp() - self.clock.time()
+        if remaining <= 0:
+            return
+        config = self.get_current_alarm_config(alarm)
+        config['sunrise_duration'] = self._sunrise_minutes(alarm) * 60
+        config['sunrise_remaining'] = remaining
+        self.pending_sunrises.append(config)
+        logger.info(f"Sunrise started for alarm {alarm_id} due at {fire_time}")
+
+    def take_sunrises(self):
+        """Return and clear the sunrises that became due."""
+        sunrises, self.pending_sunrises = self.pending_sunrises, []
+        return sunrises
+
+    def _notify_schedule_change(self):
+        """Tell the runtime that the next deadline may have moved."""
+        if self.on_schedule_change:
+            self.on_schedule_change()
+
+    def _schedule_event(self, event):
+        """Schedule the reminder for a calendar event."""
+        if not event['has_alarm']:
+            return
+        # Trigger 15 minutes before event
+        trigger_time = event['start_time'] - timedelta(minutes=15)
+        if trigger_time.tzinfo is not None:
+            trigger_time = trigger_time.astimezone().replace(tzinfo=None)
+        if trigger_time > self.clock.now() - self.catch_up_window:
+            self.scheduler.schedule(('event', event['id']), trigger_time)
+
+    def get_current_alarm_config(self, alarm=None):
+        """Get configuration for currently triggering alarm (or the given one)."""
+        alarm = alarm or self.active_alarm or {}
+        config = {
+            'sound_file': alarm.get('sound_file') or self.config.get('default_sound', 'standard_alarm.mp3'),
             'rgb_enabled': self.config.get('rgb_enabled', True),
-            'rgb_pattern': self.config.get('rgb_pattern', 'default')
+            'rgb_pattern': alarm.get('rgb_pattern') or self.config.get('rgb_pattern', 'default'),
+            'escalation': alarm.get('escalation') or self.config.get('escalation')
         }
+        if alarm.get('title'):
+            config['title'] = alarm['title']
+        return config
+
+    def upcoming_sounds(self, horizon):
+        """Sound files that may be needed within horizon: the default sound and those of alarms due by then."""
+        until = self.clock.now() + horizon
+        sounds = [self.config.get('default_sound')]
+        for fire_time, (kind, item_id) in self.scheduler.upcoming():
+            if fire_time > until:
+                break
+            alarm = self._find_alarm(item_id) if kind == 'alarm' else None
+            if alarm:
+                config = self.get_current_alarm_config(alarm)
+                sounds.append(config['sound_file'])
+                # Louder escalation stages too, so switching to them is instant
+                sounds.extend(stage.get('sound') for stage in config['escalation'] or [])
+        return [sound for sound in dict.fromkeys(sounds) if sound]
 
     def get_upcoming_events(self):
         """Get list of upcoming events."""
-        now = datetime.now()
+        now = self.clock.now()
         upcoming = []
         
-        # Add regular alarms
-        for alarm in self.alarms:
-            if alarm.get('enabled', False):
-                alarm_time = datetime.strptime(alarm['time'], '%H:%M').time()
-                if alarm_time > now.time():
-                    upcoming.append({
-                        'title': alarm.get('title', 'Alarm'),
-                        'time': alarm_time.strftime(self._get_time_format())
-                    })
+        # Add regular alarms, already ordered by the scheduler
+        for fire_time, (kind, item_id) in self.scheduler.upcoming():
+            if kind == 'alarm' and fire_time.date() == now.date():
+                alarm = self._find_alarm(item_id)
+                upcoming.append((fire_time, alarm.get('title', 'Alarm') if alarm else 'Alarm'))
         
         # Add calendar events
         for event in self.events:
-            if event['start_time'] > now:
-                upcoming.append({
-                    'title': event['title'],
-                    'time': event['start_time'].strftime(self._get_time_format())
-                })
+            start_time = event['start_time']
+            if start_time.tzinfo is not None:
+                start_time = start_time.astimezone().replace(tzinfo=None)
+            if start_time > now:
+                upcoming.append((start_time, event['title']))
         
         # Sort by time and limit to next 5 events
-        upcoming.sort(key=lambda x: datetime.strptime(x['time'], self._get_time_format()))
-        return upcoming[:5]
+        upcoming.sort(key=lambda x: x[0])
+        return [{
+            'title': title,
+            'time': when.strftime(self._get_time_format())
+        } for when, title in upcoming[:5]]
 
     def _get_time_format(self):
         """Get time format based on configuration."""
         return '%I:%M %p' if self.config.get('time_format') == '12h' else '%H:%M'
 
+    def _cache_alarm(self, alarm):
+        """Add an alarm to the cache and schedule it."""
+        self.alarms.append(alarm)
+        self._compile_alarm(alarm)
+        self._schedule_alarm(alarm)
+
+    def _recache_alarm(self, cached, alarm):
+        """Replace a cached alarm in place and reschedule it."""
+        cached.clear()
+        cached.update(alarm)
+        self._compile_alarm(cached)
+        self._schedule_alarm(cached)
+
     def add_alarm(self, alarm_data):
         """Add a new alarm."""
-        self.alarms.append(alarm_data)
+        if self.store:
+            alarm_data = self.store.create(alarm_data, device_uid=self.device_id)
+        self._cache_alarm(alarm_data)
         logger.info(f"Added new alarm: {alarm_data}")
+        return alarm_data
+
+    def update_alarm(self, alarm_data):
+        """Replace an existing alarm, matched by ID."""
+        alarm = self._find_alarm(alarm_data.get('id'))
+        if alarm is None:
+            raise ValueError(f"Alarm not found: {alarm_data.get('id')}")
+        if self.store:
+            alarm_data = self.store.update(alarm_data['id'], alarm_data)
+        self._recache_alarm(alarm, alarm_data)
+        logger.info(f"Updated alarm: {alarm_data}")
+
+    def toggle_alarm(self, alarm_id, enabled):
+        """Enable or disable an alarm. Returns False if it does not exist."""
+        alarm = self._find_alarm(alarm_id)
+        if alarm is None:
+            return False
+        if self.store:
+            self._recache_alarm(alarm, self.store.update(alarm_id, {'enabled': enabled}))
+        else:
+            alarm['enabled'] = enabled
+            self._schedule_alarm(alarm)
+        return True
+
+    def skip_next(self, alarm_id):
+        """Skip the next occurrence of an alarm. Returns the skipped date or None."""
+        alarm = self._find_alarm(alarm_id)
+        rule = self.rules.get(alarm_id)
+        if alarm is None or rule is None:
+            return None
+        skipped = rule.skip_next(self.clock.now())
+        if skipped:
+            exdates = alarm.get('exdates', []) + [skipped.strftime('%Y-%m-%d')]
+            if self.store:
+                self._recache_alarm(alarm, self.store.update(alarm_id, {'exdates': exdates}))
+            else:
+                alarm['exdates'] = exdates
+                self._schedule_alarm(alarm)
+            logger.info(f"Skipping alarm {alarm_id} on {skipped}")
+        return skipped
+
+    def set_holidays(self, holidays):
+        """Replace the holiday calendar used by alarms with skip_holidays set."""
+        # Mutate in place: compiled rules hold a reference to this set
+        self.holidays.clear()
+        self.holidays.update(holidays)
+        for alarm in self.alarms:
+            self._schedule_alarm(alarm)
 
     def remove_alarm(self, alarm_id):
         """Remove an alarm by ID."""
-        self.alarms = [a for a in self.alarms if a.get('id') != alarm_id]
+        if self.store:
+            self.store.delete(alarm_id)
+        self._forget_alarm(alarm_id)
         logger.info(f"Removed alarm: {alarm_id}")
 
+    def _forget_alarm(self, alarm_id):
+        """Drop an alarm from the cache and the schedule."""
+        self.alarms = [a for a in self.alarms if a.get('id') != alarm_id]
+        self.rules.pop(alarm_id, None)
+        self.last_fired.pop(alarm_id, None)
+        self.scheduler.cancel(('alarm', alarm_id))
+        self.scheduler.cancel(('sunrise', alarm_id))
+        self._notify_schedule_change()
+
     def update_config(self, new_config):
         """Update alarm configuration."""
         self.config.update(new_config)
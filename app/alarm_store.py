@@ -0,0 +1,161 @@
+import json
+import logging
+from contextlib import contextmanager
+from database import SessionLocal, Alarm, Device
+
+logger = logging.getLogger(__name__)
+
+# Alarm dict keys stored in their own columns; everything else (recurrence
+# bounds, exdates, sunrise, escalation, ...) is kept in Alarm.options
+COLUMN_FIELDS = ('id', 'title', 'time', 'days', 'sound_file', 'enabled', 'device_id', 'user_id', 'updated_at')
+
+def alarm_to_dict(alarm, device_uid=None):
+    """Convert an Alarm row into the dict shape AlarmManager and the API use."""
+    data = json.loads(alarm.options) if alarm.options else {}
+    data.update({
+        'id': alarm.id,
+        'title': alarm.title,
+        'time': alarm.time,
+        'days': alarm.days.split(',') if alarm.days else [],
+        'sound_file': alarm.sound_file,
+        'enabled': bool(alarm.is_enabled),
+        'device_id': device_uid,
+        'updated_at': alarm.updated_at.isoformat() if alarm.updated_at else None
+    })
+    return data
+
+def _apply(alarm, data):
+    """Copy the fields present in an alarm dict onto a row."""
+    if 'title' in data:
+        alarm.title = data['title']
+    if 'time' in data:
+        alarm.time = data['time']
+    if 'days' in data:
+        days = data['days'] or []
+        alarm.days = ','.join(days) if isinstance(days, (list, tuple)) else days
+    if 'sound_file' in data:
+        alarm.sound_file = data['sound_file']
+    if 'enabled' in data:
+        alarm.is_enabled = bool(data['enabled'])
+    options = json.loads(alarm.options) if alarm.options else {}
+    options.update({key: value for key, value in data.items() if key not in COLUMN_FIELDS})
+    alarm.options = json.dumps(options, sort_keys=True)
+
+class AlarmRepository:
+    """Alarms stored in the alarms table, queried per user or per device.
+
+    This is the single source of truth for alarms: every API worker and
+    the device loop read and write through it.
+
+    The device opens a session per call from session_factory. API requests
+    pass their request-scoped session instead; it is committed after each
+    call but left open for the request teardown to close.
+    """
+
+    def __init__(self, session_factory=SessionLocal, session=None):
+        """Initialize the repository on a session factory, or on one borrowed session."""
+        self.session_factory = session_factory
+        self.session = session
+
+    @contextmanager
+    def _session(self):
+        """A session that commits on success; closed afterwards unless borrowed."""
+        db = self.session if self.session is not None else self.session_factory()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if self.session is None:
+                db.close()
+
+    def _query(self, db):
+        """Alarms together with their device's public ID."""
+        return db.query(Alarm, Device.device_id).outerjoin(Device, Alarm.device_id == Device.id)
+
+    def _device(self, db, device_uid, user_id=None):
+        """Device row for a public device ID (optionally owned by user_id)."""
+        query = db.query(Device).filter(Device.device_id == device_uid)
+        if user_id is not None:
+            query = query.filter(Device.user_id == user_id)
+        device = query.first()
+        if device is None:
+            raise ValueError(f"Device not found: {device_uid}")
+        return device
+
+    def _owned(self, db, alarm_id, user_id):
+        """Alarm row by ID, restricted to user_id when given."""
+        query = db.query(Alarm).filter(Alarm.id == alarm_id)
+        if user_id is not None:
+            query = query.filter(Alarm.user_id == user_id)
+        return query.first()
+
+    def list_for_user(self, user_id):
+        """All of a user's alarms, ordered by time."""
+        with self._session() as db:
+            rows = self._query(db).filter(Alarm.user_id == user_id).order_by(Alarm.time, Alarm.id).all()
+            return [alarm_to_dict(alarm, device_uid) for alarm, device_uid in rows]
+
+    def list_for_device(self, device_uid):
+        """Alarms assigned to one device, ordered by time."""
+        with self._session() as db:
+            rows = (db.query(Alarm)
+                    .join(Device, Alarm.device_id == Device.id)
+                    .filter(Device.device_id == device_uid)
+                    .order_by(Alarm.time, Alarm.id)
+                    .all())
+            return [alarm_to_dict(alarm, device_uid) for alarm in rows]
+
+    def get(self, alarm_id, user_id=None):
+        """One alarm as a dict, or None."""
+        with self._session() as db:
+            row = self._query(db).filter(Alarm.id == alarm_id)
+            if user_id is not None:
+                row = row.filter(Alarm.user_id == user_id)
+            row = row.first()
+            return alarm_to_dict(*row) if row else None
+
+    def create(self, data, user_id=None, device_uid=None):
+        """Store a new alarm and return it with its ID.
+
+        The alarm belongs to user_id, or to the device owner when only a
+        device is given. Raises ValueError for an unknown device.
+        """
+        with self._session() as db:
+            device = self._device(db, device_uid, user_id) if device_uid else None
+            alarm = Alarm(user_id=user_id if user_id is not None else device.user_id if device else None,
+                          device_id=device.id if device else None)
+            _apply(alarm, data)
+            db.add(alarm)
+            db.flush()
+            db.refresh(alarm)
+            created = alarm_to_dict(alarm, device_uid)
+        logger.info(f"Created alarm {created['id']}")
+        return created
+
+    def update(self, alarm_id, data, user_id=None):
+        """Apply the given fields to an alarm. Returns the updated dict, or None if not found."""
+        with self._session() as db:
+            alarm = self._owned(db, alarm_id, user_id)
+            if alarm is None:
+                return None
+            if 'device_id' in data:
+                alarm.device_id = self._device(db, data['device_id'], user_id).id if data['device_id'] else None
+            _apply(alarm, data)
+            db.flush()
+            db.refresh(alarm)
+            device_uid = alarm.device.device_id if alarm.device else None
+            return alarm_to_dict(alarm, device_uid)
+
+    def delete(self, alarm_id, user_id=None):
+        """Delete an alarm. Returns the deleted alarm's dict, or None if it did not exist."""
+        with self._session() as db:
+            alarm = self._owned(db, alarm_id, user_id)
+            if alarm is None:
+                return None
+            deleted = alarm_to_dict(alarm, alarm.device.device_id if alarm.device else None)
+            db.delete(alarm)
+        logger.info(f"Deleted alarm {alarm_id}")
+        return deleted
@@ -1,24 +1,36 @@
 import os
 import jwt
 import json
+import hmac
+import hashlib
 import logging
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, g, stream_with_context
 from flask_cors import CORS
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 import uuid
 from email_validator import validate_email, EmailNotValidError
+from sqlalchemy import and_, cast, literal, String
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 
 # Local imports
 from config import *
-from database import get_db, User, VerificationToken, PasswordResetToken, UserSettings, Device, Alarm
+from database import SessionLocal, pool_metrics, pool_stats, User, VerificationToken, PasswordResetToken, UserSettings, Device, Alarm, LightPattern
 from email_service import EmailService
 from alarm import AlarmManager
+from alarm_store import AlarmRepository, alarm_to_dict
+from recurrence import Recurrence
 from weather import WeatherManager
-from hardware import HardwareController
+from weather_cache import SQLiteWeatherCache, quantize_location
+from hardware import HardwareController, LED_COUNT
+from led_patterns import PATTERNS, PRESETS
+from pattern_dsl import normalize, compile_spec
+from sound_upload import SoundUploads, UploadError, MAX_UPLOAD_BYTES
+from change_feed import ChangeFeed, format_sse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -27,11 +39,26 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
+# Reject oversized uploads before the body is read (headroom for multipart framing)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+# Let a fronting nginx/Apache send sound files itself (X-Sendfile / X-Accel-Redirect)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
 
 # Initialize components
 alarm_manager = AlarmManager()
-weather_manager = WeatherManager(api_key=WEATHER_API_KEY)
-hardware_controller = HardwareController()
+weather_manager = WeatherManager(
+    api_key=WEATHER_API_KEY,
+    cache=SQLiteWeatherCache(os.getenv('WEATHER_CACHE_DB', 'weather_cache.db')),
+    # Shared default for users with no device location
+    location=os.getenv('WEATHER_LOCATION', 'auto:ip')
+)
+hardware_controller = HardwareController(sounds_dir=PATHS['SOUNDS_DIR'])
+sound_index = hardware_controller.sound_index
+# Analyse new or changed sounds once at startup; uploads update the index directly
+threading.Thread(target=sound_index.refresh, daemon=True).start()
+sound_uploads = SoundUploads(sound_index.sounds_dir, sound_index, hardware_controller.sound_cache)
+# Alarm, settings and registration changes pushed to devices
+change_feed = ChangeFeed()
 
 # JWT Secret Key
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-here')
@@ -40,6 +67,34 @@ JWT_EXPIRATION = timedelta(days=7)
 # Initialize email service
 email_service = EmailService()
 
+def get_request_db():
+    """The request's database session, opened on first use and closed at teardown."""
+    if 'db' not in g:
+        g.db = SessionLocal()
+    return g.db
+
+def get_alarm_store():
+    """The alarm repository on the request's database session."""
+    if 'alarm_store' not in g:
+        g.alarm_store = AlarmRepository(session=get_request_db())
+    return g.alarm_store
+
+@app.before_request
+def begin_db_scope():
+    """Attribute connections checked out during this request to its endpoint."""
+    pool_metrics.begin_scope(request.endpoint)
+
+@app.teardown_appcontext
+def close_request_db(exc):
+    """Close the request's session (rolling back on error) and report leaked connections."""
+    db = g.pop('db', None)
+    if db is not None:
+        if exc is not None:
+            db.rollback()
+        db.close()
+    for scope, held in pool_metrics.end_scope():
+        logger.warning(f"Database connection checked out by {scope} still open after the request ({held:.1f}s)")
+
 def token_required(f):
     """Decorator to check valid JWT token."""
     @wraps(f)
@@ -66,10 +121,30 @@ def token_required(f):
         except jwt.InvalidTokenError:
             return jsonify({'success': False, 'message': 'Invalid token'}), 401
 
+        # Device tokens (see issue_device_token) only open the device's change feed
+        if current_user.get('type') == 'device' and not getattr(f, 'allow_device_token', False):
+            return jsonify({'success': False, 'message': 'User token required'}), 401
+
         return f(current_user, *args, **kwargs)
 
     return decorated
 
+def allow_device_token(f):
+    """Let a view accept a device token as well as a user token (apply under token_required)."""
+    f.allow_device_token = True
+    return f
+
+def _publish_to_user_devices(db, user_id, event_type, data=None):
+    """Publish a change event to every device the user owns."""
+    for (device_uid,) in db.query(Device.device_id).filter(Device.user_id == user_id).all():
+        change_feed.publish(device_uid, event_type, data, session=db)
+
+def _publish_alarm(alarm, action='saved'):
+    """Tell the alarm's device that it changed."""
+    if alarm and alarm.get('device_id'):
+        change_feed.publish(alarm['device_id'], 'alarm', {'action': action, 'alarm': alarm},
+                            session=get_request_db())
+
 # Authentication endpoints
 @app.route('/api/auth/verify', methods=['POST'])
 def verify_google_token():
@@ -139,7 +214,7 @@ def register():
                 'message': 'Password must be at least 8 characters long'
             }), 400
 
-        db = next(get_db())
+        db = get_request_db()
         
         # Check if user exists
         existing_user = db.query(User).filter(
@@ -206,7 +281,7 @@ def verify_email():
                 'message': 'Verification token is required'
             }), 400
 
-        db = next(get_db())
+        db = get_request_db()
         verification = db.query(VerificationToken).filter_by(
             token=token,
             is_used=False
@@ -254,7 +329,7 @@ def login():
                 'message': 'Email and password are required'
             }), 400
 
-        db = next(get_db())
+        db = get_request_db()
         user = db.query(User).filter_by(email=email).first()
 
         if not user or not user.check_password(password):
@@ -310,7 +385,7 @@ def forgot_password():
                 'message': 'Email is required'
             }), 400
 
-        db = next(get_db())
+        db = get_request_db()
         user = db.query(User).filter_by(email=email).first()
 
         if not user:
@@ -367,7 +442,7 @@ def reset_password():
                 'message': 'Password must be at least 8 characters long'
             }), 400
 
-        db = next(get_db())
+        db = get_request_db()
         reset_token = db.query(PasswordResetToken).filter_by(
             token=token,
             is_used=False
@@ -402,76 +477,139 @@ def reset_password():
 @token_required
 def get_alarms(current_user):
     """Get all alarms for the user."""
-    return jsonify({
-        'success': True,
-        'alarms': alarm_manager.alarms
-    })
+    try:
+        return jsonify({
+            'success': True,
+            'alarms': get_alarm_store().list_for_user(current_user['id'])
+        })
+    except Exception as e:
+        logger.error(f"Error getting alarms: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/alarms', methods=['POST'])
 @token_required
 def create_alarm(current_user):
     """Create a new alarm."""
     try:
-        alarm_data = request.json
-        alarm_data['id'] = str(len(alarm_manager.alarms) + 1)  # Simple ID generation
-        alarm_manager.add_alarm(alarm_data)
+        alarm_data = dict(request.json)
+        alarm_data.pop('id', None)
+        alarm = get_alarm_store().create(alarm_data, user_id=current_user['id'],
+                                   device_uid=alarm_data.pop('device_id', None))
+        _publish_alarm(alarm)
         return jsonify({
             'success': True,
-            'alarm': alarm_data
+            'alarm': alarm
         })
     except Exception as e:
         logger.error(f"Error creating alarm: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
-@app.route('/api/alarms/<alarm_id>', methods=['PUT'])
+@app.route('/api/alarms/<int:alarm_id>', methods=['PUT'])
 @token_required
 def update_alarm(current_user, alarm_id):
     """Update an existing alarm."""
     try:
-        alarm_data = request.json
-        alarm_data['id'] = alarm_id
-        alarm_manager.update_alarm(alarm_data)
+        alarm_data = dict(request.json)
+        alarm_data.pop('id', None)
+        previous = get_alarm_store().get(alarm_id, user_id=current_user['id'])
+        alarm = get_alarm_store().update(alarm_id, alarm_data, user_id=current_user['id'])
+        if alarm is None:
+            return jsonify({'success': False, 'message': 'Alarm not found'}), 404
+        if previous['device_id'] != alarm['device_id']:
+            # Moved to another device: the old one drops it
+            _publish_alarm(previous, action='deleted')
+        _publish_alarm(alarm)
         return jsonify({
             'success': True,
-            'alarm': alarm_data
+            'alarm': alarm
         })
     except Exception as e:
         logger.error(f"Error updating alarm: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
-@app.route('/api/alarms/<alarm_id>', methods=['DELETE'])
+@app.route('/api/alarms/<int:alarm_id>', methods=['DELETE'])
 @token_required
 def delete_alarm(current_user, alarm_id):
     """Delete an alarm."""
     try:
-        alarm_manager.remove_alarm(alarm_id)
-        return jsonify({'success': True})
+        alarm = get_alarm_store().delete(alarm_id, user_id=current_user['id'])
+        if alarm:
+            _publish_alarm(alarm, action='deleted')
+            return jsonify({'success': True})
+        return jsonify({'success': False, 'message': 'Alarm not found'}), 404
     except Exception as e:
         logger.error(f"Error deleting alarm: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
-@app.route('/api/alarms/<alarm_id>/toggle', methods=['POST'])
+@app.route('/api/alarms/<int:alarm_id>/toggle', methods=['POST'])
 @token_required
 def toggle_alarm(current_user, alarm_id):
     """Toggle alarm enabled state."""
     try:
         enabled = request.json.get('enabled', False)
-        alarm = next((a for a in alarm_manager.alarms if a.get('id') == alarm_id), None)
+        alarm = get_alarm_store().update(alarm_id, {'enabled': enabled}, user_id=current_user['id'])
         if alarm:
-            alarm['enabled'] = enabled
+            _publish_alarm(alarm)
             return jsonify({'success': True})
         return jsonify({'success': False, 'message': 'Alarm not found'}), 404
     except Exception as e:
         logger.error(f"Error toggling alarm: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
+@app.route('/api/alarms/<int:alarm_id>/skip', methods=['POST'])
+@token_required
+def skip_alarm(current_user, alarm_id):
+    """Skip the next occurrence of an alarm."""
+    try:
+        alarm = get_alarm_store().get(alarm_id, user_id=current_user['id'])
+        if alarm is None:
+            return jsonify({'success': False, 'message': 'Alarm not found'}), 404
+        rule = Recurrence.from_alarm(alarm, holidays=alarm_manager.holidays)
+        skipped = rule.skip_next(alarm_manager.clock.now())
+        if skipped is None:
+            return jsonify({'success': False, 'message': 'Alarm has no upcoming occurrence'}), 404
+        exdates = alarm.get('exdates', []) + [skipped.strftime('%Y-%m-%d')]
+        _publish_alarm(get_alarm_store().update(alarm_id, {'exdates': exdates}, user_id=current_user['id']))
+        return jsonify({'success': True, 'skipped': skipped.isoformat()})
+    except Exception as e:
+        logger.error(f"Error skipping alarm: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 400
+
 # Weather endpoints
+def _weather_location(current_user):
+    """Resolve the weather query for a request, quantised so nearby devices share a cache entry.
+
+    Uses ?lat=&lon=, else the location of ?device_id= or of any of the
+    user's devices, else None for the configured default location. Client
+    addresses are never used: they would give every caller its own key.
+    """
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+
+    if lat is None or lon is None:
+        db = get_request_db()
+        query = db.query(Device.latitude, Device.longitude).filter(
+            Device.user_id == current_user['id'],
+            Device.latitude.isnot(None),
+            Device.longitude.isnot(None)
+        )
+        device_id = request.args.get('device_id')
+        if device_id:
+            query = query.filter(Device.device_id == device_id)
+        location = query.order_by(Device.id).first()
+        if location is not None:
+            lat, lon = location
+
+    if lat is not None and lon is not None:
+        return quantize_location(lat, lon)
+    return None
+
 @app.route('/api/weather/current', methods=['GET'])
 @token_required
 def get_current_weather(current_user):
     """Get current weather data."""
     try:
-        weather_data = weather_manager.get_current_weather()
+        weather_data = weather_manager.get_current_weather(_weather_location(current_user))
         return jsonify({
             'success': True,
             'weather': weather_data
@@ -486,7 +624,7 @@ def get_weather_forecast(current_user):
     """Get weather forecast."""
     try:
         days = request.args.get('days', 3, type=int)
-        forecast = weather_manager.get_forecast(days)
+        forecast = weather_manager.get_forecast(days, _weather_location(current_user))
         return jsonify({
             'success': True,
             'forecast': forecast
@@ -500,7 +638,7 @@ def get_weather_forecast(current_user):
 def get_weather_alerts(current_user):
     """Get weather alerts."""
     try:
-        alerts = weather_manager.get_alerts()
+        alerts = weather_manager.get_alerts(_weather_location(current_user))
         return jsonify({
             'success': True,
             'alerts': alerts
@@ -513,69 +651,136 @@ def get_weather_alerts(current_user):
 @app.route('/api/sounds', methods=['GET'])
 @token_required
 def get_sounds(current_user):
-    """Get list of available alarm sounds."""
-    try:
-        sounds_dir = PATHS['SOUNDS_DIR']
-        sounds = []
-        for filename in os.listdir(sounds_dir):
-            if filename.endswith('.mp3'):
-                sound_id = os.path.splitext(filename)[0]
-                sounds.append({
-                    'id': sound_id,
-                    'name': sound_id.replace('-', ' ').title(),
-                    'file': filename,
-                    'isDefault': filename == alarm_manager.config.get('default_sound')
-                })
-        return jsonify({
+    """Get list of available alarm sounds from the sound index."""
+    try:
+        default_sound = alarm_manager.config.get('default_sound')
+        sounds = [{
+            'id': os.path.splitext(filename)[0],
+            'name': os.path.splitext(filename)[0].replace('-', ' ').title(),
+            'file': filename,
+            'isDefault': filename == default_sound,
+            'duration': entry['duration'],
+            'sampleRate': entry['sample_rate'],
+            'gain': entry['gain'],
+            'waveform': entry['waveform'],
+            'hash': entry['hash']
+        } for filename, entry in sound_index.entries().items()]
+
+        # The list only changes with the index or the default sound
+        etag = hashlib.sha256(f"{sound_index.version}:{default_sound}".encode()).hexdigest()[:32]
+        response = jsonify({
             'success': True,
             'sounds': sounds
         })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error getting sounds: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
+def _sound_json(filename):
+    """Sound list entry for a file name."""
+    stem = os.path.splitext(filename)[0]
+    return {
+        'id': stem,
+        'name': stem.replace('-', ' ').title(),
+        'file': filename,
+        'isDefault': filename == alarm_manager.config.get('default_sound')
+    }
+
 @app.route('/api/sounds/upload', methods=['POST'])
 @token_required
 def upload_sound(current_user):
-    """Upload a new alarm sound."""
+    """Upload a new alarm sound.
+
+    Accepts a multipart form with a 'sound' file, or the raw audio as the
+    request body with the name in the X-Filename header. The file is
+    checked and hashed here; converting and indexing it happen in the
+    background (see GET /api/sounds/uploads/<job_id>).
+    """
     try:
-        if 'sound' not in request.files:
+        if 'sound' in request.files:
+            sound_file = request.files['sound']
+            stream, filename = sound_file.stream, sound_file.filename
+        elif request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+            stream = request.stream
+            filename = request.headers.get('X-Filename') or request.args.get('filename')
+        else:
             return jsonify({'success': False, 'message': 'No sound file provided'}), 400
 
-        sound_file = request.files['sound']
-        if sound_file.filename == '':
+        if not filename:
             return jsonify({'success': False, 'message': 'No file selected'}), 400
 
-        if not sound_file.filename.endswith('.mp3'):
-            return jsonify({'success': False, 'message': 'Only MP3 files are allowed'}), 400
-
-        filename = os.path.join(PATHS['SOUNDS_DIR'], sound_file.filename)
-        sound_file.save(filename)
-
+        job = sound_uploads.receive(stream, filename)
         return jsonify({
             'success': True,
-            'sound': {
-                'id': os.path.splitext(sound_file.filename)[0],
-                'name': os.path.splitext(sound_file.filename)[0].replace('-', ' ').title(),
-                'file': sound_file.filename,
-                'isDefault': False
-            }
-        })
+            'sound': _sound_json(job['filename']),
+            'job': job
+        }), 200 if job['duplicate'] else 202
+    except UploadError as e:
+        return jsonify({'success': False, 'message': str(e)}), e.status
     except Exception as e:
         logger.error(f"Error uploading sound: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
+@app.route('/api/sounds/uploads/<job_id>', methods=['GET'])
+@token_required
+def get_sound_upload(current_user, job_id):
+    """Get the state of a sound upload job."""
+    job = sound_uploads.status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Upload not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+SOUND_MIMETYPES = {'.mp3': 'audio/mpeg', '.ogg': 'audio/ogg', '.wav': 'audio/wav'}
+# Versioned URLs (?v=<content hash>) never change, so clients keep them for a year
+SOUND_MAX_AGE = 365 * 24 * 3600
+
+@app.route('/api/sounds/<filename>', methods=['GET'])
+def stream_sound(filename):
+    """Serve a sound's bytes for previews, with Range and conditional requests.
+
+    Not behind token_required: an <audio> element cannot send the
+    Authorization header, and the sounds are shared device assets.
+    """
+    # Only indexed files are served, which also rules out path tricks
+    entry = sound_index.get(filename)
+    if entry is None:
+        return jsonify({'success': False, 'message': 'Sound not found'}), 404
+
+    path = os.path.abspath(os.path.join(sound_index.sounds_dir, filename))
+    versioned = request.args.get('v') == entry['hash']
+    # Range, If-None-Match and If-Range are handled by send_file; the body
+    # goes out through the server's file wrapper (sendfile) where available
+    response = send_file(
+        path,
+        mimetype=SOUND_MIMETYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream'),
+        conditional=True,
+        etag=entry['hash'],
+        max_age=SOUND_MAX_AGE if versioned else None
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        # Unversioned URLs may change on disk; revalidate (a 304) every time
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    return response
+
 @app.route('/api/sounds/<sound_id>/default', methods=['POST'])
 @token_required
 def set_default_sound(current_user, sound_id):
     """Set default alarm sound."""
     try:
-        sounds_dir = PATHS['SOUNDS_DIR']
-        sound_file = f"{sound_id}.mp3"
-        if not os.path.exists(os.path.join(sounds_dir, sound_file)):
+        # Uploads may be stored as .ogg or .wav, so match the id against the index
+        sound_file = next((f for f in sound_index.entries() if os.path.splitext(f)[0] == sound_id), None)
+        if sound_file is None:
             return jsonify({'success': False, 'message': 'Sound not found'}), 404
 
         alarm_manager.update_config({'default_sound': sound_file})
+        _publish_to_user_devices(get_request_db(), current_user['id'], 'settings', {'default_sound': sound_file})
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error setting default sound: {str(e)}")
@@ -598,6 +803,7 @@ def update_settings(current_user):
     try:
         new_settings = request.json
         alarm_manager.update_config(new_settings)
+        _publish_to_user_devices(get_request_db(), current_user['id'], 'settings', new_settings)
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error updating settings: {str(e)}")
@@ -609,6 +815,7 @@ def reset_settings(current_user):
     """Reset settings to defaults."""
     try:
         alarm_manager.config = alarm_manager._load_config()
+        _publish_to_user_devices(get_request_db(), current_user['id'], 'settings', alarm_manager.config)
         return jsonify({
             'success': True,
             'settings': alarm_manager.config
@@ -617,13 +824,214 @@ def reset_settings(current_user):
         logger.error(f"Error resetting settings: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 400
 
+# Light pattern endpoints
+def _light_pattern_json(pattern):
+    """Serialize a stored light pattern for the website."""
+    return {
+        'id': f"user:{pattern.id}",
+        'name': pattern.name,
+        'type': 'spec',
+        'spec': json.loads(pattern.spec),
+        'hash': pattern.content_hash,
+        'updated_at': pattern.updated_at.isoformat() if pattern.updated_at else None
+    }
+
+def _resolve_light_pattern(db, current_user, payload):
+    """Resolve a pattern payload to (settings value, pattern for the strip).
+
+    Built-in patterns are referenced by name and stored patterns as
+    'user:<id>'; anything else is an inline spec, validated and compiled
+    here. The settings value is None for inline specs.
+    """
+    pattern_id = str(payload.get('id', ''))
+    if pattern_id in PATTERNS and 'keyframes' not in payload:
+        return pattern_id, pattern_id
+    if pattern_id.startswith('user:'):
+        pattern = db.query(LightPattern).filter_by(
+            id=int(pattern_id[5:]),
+            user_id=current_user['id']
+        ).first()
+        if not pattern:
+            raise LookupError('Pattern not found')
+        return pattern_id, json.loads(pattern.spec)
+
+    spec = normalize(payload.get('spec') or payload)
+    compile_spec(spec, LED_COUNT)
+    return None, spec
+
+def _save_light_pattern(db, current_user, name, spec, pattern=None):
+    """Store a spec for the user, reusing an identical pattern if one exists."""
+    spec = normalize(spec)
+    content_hash = compile_spec(spec, LED_COUNT).digest
+    if pattern is None:
+        pattern = db.query(LightPattern).filter_by(
+            user_id=current_user['id'],
+            content_hash=content_hash
+        ).first()
+        if pattern:
+            return pattern
+        pattern = LightPattern(user_id=current_user['id'])
+        db.add(pattern)
+
+    pattern.name = name
+    pattern.spec = json.dumps(spec)
+    pattern.content_hash = content_hash
+    db.commit()
+    return pattern
+
+@app.route('/api/lights/patterns', methods=['GET'])
+@token_required
+def get_light_patterns(current_user):
+    """Get built-in and saved light patterns."""
+    try:
+        db = get_request_db()
+        saved = db.query(LightPattern).filter_by(user_id=current_user['id']).all()
+        return jsonify({
+            'success': True,
+            'patterns': PRESETS + [_light_pattern_json(pattern) for pattern in saved]
+        })
+    except Exception as e:
+        logger.error(f"Error getting light patterns: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/lights/patterns', methods=['POST'])
+@token_required
+def create_light_pattern(current_user):
+    """Save a light pattern spec."""
+    try:
+        data = request.json
+        db = get_request_db()
+        pattern = _save_light_pattern(db, current_user, data.get('name', 'Custom'), data.get('spec') or data)
+        return jsonify({
+            'success': True,
+            'pattern': _light_pattern_json(pattern)
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error saving light pattern: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/lights/patterns/<int:pattern_id>', methods=['PUT'])
+@token_required
+def update_light_pattern(current_user, pattern_id):
+    """Update a saved light pattern."""
+    try:
+        data = request.json
+        db = get_request_db()
+        pattern = db.query(LightPattern).filter_by(
+            id=pattern_id,
+            user_id=current_user['id']
+        ).first()
+
+        if not pattern:
+            return jsonify({'success': False, 'message': 'Pattern not found'}), 404
+
+        spec = data.get('spec') or json.loads(pattern.spec)
+        pattern = _save_light_pattern(db, current_user, data.get('name', pattern.name), spec, pattern)
+        return jsonify({
+            'success': True,
+            'pattern': _light_pattern_json(pattern)
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error updating light pattern: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/lights/patterns/<int:pattern_id>', methods=['DELETE'])
+@token_required
+def delete_light_pattern(current_user, pattern_id):
+    """Delete a saved light pattern."""
+    try:
+        db = get_request_db()
+        pattern = db.query(LightPattern).filter_by(
+            id=pattern_id,
+            user_id=current_user['id']
+        ).first()
+
+        if not pattern:
+            return jsonify({'success': False, 'message': 'Pattern not found'}), 404
+
+        # Fall back to the default pattern if the deleted one was in use
+        settings = db.query(UserSettings).filter_by(user_id=current_user['id']).first()
+        if settings and settings.rgb_pattern == f"user:{pattern.id}":
+            settings.rgb_pattern = 'default'
+
+        db.delete(pattern)
+        db.commit()
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Error deleting light pattern: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/lights/preview', methods=['POST'])
+@token_required
+def preview_light_pattern(current_user):
+    """Show a pattern on the strip until stopped."""
+    try:
+        db = get_request_db()
+        _, pattern = _resolve_light_pattern(db, current_user, request.json)
+        hardware_controller.start_light_sequence(pattern, restart=True)
+        return jsonify({'success': True})
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error previewing light pattern: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/lights/preview/stop', methods=['POST'])
+@token_required
+def stop_light_preview(current_user):
+    """Stop a running pattern preview."""
+    try:
+        hardware_controller.stop_light_sequence()
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Error stopping light preview: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/lights/pattern', methods=['POST'])
+@token_required
+def apply_light_pattern(current_user):
+    """Make a pattern the user's alarm light pattern."""
+    try:
+        data = request.json
+        db = get_request_db()
+        setting, pattern = _resolve_light_pattern(db, current_user, data)
+        if setting is None:
+            # Inline (custom) patterns are saved so devices can sync them
+            saved = _save_light_pattern(db, current_user, data.get('name', 'Custom'), pattern)
+            setting = f"user:{saved.id}"
+
+        settings = db.query(UserSettings).filter_by(user_id=current_user['id']).first()
+        if settings:
+            settings.rgb_pattern = setting
+            db.commit()
+        alarm_manager.update_config({'rgb_pattern': pattern})
+        _publish_to_user_devices(db, current_user['id'], 'settings', {'rgb_pattern': pattern})
+
+        return jsonify({
+            'success': True,
+            'pattern': setting
+        })
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error applying light pattern: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # Device management endpoints
 @app.route('/api/devices', methods=['GET'])
 @token_required
 def get_devices(current_user):
     """Get all devices for the user."""
     try:
-        db = next(get_db())
+        db = get_request_db()
         devices = db.query(Device).filter_by(user_id=current_user['id']).all()
         return jsonify({
             'success': True,
@@ -650,14 +1058,20 @@ def register_device(current_user):
         device_id = data.get('device_id')
         name = data.get('name', f"Smart Alarm {device_id[-6:]}")
         model = data.get('model', 'RPi3')
+        pairing_code = data.get('pairing_code')
 
         if not device_id:
             return jsonify({
                 'success': False,
                 'message': 'Device ID is required'
             }), 400
+        if not pairing_code or not isinstance(pairing_code, str):
+            return jsonify({
+                'success': False,
+                'message': 'Pairing code is required'
+            }), 400
 
-        db = next(get_db())
+        db = get_request_db()
         
         # Check if device already exists
         existing_device = db.query(Device).filter_by(device_id=device_id).first()
@@ -674,11 +1088,14 @@ def register_device(current_user):
             name=name,
             model=model,
             status='offline',
-            firmware_version='1.0.0'
+            firmware_version='1.0.0',
+            secret_hash=_hash_device_secret(pairing_code)
         )
         
         db.add(device)
         db.commit()
+        # Wakes the device waiting in check_device
+        change_feed.publish(device_id, 'registered', session=db)
 
         return jsonify({
             'success': True,
@@ -701,7 +1118,7 @@ def update_device(current_user, device_id):
     """Update device information."""
     try:
         data = request.json
-        db = next(get_db())
+        db = get_request_db()
         
         device = db.query(Device).filter_by(
             device_id=device_id,
@@ -721,6 +1138,12 @@ def update_device(current_user, device_id):
             device.status = data['status']
         if 'firmware_version' in data:
             device.firmware_version = data['firmware_version']
+        if 'latitude' in data and 'longitude' in data:
+            device.latitude = data['latitude']
+            device.longitude = data['longitude']
+        # Re-pair, e.g. after the device was reset and shows a new code
+        if data.get('pairing_code'):
+            device.secret_hash = _hash_device_secret(str(data['pairing_code']))
         
         device.last_seen = datetime.utcnow()
         db.commit()
@@ -742,48 +1165,96 @@ def update_device(current_user, device_id):
         logger.error(f"Error updating device: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Changes committed just before a sync may carry slightly earlier timestamps,
+# so the returned cursor overlaps the previous window by this much
+SYNC_CURSOR_OVERLAP = timedelta(seconds=5)
+
+def _parse_since(value):
+    """Parse a sync cursor (ISO timestamp) or return None for a full sync.
+
+    Timestamps with an offset ('Z', '+02:00') are converted to naive UTC,
+    the form updated_at is stored in.
+    """
+    if not value:
+        return None
+    try:
+        since = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except (TypeError, ValueError, AttributeError):
+        raise ValueError(f"Invalid since cursor: {value}")
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
 @app.route('/api/devices/<device_id>/sync', methods=['POST'])
 @token_required
 def sync_device(current_user, device_id):
-    """Sync device settings and alarms."""
+    """Sync device settings and alarms.
+
+    Everything comes back from one query: the device joined to the user's
+    settings, their stored light pattern (if one is selected) and the
+    device's alarms. With a 'since' cursor from the previous sync, only
+    settings and alarms updated after it are returned; 'alarm_ids' lists
+    every current alarm so the device can drop deleted ones. Unchanged
+    alarms are filtered in the query and only contribute their IDs.
+    """
     try:
-        db = next(get_db())
-        device = db.query(Device).filter_by(
-            device_id=device_id,
-            user_id=current_user['id']
-        ).first()
-        
-        if not device:
+        data = request.get_json(silent=True) or {}
+        since = _parse_since(data.get('since') or request.args.get('since'))
+        cursor = datetime.utcnow() - SYNC_CURSOR_OVERLAP
+
+        # Full rows only for alarms changed since the cursor (joined on the primary key)
+        changed_alarm = aliased(Alarm)
+        changed_join = changed_alarm.id == Alarm.id
+        if since is not None:
+            changed_join = and_(changed_join, changed_alarm.updated_at > since)
+
+        db = get_request_db()
+        rows = (db.query(Device, UserSettings, LightPattern, Alarm.id, changed_alarm)
+                .outerjoin(UserSettings, UserSettings.user_id == Device.user_id)
+                .outerjoin(LightPattern, and_(
+                    LightPattern.user_id == Device.user_id,
+                    literal('user:').concat(cast(LightPattern.id, String)) == UserSettings.rgb_pattern))
+                .outerjoin(Alarm, Alarm.device_id == Device.id)
+                .outerjoin(changed_alarm, changed_join)
+                .filter(Device.device_id == device_id, Device.user_id == current_user['id'])
+                .order_by(Alarm.time, Alarm.id)
+                .all())
+
+        if not rows:
             return jsonify({
                 'success': False,
                 'message': 'Device not found'
             }), 404
 
-        # Get user settings and alarms
-        settings = db.query(UserSettings).filter_by(user_id=current_user['id']).first()
-        alarms = db.query(Alarm).filter_by(device_id=device.id).all()
+        _, settings, pattern, _, _ = rows[0]
 
-        return jsonify({
-            'success': True,
-            'settings': {
+        def changed(row):
+            return row is not None and (since is None or (row.updated_at or datetime.min) > since)
+
+        settings_payload = None
+        if settings is not None and (changed(settings) or changed(pattern)):
+            settings_payload = {
                 'theme': settings.theme,
                 'time_format': settings.time_format,
                 'date_format': settings.date_format,
                 'temperature_unit': settings.temperature_unit,
                 'default_sound': settings.default_sound,
                 'rgb_enabled': settings.rgb_enabled,
-                'rgb_pattern': settings.rgb_pattern
-            },
-            'alarms': [{
-                'id': alarm.id,
-                'title': alarm.title,
-                'time': alarm.time,
-                'days': alarm.days,
-                'sound_file': alarm.sound_file,
-                'is_enabled': alarm.is_enabled
-            } for alarm in alarms]
+                'rgb_pattern': settings.rgb_pattern,
+                'rgb_pattern_spec': json.loads(pattern.spec) if pattern else None
+            }
+
+        return jsonify({
+            'success': True,
+            'cursor': cursor.isoformat(),
+            'full': since is None,
+            'settings': settings_payload,
+            'alarms': [alarm_to_dict(alarm, device_id) for *_, alarm in rows if alarm is not None],
+            'alarm_ids': [alarm_id for _, _, _, alarm_id, _ in rows if alarm_id is not None]
         })
 
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"Error syncing device: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -794,7 +1265,7 @@ def sync_device(current_user, device_id):
 def get_device_alarms(current_user, device_id):
     """Get all alarms for a specific device."""
     try:
-        db = next(get_db())
+        db = get_request_db()
         device = db.query(Device).filter_by(
             device_id=device_id,
             user_id=current_user['id']
@@ -823,5 +1294,152 @@ def get_device_alarms(current_user, device_id):
         logger.error(f"Error getting device alarms: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Longest a long-poll request is held open, and the SSE keepalive interval
+MAX_LONG_POLL = 55.0
+FEED_KEEPALIVE = 15.0
+# Device tokens are renewed with the device secret, so they can be short-lived
+DEVICE_TOKEN_EXPIRATION = timedelta(days=1)
+
+def _hash_device_secret(secret):
+    """Digest of a device's pairing code, as stored on the device row."""
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def _device_token(device_id):
+    """A token that lets a device follow its own change feed."""
+    return jwt.encode({
+        'device_id': device_id,
+        'type': 'device',
+        'exp': datetime.utcnow() + DEVICE_TOKEN_EXPIRATION
+    }, JWT_SECRET, algorithm="HS256")
+
+@app.route('/api/devices/check/<device_id>', methods=['GET'])
+def check_device(device_id):
+    """Check whether a device is registered, optionally waiting for it (?wait=seconds).
+
+    An unregistered device holds one request open instead of polling;
+    register_device wakes it. Answers 200 once registered, 404 otherwise.
+    Only existence is reported: feed tokens come from issue_device_token.
+    """
+    try:
+        wait = min(max(request.args.get('wait', 0.0, type=float), 0.0), MAX_LONG_POLL)
+        # Taken before the lookup so a registration in between is not missed
+        cursor = change_feed.cursor()
+        db = get_request_db()
+        query = db.query(Device.id).filter(Device.device_id == device_id)
+        registered = query.first() is not None
+        # Don't hold a pooled connection while waiting
+        db.close()
+
+        if not registered and wait and change_feed.wait(device_id, cursor, timeout=wait):
+            registered = query.first() is not None
+        if not registered:
+            return jsonify({'success': False, 'message': 'Device not registered'}), 404
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Error checking device: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/devices/<device_id>/token', methods=['POST'])
+def issue_device_token(device_id):
+    """Exchange a device's secret for a token that opens its change feed.
+
+    The secret is the pairing code the device shows on its registration
+    screen; the owner entered it when registering the device, so only a
+    device its owner paired can follow the feed.
+    """
+    try:
+        secret = (request.get_json(silent=True) or {}).get('secret')
+        db = get_request_db()
+        device = db.query(Device.secret_hash).filter(Device.device_id == device_id).first()
+        if (not isinstance(secret, str) or device is None or not device.secret_hash
+                or not hmac.compare_digest(device.secret_hash, _hash_device_secret(secret))):
+            return jsonify({'success': False, 'message': 'Invalid device credentials'}), 401
+        return jsonify({'success': True, 'device_token': _device_token(device_id)})
+    except Exception as e:
+        logger.error(f"Error issuing device token: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/devices/<device_id>/alarm/dismiss', methods=['POST'])
+@token_required
+def dismiss_device_alarm(current_user, device_id):
+    """Stop the alarm ringing on a device; delivered through its change feed."""
+    try:
+        db = get_request_db()
+        device = db.query(Device.id).filter(
+            Device.device_id == device_id,
+            Device.user_id == current_user['id']
+        ).first()
+        if device is None:
+            return jsonify({'success': False, 'message': 'Device not found'}), 404
+        change_feed.publish(device_id, 'dismiss', session=db)
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Error dismissing alarm: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/devices/<device_id>/events', methods=['GET'])
+@token_required
+@allow_device_token
+def device_events(current_user, device_id):
+    """Change feed for a device: Server-Sent Events, or a JSON long-poll.
+
+    Clients resume with the ID of the last event they saw (Last-Event-ID
+    header, or ?after= for long-polls) and receive only what they missed,
+    or a single 'resync' event if that is no longer available. SSE is used
+    when the client accepts text/event-stream; otherwise the request waits
+    up to ?timeout= seconds for events.
+    """
+    try:
+        if current_user.get('type') == 'device':
+            allowed = current_user.get('device_id') == device_id
+        else:
+            db = get_request_db()
+            allowed = db.query(Device.id).filter(
+                Device.device_id == device_id,
+                Device.user_id == current_user['id']
+            ).first() is not None
+            # Don't hold a pooled connection while waiting
+            db.close()
+        if not allowed:
+            return jsonify({'success': False, 'message': 'Device not found'}), 404
+
+        last_id = request.headers.get('Last-Event-ID') or request.args.get('after') or change_feed.cursor()
+
+        if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+            def stream(last_id):
+                yield "retry: 3000\n\n"
+                while True:
+                    events = change_feed.wait(device_id, last_id, timeout=FEED_KEEPALIVE)
+                    if not events:
+                        yield ": keepalive\n\n"
+                        continue
+                    for event in events:
+                        yield format_sse(event)
+                    last_id = events[-1]['id']
+
+            return Response(stream_with_context(stream(last_id)), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        timeout = min(max(request.args.get('timeout', 25.0, type=float), 0.0), MAX_LONG_POLL)
+        events = change_feed.wait(device_id, last_id, timeout=timeout)
+        return jsonify({
+            'success': True,
+            'events': events,
+            'last_id': events[-1]['id'] if events else last_id
+        })
+    except Exception as e:
+        logger.error(f"Error in device events: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/metrics/db', methods=['GET'])
+@token_required
+def get_db_metrics(current_user):
+    """Connection pool metrics and connections held past the leak threshold."""
+    return jsonify({
+        'success': True,
+        'pool': pool_stats(),
+        'leaks': [{'scope': scope, 'seconds': round(held, 1)} for scope, held in pool_metrics.leaks()]
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,235 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from database import SessionLocal, DeviceEvent, FeedSequence
+
+logger = logging.getLogger(__name__)
+
+# Most events one response carries; a subscriber further behind resyncs
+FEED_BACKLOG = 256
+# How often a process looks for events published by other workers
+FEED_POLL_INTERVAL = 1.0
+# Events are kept this long (the newest is always kept), pruned this often
+FEED_RETENTION = timedelta(days=1)
+FEED_PRUNE_INTERVAL = 600
+
+class _Channel:
+    """Requests in this process waiting on one device's events."""
+
+    def __init__(self, lock):
+        self.changed = threading.Condition(lock)
+        self.waiters = 0
+        self.version = 0
+
+def _to_event(row):
+    """Convert a DeviceEvent row into the event dict sent to subscribers."""
+    return {
+        'id': str(row.id),
+        'seq': row.id,
+        'type': row.event_type,
+        'data': json.loads(row.data) if row.data else None,
+        'time': row.created_at.isoformat()
+    }
+
+class ChangeFeed:
+    """Publish/subscribe of change events, one channel per device.
+
+    Events are rows in the device_events table, numbered from the single
+    feed_sequence row, so every API worker shares one sequence and a
+    subscriber can resume on any of them. Taking a number updates that
+    row, which stays locked until the event commits. Publishes are thus
+    serialised: an event never becomes visible before a lower-numbered
+    one, so reading 'id > cursor' cannot skip one. A subscriber that
+    reconnects with the last ID it saw gets exactly the events it missed;
+    if those were pruned, are more than a backlog, or the ID is unknown,
+    it gets a single 'resync' event telling it to fetch its full state
+    instead.
+
+    Publishing wakes waiting requests in the same process at once; a
+    watcher thread wakes them within FEED_POLL_INTERVAL for events other
+    workers published. A process only keeps state for channels with a
+    request waiting. API requests pass their request-scoped session to
+    publish(); it is committed but left open, as in AlarmRepository.
+    """
+
+    def __init__(self, session_factory=SessionLocal, backlog=FEED_BACKLOG, poll_interval=FEED_POLL_INTERVAL):
+        """Initialize the feed; the watcher starts with the first waiting request."""
+        self.session_factory = session_factory
+        self.backlog = backlog
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._channels = {}
+        # Highest event ID the watcher has checked (None until it starts)
+        self._seen = None
+        self._watcher = None
+        self._next_prune = 0.0
+
+    @contextmanager
+    def _session(self, session=None):
+        """A session that commits on success; closed afterwards unless borrowed."""
+        db = session if session is not None else self.session_factory()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if session is None:
+                db.close()
+
+    def _latest(self, db):
+        """ID of the most recent event (0 when there are none)."""
+        return db.query(func.max(DeviceEvent.id)).scalar() or 0
+
+    def cursor(self):
+        """ID of the most recent event on any channel (where a new subscriber starts)."""
+        with self._session() as db:
+            return str(self._latest(db))
+
+    def _next_id(self, db):
+        """Take the next event ID; the counter row stays locked until db commits."""
+        taken = db.query(FeedSequence).filter(FeedSequence.id == 1).update(
+            {FeedSequence.value: FeedSequence.value + 1}, synchronize_session=False)
+        if not taken:
+            # Schema from create_all rather than the migrations
+            db.add(FeedSequence(id=1, value=self._latest(db) + 1))
+            db.flush()
+        return db.query(FeedSequence.value).filter(FeedSequence.id == 1).scalar()
+
+    def publish(self, channel, event_type, data=None, session=None):
+        """Append an event to a channel and wake its subscribers. Returns the event."""
+        with self._session(session) as db:
+            row = DeviceEvent(
+                id=self._next_id(db),
+                device_id=channel,
+                event_type=event_type,
+                data=json.dumps(data) if data is not None else None,
+                created_at=datetime.utcnow()
+            )
+            db.add(row)
+            db.flush()
+            event = _to_event(row)
+            if time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + FEED_PRUNE_INTERVAL
+                self._prune(db, row.id)
+        self._notify([channel])
+        logger.debug(f"Published {event_type} event {event['id']} to {channel}")
+        return event
+
+    def _prune(self, db, newest):
+        """Delete events past the retention period, keeping the newest."""
+        db.query(DeviceEvent).filter(
+            DeviceEvent.created_at < datetime.utcnow() - FEED_RETENTION,
+            DeviceEvent.id < newest
+        ).delete(synchronize_session=False)
+
+    def _notify(self, channels):
+        """Wake the requests in this process waiting on any of channels."""
+        with self._lock:
+            for channel in channels:
+                state = self._channels.get(channel)
+                if state is not None:
+                    state.version += 1
+                    state.changed.notify_all()
+
+    def _parse(self, last_id):
+        """Sequence number of an event ID, or None."""
+        value = str(last_id or '')
+        return int(value) if value.isdigit() else None
+
+    def _after(self, channel, seq):
+        """Events on a channel after seq, or a single 'resync' event."""
+        with self._session() as db:
+            first, latest = db.query(func.min(DeviceEvent.id), func.max(DeviceEvent.id)).one()
+            latest = latest or 0
+            # Unknown ID, or events after it were pruned
+            if seq is None or seq > latest or (first is not None and seq < first - 1):
+                return [self._resync(latest)]
+            rows = (db.query(DeviceEvent)
+                    .filter(DeviceEvent.device_id == channel, DeviceEvent.id > seq)
+                    .order_by(DeviceEvent.id)
+                    .limit(self.backlog + 1)
+                    .all())
+            if len(rows) > self.backlog:
+                return [self._resync(latest)]
+            return [_to_event(row) for row in rows]
+
+    def _resync(self, latest):
+        """Event telling a subscriber to fetch its full state and resume from latest."""
+        return {'id': str(latest), 'seq': latest, 'type': 'resync', 'data': None,
+                'time': datetime.utcnow().isoformat()}
+
+    def _start_watcher(self):
+        """Start the watcher thread if it isn't running."""
+        if self._seen is None:
+            with self._session() as db:
+                latest = self._latest(db)
+            with self._lock:
+                if self._seen is None:
+                    self._seen = latest
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='change-feed', daemon=True)
+                self._watcher.start()
+
+    def _watch(self):
+        """Wake waiting requests for events published by other workers."""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._channels:
+                    continue
+                seen = self._seen
+            try:
+                with self._session() as db:
+                    rows = (db.query(DeviceEvent.id, DeviceEvent.device_id)
+                            .filter(DeviceEvent.id > seen)
+                            .order_by(DeviceEvent.id)
+                            .all())
+            except Exception as e:
+                logger.error(f"Error checking the change feed: {str(e)}")
+                continue
+            if rows:
+                with self._lock:
+                    self._seen = max(self._seen, rows[-1].id)
+                self._notify({row.device_id for row in rows})
+
+    def wait(self, channel, last_id=None, timeout=25.0):
+        """Block until a channel has events after last_id, or timeout. Returns the list (maybe empty).
+
+        Without last_id the subscriber starts from now and only sees new events.
+        """
+        deadline = time.monotonic() + timeout
+        seq = self._parse(self.cursor() if last_id is None else last_id)
+        with self._lock:
+            state = self._channels.get(channel)
+            if state is None:
+                state = self._channels[channel] = _Channel(self._lock)
+            state.waiters += 1
+        try:
+            self._start_watcher()
+            while True:
+                # Read before querying so a publish in between still wakes us
+                with self._lock:
+                    version = state.version
+                events = self._after(channel, seq)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                with self._lock:
+                    state.changed.wait_for(lambda: state.version != version, timeout=remaining)
+        finally:
+            with self._lock:
+                state.waiters -= 1
+                if not state.waiters:
+                    del self._channels[channel]
+
+def format_sse(event):
+    """Encode an event for a text/event-stream response."""
+    payload = json.dumps({'type': event['type'], 'data': event['data'], 'time': event['time']})
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
@@ -0,0 +1,67 @@
+import time
+from datetime import datetime, timedelta
+
+class SystemClock:
+    """Wall and monotonic time from the operating system."""
+
+    def now(self):
+        """Current local wall-clock time (naive datetime)."""
+        return datetime.now()
+
+    def time(self):
+        """Current wall-clock time as a UNIX timestamp."""
+        return time.time()
+
+    def monotonic(self):
+        """Monotonic seconds; never jumps with wall-clock changes."""
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """Block for the given number of seconds."""
+        if seconds > 0:
+            time.sleep(seconds)
+
+class FakeClock:
+    """Manually driven clock for exercising the scheduler without waiting.
+
+    Wall time follows the process timezone (set TZ and call time.tzset()
+    to simulate DST transitions).
+    """
+
+    def __init__(self, start=None):
+        """Initialize the clock at `start` (naive local datetime) or now."""
+        self._wall = (start or datetime.now()).timestamp()
+        self._monotonic = 0.0
+
+    def now(self):
+        return datetime.fromtimestamp(self._wall)
+
+    def time(self):
+        return self._wall
+
+    def monotonic(self):
+        return self._monotonic
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """Let time pass normally (both clocks move together)."""
+        if isinstance(seconds, timedelta):
+            seconds = seconds.total_seconds()
+        self._wall += seconds
+        self._monotonic += seconds
+
+    def stall(self, seconds):
+        """Simulate the main loop blocking for `seconds` (e.g. a hung HTTP call)."""
+        self.advance(seconds)
+
+    def suspend(self, seconds):
+        """Simulate system suspend: wall time moves, monotonic time does not."""
+        if isinstance(seconds, timedelta):
+            seconds = seconds.total_seconds()
+        self._wall += seconds
+
+    def set_wall(self, when):
+        """Step the wall clock to `when` (NTP correction or manual change)."""
+        self._wall = when.timestamp()
@@ -1,26 +1,207 @@
 import os
+import time
+import logging
+import threading
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, Index, Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from werkzeug.security import generate_password_hash, check_password_hash
 from urllib.parse import quote_plus
-from config import DB_HOST, DB_NAME, DB_USER, DB_PASS
 
-# Properly escape special characters in the password
-DB_PASS_ESCAPED = quote_plus(DB_PASS)
+logger = logging.getLogger(__name__)
 
-# Database URL with escaped password
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS_ESCAPED}@{DB_HOST}/{DB_NAME}"
+def _mysql_url():
+    """MySQL URL built from the credentials in config."""
+    from config import DB_HOST, DB_NAME, DB_USER, DB_PASS
+    # Properly escape special characters in the password
+    return f"mysql+pymysql://{DB_USER}:{quote_plus(DB_PASS)}@{DB_HOST}/{DB_NAME}"
+
+# e.g. sqlite:////var/lib/smart-alarm/alarm.db or sqlite:// (in memory);
+# without it the MySQL server from config is used
+DATABASE_URL = os.getenv('DATABASE_URL') or _mysql_url()
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    'foreign_keys': 'ON',
+    'synchronous': 'NORMAL',  # Safe with WAL; only the last transaction can be lost on power failure
+    'busy_timeout': os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'),
+    'cache_size': '-8000',  # KiB
+    'temp_store': 'MEMORY',
+    'mmap_size': str(64 * 1024 * 1024)
+}
+
+# Connection pool tuning
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+POOL_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Below MySQL's wait_timeout, so idle connections are replaced before the server drops them
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# Connections held longer than this are reported as leaked
+LEAK_SECONDS = float(os.getenv('DB_LEAK_SECONDS', '30'))
+
+class PoolMetrics:
+    """Counters for the connection pool, plus tracking of who holds each connection.
+
+    Every checkout is recorded with the thread and the current scope (set
+    by the API to the request endpoint), so connections still held when a
+    request ends, or for longer than LEAK_SECONDS, can be reported.
+    """
+
+    def __init__(self):
+        """Initialize empty counters."""
+        self.checkouts = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._held = {}
+        self._lock = threading.Lock()
+        self._scope = threading.local()
+
+    def record_wait(self, seconds, timed_out=False):
+        """Record the time one checkout waited for a free connection."""
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def on_checkout(self, connection_record, overflowed):
+        """Record a connection leaving the pool."""
+        with self._lock:
+            self.checkouts += 1
+            if overflowed:
+                self.overflow_events += 1
+            self._held[id(connection_record)] = (threading.get_ident(), getattr(self._scope, 'name', None),
+                                                 time.monotonic())
+
+    def on_checkin(self, connection_record):
+        """Record a connection returning to the pool."""
+        with self._lock:
+            self._held.pop(id(connection_record), None)
+
+    def begin_scope(self, name):
+        """Start a scope (e.g. a request) on this thread."""
+        self._scope.name = name
+        self._scope.started = time.monotonic()
+
+    def end_scope(self):
+        """End this thread's scope. Returns (scope, seconds held) for connections it still holds."""
+        name = getattr(self._scope, 'name', None)
+        started = getattr(self._scope, 'started', None)
+        self._scope.name = self._scope.started = None
+        if started is None:
+            return []
+        now, thread = time.monotonic(), threading.get_ident()
+        with self._lock:
+            return [(name, now - since) for owner, scope, since in self._held.values()
+                    if owner == thread and since >= started]
+
+    def leaks(self, older_than=LEAK_SECONDS):
+        """(scope, seconds held) for every connection checked out longer than older_than."""
+        now = time.monotonic()
+        with self._lock:
+            return [(scope, now - since) for _, scope, since in self._held.values() if now - since > older_than]
+
+    def stats(self, pool):
+        """Snapshot of the counters and the pool's current state."""
+        with self._lock:
+            return {
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+                'checkouts': self.checkouts,
+                'overflow_events': self.overflow_events,
+                'timeouts': self.timeouts,
+                'wait_ms_mean': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_ms_max': round(self.wait_max * 1000, 3),
+                'held_over_leak_threshold': sum(1 for _, _, since in self._held.values()
+                                                if time.monotonic() - since > LEAK_SECONDS)
+            }
+
+pool_metrics = PoolMetrics()
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except Exception:
+            timed_out = True
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start, timed_out)
+
+def _is_memory(url):
+    """Whether a SQLite URL names an in-memory database."""
+    return url.database in (None, '', ':memory:') or 'mode=memory' in str(url)
+
+def create_db_engine(url=DATABASE_URL):
+    """Create an engine for url with pooling suited to its backend."""
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(
+            url,
+            poolclass=MeteredQueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+
+    memory = _is_memory(url)
+    # An in-memory database lives in exactly one connection, so threads take
+    # turns on it; a file database keeps a pool of connections for reuse
+    # (there is no server to time idle ones out)
+    sqlite_engine = create_engine(
+        url,
+        poolclass=MeteredQueuePool,
+        pool_size=1 if memory else POOL_SIZE,
+        max_overflow=0 if memory else POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        # Connections move between threads, one at a time, via the pool
+        connect_args={'check_same_thread': False}
+    )
+
+    @event.listens_for(sqlite_engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not memory:
+            # Readers no longer block the writer (or each other)
+            cursor.execute("PRAGMA journal_mode=WAL")
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return sqlite_engine
 
 try:
     # Create SQLAlchemy engine and session
-    engine = create_engine(DATABASE_URL)
+    engine = create_db_engine()
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 except Exception as e:
     print(f"Error creating database engine: {str(e)}")
     raise
 
+@event.listens_for(engine, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.on_checkout(connection_record, engine.pool.checkedout() > engine.pool.size())
+
+@event.listens_for(engine, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.on_checkin(connection_record)
+
+def pool_stats():
+    """Connection pool metrics (see PoolMetrics.stats)."""
+    return pool_metrics.stats(engine.pool)
+
 # Create base class for declarative models
 Base = declarative_base()
 
@@ -44,6 +225,7 @@ class User(Base):
     alarms = relationship("Alarm", back_populates="user")
     settings = relationship("UserSettings", back_populates="user", uselist=False)
     devices = relationship("Device", back_populates="user")
+    light_patterns = relationship("LightPattern", back_populates="user")
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -53,6 +235,7 @@ class User(Base):
 
 class VerificationToken(Base):
     __tablename__ = "verification_tokens"
+    __table_args__ = (Index('ix_verification_tokens_token_is_used', 'token', 'is_used'),)
 
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String(255), unique=True, index=True)
@@ -69,6 +252,7 @@ class VerificationToken(Base):
 
 class PasswordResetToken(Base):
     __tablename__ = "password_reset_tokens"
+    __table_args__ = (Index('ix_password_reset_tokens_token_is_used', 'token', 'is_used'),)
 
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String(255), unique=True, index=True)
@@ -93,6 +277,7 @@ class Alarm(Base):
     days = Column(String(50))  # Comma-separated days
     sound_file = Column(String(255))
     is_enabled = Column(Boolean, default=True)
+    options = Column(Text)  # Other alarm settings as JSON (see alarm_store)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     device_id = Column(Integer, ForeignKey("devices.id"))
@@ -101,6 +286,12 @@ class Alarm(Base):
     user = relationship("User", back_populates="alarms")
     device = relationship("Device", back_populates="alarms")
 
+    # Per-device and per-user listings, in time order (migration 0003)
+    __table_args__ = (
+        Index('ix_alarms_device_id_time', 'device_id', 'time', 'id'),
+        Index('ix_alarms_user_id_time', 'user_id', 'time', 'id'),
+    )
+
 class UserSettings(Base):
     __tablename__ = "user_settings"
 
@@ -130,6 +321,9 @@ class Device(Base):
     status = Column(String(20))  # online/offline/error
     last_seen = Column(DateTime)
     firmware_version = Column(String(20))
+    latitude = Column(Float, nullable=True)  # Used to key shared weather lookups
+    longitude = Column(Float, nullable=True)
+    secret_hash = Column(String(64), nullable=True)  # SHA-256 of the pairing code the device trades for feed tokens
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -137,6 +331,39 @@ class Device(Base):
     user = relationship("User", back_populates="devices")
     alarms = relationship("Alarm", back_populates="device")
 
+    __table_args__ = (Index('ix_devices_device_id_user_id', 'device_id', 'user_id'),)
+
+class LightPattern(Base):
+    __tablename__ = "light_patterns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    name = Column(String(100))
+    spec = Column(Text)  # Canonical pattern spec as JSON (see pattern_dsl)
+    content_hash = Column(String(64), index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationship
+    user = relationship("User", back_populates="light_patterns")
+
+class DeviceEvent(Base):
+    __tablename__ = "device_events"
+
+    id = Column(Integer, primary_key=True)  # Change feed sequence number, from FeedSequence
+    device_id = Column(String(64))  # Public device ID the event is for
+    event_type = Column(String(32))
+    data = Column(Text, nullable=True)  # Event payload as JSON
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # Pruned after a retention period
+
+    __table_args__ = (Index('ix_device_events_device_id_id', 'device_id', 'id'),)
+
+class FeedSequence(Base):
+    __tablename__ = "feed_sequence"
+
+    id = Column(Integer, primary_key=True)  # Single row, id 1
+    value = Column(Integer, nullable=False, default=0)  # Last change feed event ID handed out
+
 # Database dependency
 def get_db():
     db = SessionLocal()
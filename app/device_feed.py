@@ -0,0 +1,95 @@
+import logging
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Server holds each request this long; the client waits a little longer
+POLL_TIMEOUT = 25
+REQUEST_SLACK = 10
+# Back-off after errors and after consecutive resyncs, doubling up to the maximum
+RETRY_MIN = 2
+RETRY_MAX = 60
+
+class DeviceFeed:
+    """Follows this device's change feed on the API with long-polls.
+
+    Each request resumes from the ID of the last event received, so
+    nothing is missed between polls. Events are handed to on_event(event)
+    on the feed thread. On a 401 the token is replaced by calling
+    refresh_token(), which returns a new token or None. A 'resync' makes
+    the device reload everything, so repeated resyncs are spaced out like
+    errors rather than polled back to back.
+    """
+
+    def __init__(self, base_url, device_id, token, on_event, refresh_token=None):
+        """Initialize the client; call start() to begin polling."""
+        self.url = f"{base_url}/api/devices/{device_id}/events"
+        self.token = token
+        self.on_event = on_event
+        self.refresh_token = refresh_token
+        self.last_id = None
+        self.session = requests.Session()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start polling on a background thread."""
+        self._thread = threading.Thread(target=self._run, name='device-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling (the current request is abandoned)."""
+        self._stopped.set()
+        self.session.close()
+
+    def poll(self):
+        """One long-poll. Returns the events received (maybe none)."""
+        params = {'timeout': POLL_TIMEOUT}
+        if self.last_id:
+            params['after'] = self.last_id
+        response = self.session.get(
+            self.url,
+            params=params,
+            headers={'Authorization': f"Bearer {self.token}", 'Accept': 'application/json'},
+            verify=False,  # Temporarily disable SSL verification
+            timeout=POLL_TIMEOUT + REQUEST_SLACK
+        )
+        if response.status_code == 401 and self.refresh_token:
+            token = self.refresh_token()
+            if token:
+                self.token = token
+                return []
+        response.raise_for_status()
+        data = response.json()
+        self.last_id = data.get('last_id') or self.last_id
+        return data.get('events', [])
+
+    def _run(self):
+        """Poll until stopped, backing off while the API is unreachable."""
+        delay = RETRY_MIN
+        resync_delay = 0
+        while not self._stopped.is_set():
+            try:
+                events = self.poll()
+                delay = RETRY_MIN
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.error(f"Error polling change feed: {str(e)}")
+                self._stopped.wait(delay)
+                delay = min(delay * 2, RETRY_MAX)
+                continue
+            for event in events:
+                try:
+                    self.on_event(event)
+                except Exception as e:
+                    logger.error(f"Error handling {event.get('type')} event: {str(e)}")
+            if any(event.get('type') == 'resync' for event in events):
+                # The first resync is answered at once, later ones in a row back off
+                if resync_delay:
+                    logger.warning(f"Change feed resynced again; next poll in {resync_delay}s")
+                    self._stopped.wait(resync_delay)
+                resync_delay = min(max(resync_delay * 2, RETRY_MIN), RETRY_MAX)
+            else:
+                resync_delay = 0
@@ -4,11 +4,21 @@ import logging
 import qrcode
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
+from text_cache import TextCache
+from framebuffer import create_backend
 
 logger = logging.getLogger(__name__)
 
+# Screen regions (x0, y0, x1, y1) redrawn independently
+REGIONS = {
+    'time': (10, 10, 400, 150),
+    'weather': (410, 10, 799, 150),
+    'alerts': (10, 160, 790, 280),
+    'events': (10, 290, 790, 470)
+}
+
 class Display:
-    def __init__(self):
+    def __init__(self, backend=None):
         """Initialize the display interface."""
         self.width = 800  # Display width
         self.height = 480  # Display height
@@ -19,11 +29,33 @@ class Display:
         self.image = Image.new('RGB', (self.width, self.height), self.theme['background'])
         self.draw = ImageDraw.Draw(self.image)
         
-        # Load fonts
+        # Load fonts and the rendered-text cache, with the clock digits pre-rasterised
         self.fonts = self._load_fonts()
+        self.text_cache = TextCache(self.fonts)
+        self.text_cache.warm('large')
+        
+        # Dirty-region tracking: what each region last showed, and what needs flushing
+        self._region_content = {}
+        self._dirty = []
+        self.backend = backend or create_backend()
         
         logger.info("Display interface initialized")
 
+    def _region_changed(self, region, content):
+        """Record the content for a region; False if it is identical to the last frame."""
+        if self._region_content.get(region) == content:
+            return False
+        self._region_content[region] = content
+        x0, y0, x1, y1 = REGIONS[region]
+        # Drawing boxes are inclusive; flush boxes are exclusive
+        self._dirty.append((x0, y0, x1 + 1, y1 + 1))
+        return True
+
+    def _invalidate(self):
+        """Mark the whole screen dirty and forget cached region content."""
+        self._region_content.clear()
+        self._dirty = [(0, 0, self.width, self.height)]
+
     def _load_theme(self):
         """Load theme configuration."""
         # Default theme (can be overridden by web configuration)
@@ -55,19 +87,22 @@ class Display:
     def clear(self):
         """Clear the display."""
         self.draw.rectangle([0, 0, self.width, self.height], fill=self.theme['background'])
+        self._invalidate()
 
     def update_time(self):
         """Update the time display."""
         now = datetime.now()
         time_str = now.strftime("%H:%M")
         date_str = now.strftime("%B %d, %Y")
+        if not self._region_changed('time', (time_str, date_str)):
+            return
         
         # Clear the time area
-        self.draw.rectangle([10, 10, 400, 150], fill=self.theme['background'])
+        self.draw.rectangle(REGIONS['time'], fill=self.theme['background'])
         
         # Draw time
-        self.draw.text((20, 20), time_str, font=self.fonts['large'], fill=self.theme['text_primary'])
-        self.draw.text((20, 100), date_str, font=self.fonts['medium'], fill=self.theme['text_secondary'])
+        self.text_cache.draw_tiled(self.image, (20, 20), time_str, 'large', self.theme['text_primary'])
+        self.text_cache.draw(self.image, (20, 100), date_str, 'medium', self.theme['text_secondary'])
         
         self._update_display()
 
@@ -76,17 +111,19 @@ class Display:
         if not weather_data:
             return
             
-        # Clear weather area
-        self.draw.rectangle([410, 10, 790, 150], fill=self.theme['background'])
-        
         # Draw weather information
         temp = f"{weather_data['temp_c']}°C"
         condition = weather_data['condition']['text']
         humidity = f"Humidity: {weather_data['humidity']}%"
+        if not self._region_changed('weather', (temp, condition, humidity)):
+            return
+        
+        # Clear weather area
+        self.draw.rectangle(REGIONS['weather'], fill=self.theme['background'])
         
-        self.draw.text((420, 20), temp, font=self.fonts['large'], fill=self.theme['text_primary'])
-        self.draw.text((420, 100), condition, font=self.fonts['small'], fill=self.theme['text_secondary'])
-        self.draw.text((620, 100), humidity, font=self.fonts['small'], fill=self.theme['text_secondary'])
+        self.text_cache.draw(self.image, (420, 20), temp, 'large', self.theme['text_primary'])
+        self.text_cache.draw(self.image, (420, 100), condition, 'small', self.theme['text_secondary'])
+        self.text_cache.draw(self.image, (620, 100), humidity, 'small', self.theme['text_secondary'])
         
         self._update_display()
 
@@ -95,19 +132,21 @@ class Display:
         if not alerts:
             return
             
-        # Clear alerts area
-        self.draw.rectangle([10, 160, 790, 280], fill=self.theme['background'])
-        
         # Display most recent/important alert
         alert = alerts[0]
         headline = alert['headline']
         severity = alert['severity']
+        if not self._region_changed('alerts', (headline, severity)):
+            return
+        
+        # Clear alerts area
+        self.draw.rectangle(REGIONS['alerts'], fill=self.theme['background'])
         
         # Draw alert box
-        self.draw.rectangle([10, 160, 790, 280], outline=self.theme['warning'])
-        self.draw.text((20, 170), "WEATHER ALERT", font=self.fonts['medium'], fill=self.theme['warning'])
-        self.draw.text((20, 220), headline[:80] + "..." if len(headline) > 80 else headline,
-                      font=self.fonts['small'], fill=self.theme['text_primary'])
+        self.draw.rectangle(REGIONS['alerts'], outline=self.theme['warning'])
+        self.text_cache.draw(self.image, (20, 170), "WEATHER ALERT", 'medium', self.theme['warning'])
+        self.text_cache.draw(self.image, (20, 220), headline[:80] + "..." if len(headline) > 80 else headline,
+                             'small', self.theme['text_primary'])
         
         self._update_display()
 
@@ -115,18 +154,21 @@ class Display:
         """Update upcoming events display."""
         if not events:
             return
+        
+        event_lines = tuple(f"{event['title']} - {event['time']}" for event in events[:3])
+        if not self._region_changed('events', event_lines):
+            return
             
         # Clear events area
-        self.draw.rectangle([10, 290, 790, 470], fill=self.theme['background'])
+        self.draw.rectangle(REGIONS['events'], fill=self.theme['background'])
         
         # Draw events header
-        self.draw.text((20, 300), "Upcoming Events", font=self.fonts['medium'], fill=self.theme['accent'])
+        self.text_cache.draw(self.image, (20, 300), "Upcoming Events", 'medium', self.theme['accent'])
         
         # Display up to 3 upcoming events
         y_pos = 350
-        for event in events[:3]:
-            event_text = f"{event['title']} - {event['time']}"
-            self.draw.text((20, y_pos), event_text, font=self.fonts['small'], fill=self.theme['text_secondary'])
+        for event_text in event_lines:
+            self.text_cache.draw(self.image, (20, y_pos), event_text, 'small', self.theme['text_secondary'])
             y_pos += 40
             
         self._update_display()
@@ -136,22 +178,18 @@ class Display:
         self.clear()
         
         # Draw large alarm notification
-        self.draw.text((self.width//2 - 100, self.height//2 - 50),
-                      "ALARM",
-                      font=self.fonts['large'],
-                      fill=self.theme['warning'])
+        self.text_cache.draw(self.image, (self.width//2 - 100, self.height//2 - 50),
+                             "ALARM", 'large', self.theme['warning'])
         
         # Draw alarm details
         if 'title' in config:
-            self.draw.text((self.width//2 - 150, self.height//2 + 50),
-                          config['title'],
-                          font=self.fonts['medium'],
-                          fill=self.theme['text_primary'])
+            self.text_cache.draw(self.image, (self.width//2 - 150, self.height//2 + 50),
+                                 config['title'], 'medium', self.theme['text_primary'])
             
         self._update_display()
 
-    def show_registration_screen(self, device_id):
-        """Display device registration screen with QR code."""
+    def show_registration_screen(self, device_id, pairing_code):
+        """Display device registration screen with QR code and pairing code."""
         self.clear()
         
         # Draw registration info
@@ -164,7 +202,7 @@ class Display:
                       fill=self.theme['warning'])
         
         # Generate QR code
-        registration_url = f"{os.getenv('WEBSITE_URL')}/devices/register/{device_id}"
+        registration_url = f"{os.getenv('WEBSITE_URL')}/devices/register/{device_id}?code={pairing_code}"
         qr = qrcode.QRCode(
             version=1,
             error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -190,10 +228,11 @@ class Display:
             "1. Scan this QR code with your phone",
             "2. Login or create an account",
             "3. Follow the registration process",
-            "Device ID: " + device_id[:8]  # Show only first 8 characters
+            "Device ID: " + device_id[:8],  # Show only first 8 characters
+            "Pairing code: " + pairing_code
         ]
         
-        y_pos = self.height//2 + 120
+        y_pos = self.height//2 + 100
         for instruction in instructions:
             text_bbox = self.draw.textbbox((0, 0), instruction, font=self.fonts['small'])
             text_width = text_bbox[2] - text_bbox[0]
@@ -201,23 +240,23 @@ class Display:
                           instruction,
                           font=self.fonts['small'],
                           fill=self.theme['text_secondary'])
-            y_pos += 30
+            y_pos += 26
         
         self._update_display()
 
     def _update_display(self):
-        """Update the physical display with current buffer."""
+        """Flush the dirty regions of the buffer to the physical display."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, []
         try:
-            # Here you would implement the actual display update
-            # This depends on your specific display hardware
-            # For example, using framebuffer:
-            # self.image.save('/dev/fb0', 'PNG')
-            pass
+            self.backend.write(self.image, dirty)
         except Exception as e:
             logger.error(f"Error updating display: {str(e)}")
 
     def set_theme(self, theme_config):
         """Update the display theme."""
         self.theme.update(theme_config)
+        # Cached text masks are colour-independent, so only the screen is redrawn
         self.clear()
         self._update_display() 
\ No newline at end of file
@@ -0,0 +1,168 @@
+import logging
+import threading
+from clock import SystemClock
+
+logger = logging.getLogger(__name__)
+
+# Seconds between volume updates while a ramp is running
+RAMP_STEP = 0.1
+
+# Volume curves over ramp progress u in [0, 1], returning a fraction of the range
+VOLUME_CURVES = {
+    'linear': lambda u: u,
+    'ease_in': lambda u: u * u,
+    # Equal steps in loudness rather than amplitude
+    'exponential': lambda u: (10 ** (2 * u) - 1) / 99
+}
+
+# Stage 0 plays the alarm's own sound and pattern; later stages switch after
+# `after` seconds without a dismissal
+DEFAULT_STAGES = [
+    {'after': 0, 'volume': [0.1, 0.7], 'ramp': 90, 'curve': 'exponential'},
+    {'after': 180, 'sound': 'very-loud.mp3', 'volume': [0.7, 1.0], 'ramp': 30,
+     'curve': 'linear', 'pattern': 'chase'}
+]
+
+class EscalationEngine:
+    """Runs an alarm's volume ramps and stage changes on one timer thread.
+
+    Everything the engine does is a function of seconds elapsed on the
+    monotonic clock since the alarm fired, so a late wake-up simply
+    catches up to the right stage and volume.
+    """
+
+    def __init__(self, hardware, clock=None):
+        """Initialize the engine driving a HardwareController."""
+        self.hardware = hardware
+        self.clock = clock or SystemClock()
+        self.stages = None
+        self.started = None
+        self.stage_index = None
+        self.volume = None
+        self._config = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._shutdown = False
+
+    def start(self, config, stages=None):
+        """Begin escalating an alarm described by get_current_alarm_config()."""
+        with self._lock:
+            self._stop_effects()
+            self._config = config
+            self.stages = sorted(stages or config.get('escalation') or DEFAULT_STAGES,
+                                 key=lambda stage: stage.get('after', 0))
+            self.started = self.clock.monotonic()
+            self.stage_index = None
+            self.volume = None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='escalation', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self):
+        """Dismiss the alarm: stop sound and lights."""
+        with self._lock:
+            self._stop_effects()
+            self._config = None
+            self.started = None
+        self._wake.set()
+
+    def shutdown(self):
+        """Stop the engine thread."""
+        self._shutdown = True
+        self.stop()
+        if self._thread:
+            self._thread.join()
+
+    @property
+    def active(self):
+        """Whether an alarm is currently escalating."""
+        return self.started is not None
+
+    def _stop_effects(self):
+        """Stop whatever the current stage started."""
+        if self.started is not None:
+            self.hardware.stop_alarm_sound()
+            self.hardware.stop_light_sequence()
+
+    def _stage_at(self, elapsed):
+        """Index of the stage in effect after elapsed seconds."""
+        index = 0
+        for i, stage in enumerate(self.stages):
+            if stage.get('after', 0) <= elapsed:
+                index = i
+        return index
+
+    def _resolved(self, index, key, default):
+        """A stage setting, inherited from earlier stages (then the alarm) when unset."""
+        for stage in reversed(self.stages[:index + 1]):
+            if stage.get(key):
+                return stage[key]
+        return default
+
+    def _volume_at(self, index, elapsed):
+        """Volume for a stage after elapsed seconds of the alarm."""
+        stage = self.stages[index]
+        low, high = stage.get('volume', [1.0, 1.0])
+        ramp = stage.get('ramp', 0)
+        progress = min((elapsed - stage.get('after', 0)) / ramp, 1.0) if ramp > 0 else 1.0
+        curve = VOLUME_CURVES.get(stage.get('curve', 'linear'), VOLUME_CURVES['linear'])
+        return low + (high - low) * curve(max(progress, 0.0))
+
+    def step(self):
+        """Apply the state for the current time. Returns seconds until the next change, or None."""
+        with self._lock:
+            if self.started is None:
+                return None
+            elapsed = self.clock.monotonic() - self.started
+            index = self._stage_at(elapsed)
+            volume = round(self._volume_at(index, elapsed), 3)
+
+            if index != self.stage_index:
+                self._enter_stage(index, volume)
+            elif volume != self.volume:
+                self.hardware.set_alarm_volume(volume)
+            self.volume = volume
+
+            stage = self.stages[index]
+            ramp_end = stage.get('after', 0) + stage.get('ramp', 0)
+            if elapsed < ramp_end:
+                return RAMP_STEP
+            if index + 1 < len(self.stages):
+                return max(self.stages[index + 1].get('after', 0) - elapsed, 0.0)
+            return None
+
+    def _enter_stage(self, index, volume):
+        """Switch sound (and lights) to a stage."""
+        stage = self.stages[index]
+        config = self._config
+        sound_file = self._resolved(index, 'sound', config.get('sound_file'))
+        logger.info(f"Alarm escalation stage {index}: {sound_file} at volume {volume}")
+
+        previous = self.stages[self.stage_index] if self.stage_index is not None else None
+        if previous is None or stage.get('sound'):
+            self.hardware.stop_alarm_sound()
+            # The alarm's own sound is loudness-normalised; a sound switched to
+            # by escalation plays at its raw loudness, so it really is louder
+            self.hardware.play_alarm_sound(sound_file, volume=volume, normalize=previous is None)
+        else:
+            self.hardware.set_alarm_volume(volume)
+
+        if config.get('rgb_enabled', True) and (previous is None or stage.get('pattern')):
+            pattern = self._resolved(index, 'pattern', config.get('rgb_pattern', 'default'))
+            # Replaces a sunrise ramp (or the previous stage's pattern)
+            self.hardware.start_light_sequence(pattern, restart=True)
+        self.stage_index = index
+
+    def _run(self):
+        """Timer thread: sleep until the next volume step or stage change."""
+        while not self._shutdown:
+            # Cleared before stepping so a start() or stop() during the step is not lost
+            self._wake.clear()
+            try:
+                delay = self.step()
+            except Exception as e:
+                logger.error(f"Error in alarm escalation: {str(e)}")
+                delay = None
+            self._wake.wait(delay)
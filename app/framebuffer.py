@@ -0,0 +1,173 @@
+import os
+import sys
+import mmap
+import time
+import logging
+import tempfile
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class DisplayBackend:
+    """Destination for Display frames. Subclasses push dirty boxes somewhere."""
+
+    def write(self, image, boxes):
+        """Push the given (x0, y0, x1, y1) boxes of a PIL RGB image."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources."""
+
+class NullBackend(DisplayBackend):
+    """Discards frames (no display attached)."""
+
+    def write(self, image, boxes):
+        pass
+
+class PNGBackend(DisplayBackend):
+    """Headless backend that dumps each flushed frame to a PNG (for CI)."""
+
+    def __init__(self, path='display.png'):
+        """Initialize the backend writing to path."""
+        self.path = path
+        self.frames = 0
+
+    def write(self, image, boxes):
+        tmp_path = f"{self.path}.tmp"
+        image.save(tmp_path, 'PNG')
+        os.replace(tmp_path, self.path)
+        self.frames += 1
+
+class FramebufferBackend(DisplayBackend):
+    """Memory-mapped framebuffer in the device's native pixel format.
+
+    Works on a real /dev/fbN (geometry read from sysfs) or on a regular
+    file standing in for one, given explicit geometry. Only scanlines that
+    differ from what was last written are copied into the mapping.
+    """
+
+    def __init__(self, device='/dev/fb0', width=None, height=None, bits_per_pixel=None, stride=None):
+        """Open and map the framebuffer."""
+        if width is None:
+            sysfs = f'/sys/class/graphics/{os.path.basename(device)}'
+            width, height = self._read_sysfs(sysfs, 'virtual_size', ',')
+            bits_per_pixel = self._read_sysfs(sysfs, 'bits_per_pixel')[0]
+            stride = self._read_sysfs(sysfs, 'stride')[0]
+        if bits_per_pixel not in (16, 32):
+            raise ValueError(f"Unsupported framebuffer depth: {bits_per_pixel} bpp")
+
+        self.width = width
+        self.height = height
+        self.bits_per_pixel = bits_per_pixel
+        self.stride = stride or width * bits_per_pixel // 8
+        self.dtype = np.uint16 if bits_per_pixel == 16 else np.uint32
+
+        size = self.stride * self.height
+        self._file = open(device, 'r+b' if os.path.exists(device) else 'w+b')
+        if not device.startswith('/dev/') and os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+        # Pixel view of the mapping (rows may be padded beyond width)
+        rows = np.frombuffer(self._map, dtype=np.uint8).reshape(self.height, self.stride)
+        self.pixels = rows[:, :self.width * self.bits_per_pixel // 8].view(self.dtype)
+        self.rows_written = 0
+
+    @staticmethod
+    def _read_sysfs(sysfs, name, sep=None):
+        """Read an integer framebuffer attribute from sysfs."""
+        with open(os.path.join(sysfs, name)) as f:
+            return [int(v) for v in f.read().strip().split(sep)]
+
+    def convert(self, rgb):
+        """Convert an HxWx3 uint8 RGB array to native pixels (RGB565 or XRGB8888)."""
+        r = rgb[..., 0].astype(self.dtype)
+        g = rgb[..., 1].astype(self.dtype)
+        b = rgb[..., 2].astype(self.dtype)
+        if self.bits_per_pixel == 16:
+            return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+        return (r << 16) | (g << 8) | b
+
+    def write(self, image, boxes):
+        for x0, y0, x1, y1 in boxes:
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, self.width, image.width), min(y1, self.height, image.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            native = self.convert(np.asarray(image.crop((x0, y0, x1, y1))))
+            target = self.pixels[y0:y1, x0:x1]
+            changed = np.any(native != target, axis=1)
+            if changed.any():
+                target[changed] = native[changed]
+                self.rows_written += int(changed.sum())
+
+    def close(self):
+        self.pixels = None
+        self._map.close()
+        self._file.close()
+
+def create_backend(spec=None):
+    """Create a backend from a spec: 'fb[:device]', 'png[:path]' or 'null'.
+
+    Defaults to the DISPLAY_BACKEND environment variable, then to /dev/fb0
+    when it exists.
+    """
+    spec = spec or os.getenv('DISPLAY_BACKEND')
+    if not spec:
+        spec = 'fb' if os.path.exists('/dev/fb0') else 'null'
+    kind, _, arg = spec.partition(':')
+    try:
+        if kind == 'fb':
+            return FramebufferBackend(arg or '/dev/fb0')
+        if kind == 'png':
+            return PNGBackend(arg or 'display.png')
+        if kind == 'null':
+            return NullBackend()
+        logger.error(f"Unknown display backend: {spec}")
+    except Exception as e:
+        logger.error(f"Error opening display backend {spec}: {str(e)}")
+    return NullBackend()
+
+def benchmark(frames=300, bits_per_pixel=16):
+    """Measure frames per second and CPU per frame for Display updates."""
+    from display import Display
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backend = FramebufferBackend(os.path.join(tmp_dir, 'fb'), width=800, height=480,
+                                     bits_per_pixel=bits_per_pixel)
+        display = Display(backend=backend)
+        weather = {'temp_c': 21, 'condition': {'text': 'Partly cloudy'}, 'humidity': 60}
+
+        results = {}
+        for name, changing in (('idle', False), ('changing', True)):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            for frame in range(frames):
+                if changing:
+                    weather['temp_c'] = frame % 40
+                display.update_time()
+                display.update_weather(weather)
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            results[name] = (frames / wall, cpu / frames * 1000)
+
+        full_start = time.process_time()
+        for _ in range(frames // 10 or 1):
+            backend.write(display.image, [(0, 0, 800, 480)])
+            backend.pixels[:] = 0  # Force every scanline to be rewritten
+        full_cpu = (time.process_time() - full_start) / (frames // 10 or 1) * 1000
+
+        backend.close()
+
+    for name, (fps, cpu_ms) in results.items():
+        print(f"{name:>9}: {fps:8.1f} frames/s, {cpu_ms:6.3f} ms CPU/frame")
+    print(f"full-frame {bits_per_pixel}bpp flush: {full_cpu:.3f} ms CPU")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Usage: python framebuffer.py benchmark [frames] [16|32]")
+        sys.exit(1)
+
+    benchmark(
+        frames=int(sys.argv[2]) if len(sys.argv) > 2 else 300,
+        bits_per_pixel=int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    )
@@ -1,9 +1,13 @@
 import os
-import time
 import logging
 import threading
 import pygame
-from rpi_ws281x import PixelStrip, Color
+from rpi_ws281x import PixelStrip
+from led_patterns import compile_pattern, compile_sunrise, target_fps, SUNRISE_FPS
+from led_renderer import LedRenderer, FakePixelStrip
+from pattern_dsl import compile_spec, CompiledPattern
+from sound_cache import SoundCache
+from sound_index import SoundIndex
 
 logger = logging.getLogger(__name__)
 
@@ -17,21 +21,29 @@ LED_INVERT = False   # True to invert the signal
 LED_CHANNEL = 0      # Set to '1' for GPIOs 13, 19, 41, 45 or 53
 
 class HardwareController:
-    def __init__(self):
-        """Initialize hardware components."""
-        self.sound_thread = None
+    def __init__(self, sounds_dir='sounds'):
+        """Initialize hardware components, playing sounds from sounds_dir (PATHS['SOUNDS_DIR'])."""
+        self.sound_channel = None
+        self.sounds_dir = sounds_dir
+        self.sound_index = SoundIndex(sounds_dir)
+        self.sound_cache = SoundCache(sounds_dir)
+        # Loudness normalisation of the playing sound, applied through its volume
+        self.sound_gain = 1.0
         self.light_thread = None
         self.running = False
         
-        # Initialize LED strip
+        # Initialize LED strip (LED_STRIP=fake runs without the hardware)
         try:
-            self.strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA,
+            strip_class = FakePixelStrip if os.getenv('LED_STRIP') == 'fake' else PixelStrip
+            self.strip = strip_class(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA,
                                   LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
             self.strip.begin()
+            self.renderer = LedRenderer(self.strip)
             logger.info("LED strip initialized")
         except Exception as e:
             logger.error(f"Error initializing LED strip: {str(e)}")
             self.strip = None
+            self.renderer = None
 
         # Initialize audio
         try:
@@ -40,52 +52,79 @@ class HardwareController:
         except Exception as e:
             logger.error(f"Error initializing audio: {str(e)}")
 
-    def play_alarm_sound(self, sound_file):
-        """Play alarm sound in a separate thread."""
-        if self.sound_thread and self.sound_thread.is_alive():
+    def play_alarm_sound(self, sound_file, volume=1.0, normalize=True):
+        """Play alarm sound, from preloaded PCM when it is cached.
+
+        With normalize, loud files are turned down to the index's target
+        loudness; without it the file plays as loud as it was recorded.
+        """
+        if self.sound_channel and self.sound_channel.get_busy():
             return  # Already playing
+        if pygame.mixer.music.get_busy():
+            return  # Already streaming
 
         try:
+            self.sound_gain = self.sound_index.gain(sound_file) if normalize else 1.0
+            sound = self.sound_cache.cached(sound_file)
+            if sound is not None:
+                self.sound_channel = sound.play(loops=-1)  # -1 means loop indefinitely
+                if self.sound_channel is not None:
+                    self.sound_channel.set_volume(volume * self.sound_gain)
+                    return
+
             # Construct full path to sound file
-            sound_path = os.path.join('sounds', sound_file)
+            sound_path = os.path.join(self.sounds_dir, sound_file)
             if not os.path.exists(sound_path):
                 logger.error(f"Sound file not found: {sound_path}")
                 return
 
-            self.sound_thread = threading.Thread(
-                target=self._play_sound_loop,
-                args=(sound_path,)
-            )
-            self.sound_thread.start()
+            # Not preloaded: stream it rather than wait for a full decode.
+            # The mixer streams on its own audio thread, so no thread of ours
+            pygame.mixer.music.load(sound_path)
+            pygame.mixer.music.set_volume(volume * self.sound_gain)
+            pygame.mixer.music.play(-1)  # -1 means loop indefinitely
             
         except Exception as e:
             logger.error(f"Error playing alarm sound: {str(e)}")
 
-    def _play_sound_loop(self, sound_path):
-        """Internal method to play sound in a loop."""
+    def set_alarm_volume(self, volume):
+        """Set the volume (0.0-1.0) of the playing alarm sound."""
         try:
-            pygame.mixer.music.load(sound_path)
-            pygame.mixer.music.play(-1)  # -1 means loop indefinitely
+            if self.sound_channel:
+                self.sound_channel.set_volume(volume * self.sound_gain)
+            pygame.mixer.music.set_volume(volume * self.sound_gain)
         except Exception as e:
-            logger.error(f"Error in sound loop: {str(e)}")
+            logger.error(f"Error setting alarm volume: {str(e)}")
+
+    def preload_sounds(self, sound_files):
+        """Decode sounds into the cache ahead of time (blocking; run off the main loop)."""
+        self.sound_cache.preload(sound_files)
 
     def stop_alarm_sound(self):
         """Stop playing alarm sound."""
         try:
+            if self.sound_channel:
+                self.sound_channel.stop()
+                self.sound_channel = None
             pygame.mixer.music.stop()
-            if self.sound_thread:
-                self.sound_thread.join()
         except Exception as e:
             logger.error(f"Error stopping alarm sound: {str(e)}")
 
-    def start_light_sequence(self, pattern='default'):
-        """Start LED light sequence in a separate thread."""
+    def start_light_sequence(self, pattern='default', restart=False):
+        """Start LED light sequence in a separate thread.
+
+        pattern is a built-in pattern name, a pattern spec (see pattern_dsl)
+        or an already compiled pattern.
+        With restart, a running sequence is replaced instead of kept.
+        """
         if not self.strip:
             logger.error("LED strip not initialized")
             return
 
         if self.light_thread and self.light_thread.is_alive():
-            return  # Already running
+            if not restart:
+                return  # Already running
+            self.stop_light_sequence()
 
         self.running = True
         self.light_thread = threading.Thread(
@@ -95,78 +134,49 @@ class HardwareController:
         self.light_thread.start()
 
     def _run_light_pattern(self, pattern):
-        """Internal method to run LED patterns."""
+        """Internal method to run LED patterns from precompiled frame tables."""
         try:
-            while self.running:
-                if pattern == 'default':
-                    self._pattern_rainbow_cycle()
-                elif pattern == 'pulse':
-                    self._pattern_pulse()
-                elif pattern == 'chase':
-                    self._pattern_color_chase()
-                else:
-                    self._pattern_solid_color()
+            led_count = self.strip.numPixels()
+            if isinstance(pattern, (dict, CompiledPattern)):
+                compiled = pattern if isinstance(pattern, CompiledPattern) else compile_spec(pattern, led_count)
+                frames, fps, loops = compiled.frames, compiled.fps, compiled.loops
+                name = compiled.digest[:12]
+            else:
+                frames, fps, loops = compile_pattern(pattern, led_count), target_fps(pattern), 0
+                name = pattern
+            # Python lists so each frame is a single bulk write to the strip
+            stats = self.renderer.run(frames.tolist(), fps, lambda: self.running, loops=loops or None)
+            logger.info(f"Light pattern '{name}' stopped: {stats.as_dict()}")
         except Exception as e:
             logger.error(f"Error in light pattern: {str(e)}")
         finally:
             self._clear_lights()
 
-    def _pattern_rainbow_cycle(self):
-        """Rainbow cycle pattern."""
-        for j in range(256):
-            for i in range(self.strip.numPixels()):
-                if not self.running:
-                    return
-                pixel_index = (i * 256 // self.strip.numPixels()) + j
-                self.strip.setPixelColor(i, self._wheel(pixel_index & 255))
-            self.strip.show()
-            time.sleep(0.02)
-
-    def _pattern_pulse(self):
-        """Pulsing light pattern."""
-        for brightness in range(0, 255, 5) + range(255, 0, -5):
-            if not self.running:
-                return
-            for i in range(self.strip.numPixels()):
-                self.strip.setPixelColor(i, Color(brightness, 0, 0))
-            self.strip.show()
-            time.sleep(0.02)
-
-    def _pattern_color_chase(self):
-        """Color chase pattern."""
-        colors = [Color(255, 0, 0), Color(0, 255, 0), Color(0, 0, 255)]
-        for color in colors:
-            for i in range(self.strip.numPixels()):
-                if not self.running:
-                    return
-                self.strip.setPixelColor(i, color)
-                self.strip.show()
-                time.sleep(0.05)
-
-    def _pattern_solid_color(self, color=Color(255, 0, 0)):
-        """Solid color pattern."""
-        for i in range(self.strip.numPixels()):
-            self.strip.setPixelColor(i, color)
-        self.strip.show()
-        time.sleep(0.5)
-
-    def _wheel(self, pos):
-        """Generate rainbow colors across 0-255 positions."""
-        if pos < 85:
-            return Color(pos * 3, 255 - pos * 3, 0)
-        elif pos < 170:
-            pos -= 85
-            return Color(255 - pos * 3, 0, pos * 3)
-        else:
-            pos -= 170
-            return Color(0, pos * 3, 255 - pos * 3)
+    def start_sunrise(self, duration, remaining):
+        """Start a sunrise ramp lasting duration seconds that ends in remaining seconds.
+
+        Starting late (e.g. after a reboot) joins the ramp part-way. The ramp
+        stops at the alarm time, when the alarm's own pattern takes over.
+        """
+        if not self.strip:
+            logger.error("LED strip not initialized")
+            return
+
+        frames = compile_sunrise(duration, self.strip.numPixels())
+        start = int(max(duration - remaining, 0) * SUNRISE_FPS)
+        if start >= len(frames):
+            return
+        logger.info(f"Starting sunrise: {remaining / 60:.1f} of {duration / 60:.0f} minutes remaining")
+        self.start_light_sequence(CompiledPattern('sunrise', frames[start:], SUNRISE_FPS, 1), restart=True)
 
     def _clear_lights(self):
         """Turn off all LEDs."""
         if self.strip:
-            for i in range(self.strip.numPixels()):
-                self.strip.setPixelColor(i, Color(0, 0, 0))
-            self.strip.show()
+            self.renderer.show_frame([0] * self.strip.numPixels())
+
+    def light_stats(self):
+        """Frame telemetry for the current (or last) light pattern."""
+        return self.renderer.stats.as_dict() if self.renderer else None
 
     def stop_light_sequence(self):
         """Stop LED light sequence."""
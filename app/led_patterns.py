@@ -0,0 +1,127 @@
+import logging
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Target frames per second, per pattern
+TARGET_FPS = {
+    'default': 50,
+    'pulse': 50,
+    'chase': 20,
+    'solid': 2
+}
+
+# Sunrise ramps change slowly, so a low frame rate is indistinguishable from smooth
+SUNRISE_FPS = 2
+# Perceptual level (0-255) to LED duty cycle
+GAMMA = 2.2
+GAMMA_TABLE = np.rint((np.arange(256) / 255.0) ** GAMMA * 255).astype(np.uint8)
+# Colour temperature at the start and end of a sunrise
+SUNRISE_KELVIN = (1000, 6500)
+
+def pack_rgb(r, g, b):
+    """Pack 8-bit channels into the strip's 24-bit colour (same layout as rpi_ws281x.Color)."""
+    return ((np.asarray(r, dtype=np.uint32) << 16) |
+            (np.asarray(g, dtype=np.uint32) << 8) |
+            np.asarray(b, dtype=np.uint32))
+
+def wheel(pos):
+    """Vectorised rainbow colour wheel over positions 0-255."""
+    pos = np.asarray(pos, dtype=np.int32) & 255
+    r = np.where(pos < 85, pos * 3, np.where(pos < 170, 255 - (pos - 85) * 3, 0))
+    g = np.where(pos < 85, 255 - pos * 3, np.where(pos < 170, 0, (pos - 170) * 3))
+    b = np.where(pos < 85, 0, np.where(pos < 170, (pos - 85) * 3, 255 - (pos - 170) * 3))
+    return pack_rgb(r, g, b)
+
+def _rainbow_cycle(led_count):
+    """256 frames of a rainbow rotating along the strip."""
+    offsets = np.arange(led_count) * 256 // led_count
+    return wheel(offsets[np.newaxis, :] + np.arange(256)[:, np.newaxis])
+
+def _pulse(led_count):
+    """Red brightness ramping up and back down."""
+    levels = np.concatenate([np.arange(0, 255, 5), np.arange(255, 0, -5)])
+    return np.repeat(pack_rgb(levels, 0, 0)[:, np.newaxis], led_count, axis=1)
+
+def _color_chase(led_count):
+    """Each colour in turn fills the strip one pixel per frame."""
+    colors = pack_rgb([255, 0, 0], [0, 255, 0], [0, 0, 255])
+    frames = np.empty((len(colors) * led_count, led_count), dtype=np.uint32)
+    filled = np.arange(led_count)[np.newaxis, :] <= np.arange(led_count)[:, np.newaxis]
+    for index, color in enumerate(colors):
+        # Pixels not yet reached still show the previous colour
+        frames[index * led_count:(index + 1) * led_count] = np.where(filled, color, colors[index - 1])
+    return frames
+
+def _solid(led_count, color=(255, 0, 0)):
+    """A single frame of one colour."""
+    return np.full((1, led_count), pack_rgb(*color), dtype=np.uint32)
+
+PATTERNS = {
+    'default': _rainbow_cycle,
+    'pulse': _pulse,
+    'chase': _color_chase,
+    'solid': _solid
+}
+
+# Built-in patterns as the website describes them (type drives its preview)
+PRESETS = [
+    {'id': 'default', 'name': 'Rainbow', 'type': 'rainbow_cycle'},
+    {'id': 'pulse', 'name': 'Pulse', 'type': 'pulse', 'color': '#ff0000'},
+    {'id': 'chase', 'name': 'Color Chase', 'type': 'chase', 'colors': ['#ff0000', '#00ff00', '#0000ff']},
+    {'id': 'solid', 'name': 'Solid', 'type': 'solid', 'color': '#ff0000'}
+]
+
+@lru_cache(maxsize=32)
+def compile_pattern(name, led_count):
+    """Return the frame table (frames x led_count, uint32) for a named pattern.
+
+    Tables are built once per pattern and strip length; unknown names fall
+    back to a solid colour, as before.
+    """
+    builder = PATTERNS.get(name, _solid)
+    frames = np.ascontiguousarray(builder(led_count), dtype=np.uint32)
+    frames.setflags(write=False)
+    logger.info(f"Compiled light pattern '{name}': {frames.shape[0]} frames x {led_count} LEDs")
+    return frames
+
+def target_fps(name):
+    """Target frame rate for a named pattern."""
+    return TARGET_FPS.get(name, TARGET_FPS['solid'])
+
+def kelvin_to_rgb(kelvin):
+    """Approximate RGB (0-255 floats) of a black body at the given temperatures."""
+    t = np.asarray(kelvin, dtype=np.float64) / 100.0
+    r = np.where(t <= 66, 255.0, 329.698727446 * np.power(np.maximum(t - 60, 1e-6), -0.1332047592))
+    g = np.where(t <= 66,
+                 99.4708025861 * np.log(t) - 161.1195681661,
+                 288.1221695283 * np.power(np.maximum(t - 60, 1e-6), -0.0755148492))
+    b = np.where(t >= 66, 255.0,
+                 np.where(t <= 19, 0.0, 138.5177312231 * np.log(np.maximum(t - 10, 1e-6)) - 305.0447927307))
+    return np.clip(np.stack([r, g, b], axis=-1), 0, 255)
+
+@lru_cache(maxsize=4)
+def sunrise_ramp(steps):
+    """Gamma-corrected (steps, 3) uint8 colours from darkness to full daylight.
+
+    Brightness rises linearly in perceived level while the colour warms
+    from deep red towards daylight; GAMMA_TABLE maps each level to the
+    duty cycle the LEDs need for it to look linear.
+    """
+    progress = np.linspace(0.0, 1.0, steps)
+    kelvin = SUNRISE_KELVIN[0] + (SUNRISE_KELVIN[1] - SUNRISE_KELVIN[0]) * progress
+    levels = np.rint(kelvin_to_rgb(kelvin) * progress[:, np.newaxis]).astype(np.intp)
+    ramp = GAMMA_TABLE[levels]
+    ramp.setflags(write=False)
+    return ramp
+
+@lru_cache(maxsize=4)
+def compile_sunrise(duration, led_count, fps=SUNRISE_FPS):
+    """Frame table for a sunrise lasting duration seconds at fps."""
+    ramp = sunrise_ramp(max(int(duration * fps), 1))
+    colors = pack_rgb(ramp[:, 0], ramp[:, 1], ramp[:, 2])
+    frames = np.ascontiguousarray(np.repeat(colors[:, np.newaxis], led_count, axis=1))
+    frames.setflags(write=False)
+    logger.info(f"Compiled sunrise: {frames.shape[0]} frames x {led_count} LEDs")
+    return frames
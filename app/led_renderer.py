@@ -0,0 +1,159 @@
+import sys
+import time
+from clock import SystemClock
+from led_patterns import compile_pattern, target_fps
+
+class FrameStats:
+    """Counters for one run of the LED renderer."""
+
+    def __init__(self, target_fps=0.0):
+        """Initialize empty counters."""
+        self.target_fps = target_fps
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.render_time = 0.0
+        self.max_render_time = 0.0
+        self.started = None
+        self.elapsed = 0.0
+
+    def record_frame(self, render_time):
+        """Record one frame that reached the strip."""
+        self.frames_shown += 1
+        self.render_time += render_time
+        self.max_render_time = max(self.max_render_time, render_time)
+
+    @property
+    def achieved_fps(self):
+        """Frames actually shown per second."""
+        return self.frames_shown / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mean_render_time(self):
+        """Average seconds spent writing and latching a frame."""
+        return self.render_time / self.frames_shown if self.frames_shown else 0.0
+
+    def as_dict(self):
+        """Telemetry snapshot."""
+        return {
+            'target_fps': self.target_fps,
+            'achieved_fps': round(self.achieved_fps, 2),
+            'frames_shown': self.frames_shown,
+            'frames_dropped': self.frames_dropped,
+            'mean_render_ms': round(self.mean_render_time * 1000, 3),
+            'max_render_ms': round(self.max_render_time * 1000, 3)
+        }
+
+class LedRenderer:
+    """Drives a strip from a frame table on a monotonic frame clock.
+
+    Frame n is due at start + n / fps. When rendering falls behind (slow
+    show(), GIL contention), overdue frames are skipped rather than shown
+    late, so animations keep their speed instead of stuttering slower.
+    """
+
+    def __init__(self, strip, clock=None):
+        """Initialize the renderer for a strip."""
+        self.strip = strip
+        self.clock = clock or SystemClock()
+        self.stats = FrameStats()
+
+    def show_frame(self, frame):
+        """Write a whole frame of packed colours and latch it."""
+        self.strip[0:len(frame)] = frame
+        self.strip.show()
+
+    def run(self, frames, fps, is_running, loops=None):
+        """Play frames at fps until is_running() is False (or after `loops` passes)."""
+        self.stats = stats = FrameStats(fps)
+        period = 1.0 / fps
+        total = len(frames) * loops if loops else None
+        start = self.clock.monotonic()
+        stats.started = start
+        index = 0
+
+        while is_running() and (total is None or index < total):
+            now = self.clock.monotonic()
+            due = int((now - start) / period)
+            if due > index:
+                # Behind schedule: jump to the frame that should be showing now
+                stats.frames_dropped += due - index
+                index = due
+                if total is not None and index >= total:
+                    break
+
+            render_start = self.clock.monotonic()
+            self.show_frame(frames[index % len(frames)])
+            stats.record_frame(self.clock.monotonic() - render_start)
+
+            index += 1
+            delay = start + index * period - self.clock.monotonic()
+            if delay > 0:
+                self.clock.sleep(delay)
+            stats.elapsed = self.clock.monotonic() - start
+
+        return stats
+
+class FakePixelStrip:
+    """Stand-in for rpi_ws281x.PixelStrip for benchmarking without hardware.
+
+    show() blocks for the time a real WS2812 strip needs to latch the data
+    (about 30 us per LED plus a 50 us reset).
+    """
+
+    def __init__(self, num, *args, show_time=None, **kwargs):
+        """Initialize the fake strip."""
+        self._pixels = [0] * num
+        self.show_time = show_time if show_time is not None else num * 30e-6 + 50e-6
+        self.shows = 0
+
+    def begin(self):
+        pass
+
+    def numPixels(self):
+        return len(self._pixels)
+
+    def setPixelColor(self, n, color):
+        self._pixels[n] = color
+
+    def getPixelColor(self, n):
+        return self._pixels[n]
+
+    def __setitem__(self, pos, value):
+        self._pixels[pos] = value
+
+    def __getitem__(self, pos):
+        return self._pixels[pos]
+
+    def show(self):
+        deadline = time.perf_counter() + self.show_time
+        while time.perf_counter() < deadline:
+            pass
+        self.shows += 1
+
+def benchmark(pattern='default', seconds=5.0, led_count=8, fps=None):
+    """Render a pattern to a FakePixelStrip and report frame telemetry."""
+    strip = FakePixelStrip(led_count)
+    renderer = LedRenderer(strip)
+    frames = compile_pattern(pattern, led_count).tolist()
+    deadline = time.monotonic() + seconds
+
+    cpu_start = time.process_time()
+    stats = renderer.run(frames, fps or target_fps(pattern), lambda: time.monotonic() < deadline)
+    cpu = time.process_time() - cpu_start
+
+    print(f"pattern={pattern} leds={led_count} target={stats.target_fps} fps")
+    for key, value in stats.as_dict().items():
+        print(f"  {key}: {value}")
+    print(f"  cpu_per_frame_ms: {cpu / max(stats.frames_shown, 1) * 1000:.3f}")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Usage: python led_renderer.py benchmark [pattern] [seconds] [leds] [fps]")
+        sys.exit(1)
+
+    benchmark(
+        pattern=sys.argv[2] if len(sys.argv) > 2 else 'default',
+        seconds=float(sys.argv[3]) if len(sys.argv) > 3 else 5.0,
+        led_count=int(sys.argv[4]) if len(sys.argv) > 4 else 8,
+        fps=float(sys.argv[5]) if len(sys.argv) > 5 else None
+    )
@@ -2,10 +2,12 @@
 import os
 import sys
 import time
+import asyncio
 import logging
 import threading
 import uuid
 import json
+import secrets
 import requests
 from urllib3.exceptions import InsecureRequestWarning
 from dotenv import load_dotenv
@@ -16,8 +18,12 @@ requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 # Local module imports
 from display import Display
 from alarm import AlarmManager
+from alarm_store import AlarmRepository
 from weather import WeatherManager
 from hardware import HardwareController
+from escalation import EscalationEngine
+from runtime import AlarmRuntime
+from device_feed import DeviceFeed
 from api import app as api_app
 
 # Configure logging
@@ -31,6 +37,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Seconds each registration check waits on the API
+REGISTRATION_WAIT = 25
+# Seconds between device token requests while the device is not paired
+PAIRING_RETRY = 300
+
 class SmartAlarm:
     def __init__(self):
         """Initialize the Smart Alarm system."""
@@ -38,6 +49,8 @@ class SmartAlarm:
         
         # Check for device ID
         self.device_id = self._get_or_create_device_id()
+        self.device_secret = self._get_or_create_device_secret()
+        self.device_token = None
         self.is_registered = self._check_device_registration()
         
         # Initialize display first for registration screen
@@ -46,13 +59,36 @@ class SmartAlarm:
         if not self.is_registered:
             logger.info(f"Device not registered. Device ID: {self.device_id}")
             # Show registration screen
-            self.display.show_registration_screen(self.device_id)
+            self.display.show_registration_screen(self.device_id, self.device_secret)
             return
         
         # Initialize other components only if device is registered
-        self.alarm_manager = AlarmManager()
-        self.weather_manager = WeatherManager(api_key=os.getenv('WEATHER_API_KEY'))
-        self.hardware = HardwareController()
+        self.alarm_manager = AlarmManager(store=AlarmRepository(), device_id=self.device_id)
+        self.weather_manager = WeatherManager(
+            api_key=os.getenv('WEATHER_API_KEY'),
+            location=os.getenv('WEATHER_LOCATION', 'auto:ip')
+        )
+        self.hardware = HardwareController(sounds_dir=self.alarm_manager.config['sounds_dir'])
+        self.escalation = EscalationEngine(self.hardware, clock=self.alarm_manager.clock)
+        self.runtime = AlarmRuntime(
+            self.display,
+            self.alarm_manager,
+            self.weather_manager,
+            on_alarm=self.trigger_alarm,
+            on_sunrise=self.start_sunrise,
+            preload_sounds=self.hardware.preload_sounds
+        )
+        # Alarm and settings changes pushed from the API (started once a
+        # device token is issued, see _start_feed)
+        self.feed = DeviceFeed(
+            os.getenv('API_BASE_URL'),
+            self.device_id,
+            self.device_token,
+            on_event=self._on_feed_event,
+            refresh_token=self._request_device_token
+        )
+        
+        self._pairing_timer = None
         
         self.running = False
         logger.info("Smart Alarm system initialized")
@@ -71,84 +107,145 @@ class SmartAlarm:
             json.dump({'device_id': device_id}, f)
         return device_id
 
-    def _check_device_registration(self):
-        """Check if device is registered with the web service."""
+    def _get_or_create_device_secret(self):
+        """Get the secret this device pairs with, creating it on first use.
+
+        It is shown as the pairing code on the registration screen.
+        """
+        device_file = 'device_id.json'
+        with open(device_file, 'r') as f:
+            data = json.load(f)
+        if 'secret' not in data:
+            data['secret'] = secrets.token_hex(8)
+            with open(device_file, 'w') as f:
+                json.dump(data, f)
+            os.chmod(device_file, 0o600)
+        return data['secret']
+
+    def _check_device_registration(self, wait=0):
+        """Check if device is registered with the web service.
+
+        With wait, the API holds the request open for up to that many
+        seconds until the device is registered.
+        """
         try:
             response = requests.get(
                 f"{os.getenv('API_BASE_URL')}/api/devices/check/{self.device_id}",
+                params={'wait': wait} if wait else None,
                 verify=False,  # Temporarily disable SSL verification
-                timeout=5
+                timeout=wait + 5
             )
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Error checking device registration: {str(e)}")
             return False
 
+    def _request_device_token(self):
+        """Exchange the device secret for a change feed token, or None."""
+        try:
+            response = requests.post(
+                f"{os.getenv('API_BASE_URL')}/api/devices/{self.device_id}/token",
+                json={'secret': self.device_secret},
+                verify=False,  # Temporarily disable SSL verification
+                timeout=5
+            )
+            if response.status_code == 401:
+                logger.warning("Device secret rejected; re-pair the device with the secret in device_id.json")
+                return None
+            response.raise_for_status()
+            return response.json().get('device_token')
+        except Exception as e:
+            logger.error(f"Error requesting device token: {str(e)}")
+            return None
+
+    def _start_feed(self):
+        """Start following the change feed once the API issues a device token.
+
+        A device registered before pairing existed (or re-paired with
+        another code) gets no token. It keeps working on the periodic
+        store reload and asks again every PAIRING_RETRY seconds, so
+        re-pairing it through PUT /api/devices/<id> picks the feed up.
+        """
+        if not self.running:
+            return
+        self.device_token = self._request_device_token()
+        if self.device_token:
+            self.feed.token = self.device_token
+            self.feed.start()
+            return
+        logger.warning("No change feed token; alarms update on the periodic reload until the "
+                       "device is re-paired with the secret in device_id.json")
+        self._pairing_timer = threading.Timer(PAIRING_RETRY, self._start_feed)
+        self._pairing_timer.daemon = True
+        self._pairing_timer.start()
+
+    def _on_feed_event(self, event):
+        """Apply a change event from the API (called on the feed thread)."""
+        if event['type'] in ('alarm', 'resync'):
+            self.runtime.notify_store_changed()
+        elif event['type'] == 'dismiss':
+            self.runtime.call_in_loop(self.dismiss_alarm)
+        elif event['type'] == 'settings' and event.get('data'):
+            self.runtime.call_in_loop(self.alarm_manager.update_config, event['data'])
+
     def start(self):
         """Start the Smart Alarm system."""
         if not self.is_registered:
-            # Just keep showing registration screen and checking
-            while not self._check_device_registration():
-                time.sleep(5)
+            # Keep showing the registration screen; each check waits on the
+            # API until the device is registered
+            while True:
+                started = time.monotonic()
+                if self._check_device_registration(wait=REGISTRATION_WAIT):
+                    break
+                # Only pause when the check failed fast (API unreachable)
+                time.sleep(max(0, 5 - (time.monotonic() - started)))
             # Once registered, reinitialize
             self.__init__()
         
         self.running = True
         logger.info("Starting Smart Alarm system")
+        self._start_feed()
         
         try:
-            while self.running:
-                # Update display with current time and date
-                self.display.update_time()
-                
-                # Check and update weather information
-                weather_data = self.weather_manager.get_current_weather()
-                if weather_data:
-                    self.display.update_weather(weather_data)
-                
-                # Check for active alarms
-                if self.alarm_manager.check_alarms():
-                    self.trigger_alarm()
-                
-                # Check for weather alerts
-                alerts = self.weather_manager.get_alerts()
-                if alerts:
-                    self.display.show_alerts(alerts)
-                
-                # Update upcoming events
-                events = self.alarm_manager.get_upcoming_events()
-                if events:
-                    self.display.update_events(events)
-                
-                # Small delay to prevent excessive CPU usage
-                time.sleep(1)
-                
+            asyncio.run(self.runtime.run())
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received")
-            self.stop()
         except Exception as e:
             logger.error(f"Error in main loop: {str(e)}")
+        finally:
             self.stop()
 
     def stop(self):
         """Stop the Smart Alarm system."""
         self.running = False
+        if getattr(self, '_pairing_timer', None):
+            self._pairing_timer.cancel()
+        if hasattr(self, 'feed'):
+            self.feed.stop()
+        if hasattr(self, 'runtime'):
+            self.runtime.stop()
+        if hasattr(self, 'escalation'):
+            self.escalation.shutdown()
         if hasattr(self, 'hardware'):
             self.hardware.cleanup()
         logger.info("Smart Alarm system stopped")
 
-    def trigger_alarm(self):
+    def start_sunrise(self, config):
+        """Start the wake-up light ramp ahead of an alarm."""
+        try:
+            if config.get('rgb_enabled', True):
+                self.hardware.start_sunrise(config['sunrise_duration'], config['sunrise_remaining'])
+        except Exception as e:
+            logger.error(f"Error starting sunrise: {str(e)}")
+
+    def trigger_alarm(self, config=None):
         """Handle alarm triggering."""
         try:
             # Get alarm configuration
-            config = self.alarm_manager.get_current_alarm_config()
-            
-            # Trigger RGB lights if enabled
-            if config.get('rgb_enabled', True):
-                self.hardware.start_light_sequence(config.get('rgb_pattern', 'default'))
+            config = config or self.alarm_manager.get_current_alarm_config()
             
-            # Play alarm sound
-            self.hardware.play_alarm_sound(config.get('sound_file', 'standard_alarm.mp3'))
+            # Sound and lights, escalating until the alarm is dismissed
+            self.escalation.start(config)
             
             # Update display for alarm state
             self.display.show_alarm_active(config)
@@ -156,6 +253,19 @@ class SmartAlarm:
         except Exception as e:
             logger.error(f"Error triggering alarm: {str(e)}")
 
+    def dismiss_alarm(self):
+        """Stop the ringing alarm and return to the clock (called on the runtime loop)."""
+        try:
+            if not self.escalation.active:
+                return
+            self.escalation.stop()
+            self.alarm_manager.active_alarm = None
+            logger.info("Alarm dismissed")
+            self.display.clear()
+            self.display.update_time()
+        except Exception as e:
+            logger.error(f"Error dismissing alarm: {str(e)}")
+
 def run_api_server():
     """Run the Flask API server."""
     api_app.run(host='0.0.0.0', port=5000)
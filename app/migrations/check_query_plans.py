@@ -0,0 +1,82 @@
+"""Assert that every hot query is answered through an index.
+
+Runs EXPLAIN (MySQL) or EXPLAIN QUERY PLAN (SQLite) against the configured
+database and fails when a query scans its table or sorts rows after
+reading them. Run after migrating:
+
+    alembic upgrade head && python migrations/check_query_plans.py
+"""
+
+import os
+import sys
+from sqlalchemy import select, text, false
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import engine, Alarm, Device, DeviceEvent, UserSettings, VerificationToken, PasswordResetToken
+
+# (name, table, statement) for the lookups the API makes on every request
+HOT_QUERIES = [
+    ('alarms by device', 'alarms',
+     select(Alarm).where(Alarm.device_id == 1).order_by(Alarm.time, Alarm.id)),
+    ('alarms by user', 'alarms',
+     select(Alarm).where(Alarm.user_id == 1).order_by(Alarm.time, Alarm.id)),
+    ('device by device_id and user', 'devices',
+     select(Device).where(Device.device_id == 'device', Device.user_id == 1)),
+    ('settings by user', 'user_settings',
+     select(UserSettings).where(UserSettings.user_id == 1)),
+    ('unused verification token', 'verification_tokens',
+     select(VerificationToken).where(VerificationToken.token == 'token', VerificationToken.is_used == false())),
+    ('unused password reset token', 'password_reset_tokens',
+     select(PasswordResetToken).where(PasswordResetToken.token == 'token', PasswordResetToken.is_used == false())),
+    ('change feed events after a cursor', 'device_events',
+     select(DeviceEvent).where(DeviceEvent.device_id == 'device', DeviceEvent.id > 1).order_by(DeviceEvent.id))
+]
+
+def _sql(statement):
+    """A statement as SQL text with its parameters inlined."""
+    return str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+
+def _check_sqlite(connection, table, sql):
+    """Problems in a SQLite plan (empty if the query uses an index)."""
+    details = [row[3] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    problems = [d for d in details if d.startswith(f"SCAN {table}") and 'INDEX' not in d]
+    problems += [d for d in details if 'TEMP B-TREE' in d]
+    if not any(d.startswith(f"SEARCH {table}") for d in details):
+        problems.append(f"no index search on {table}: {details}")
+    return problems
+
+def _check_mysql(connection, table, sql):
+    """Problems in a MySQL plan (empty if the query uses an index)."""
+    problems = []
+    for row in connection.execute(text(f"EXPLAIN {sql}")).mappings():
+        if row['table'] != table:
+            continue
+        extra = row['Extra'] or ''
+        # Unique lookups on an empty table are resolved before execution
+        if 'const tables' in extra or row['type'] in ('const', 'eq_ref'):
+            continue
+        if row['type'] == 'ALL' or not row['key']:
+            problems.append(f"full scan (type={row['type']}, possible_keys={row['possible_keys']})")
+        if 'Using filesort' in extra:
+            problems.append(f"filesort ({extra})")
+    return problems
+
+def check_query_plans():
+    """Check every hot query; returns {name: [problems]} for the failing ones."""
+    check = _check_mysql if engine.dialect.name == 'mysql' else _check_sqlite
+    failures = {}
+    with engine.connect() as connection:
+        for name, table, statement in HOT_QUERIES:
+            problems = check(connection, table, _sql(statement))
+            print(f"{'FAIL' if problems else 'ok':>4}  {name}")
+            if problems:
+                failures[name] = problems
+    return failures
+
+if __name__ == '__main__':
+    failures = check_query_plans()
+    for name, problems in failures.items():
+        for problem in problems:
+            print(f"{name}: {problem}")
+    sys.exit(1 if failures else 0)
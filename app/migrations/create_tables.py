@@ -2,27 +2,33 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import Base, engine, init_db
-from alembic import op
-import sqlalchemy as sa
-from datetime import datetime
+from alembic import command
+from alembic.config import Config
 
-def upgrade():
-    """Create all tables."""
-    init_db()
-    print("Database tables created successfully!")
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def downgrade():
-    """Drop all tables."""
-    Base.metadata.drop_all(bind=engine)
-    print("Database tables dropped successfully!")
+def _config():
+    """Alembic configuration for the app's migration chain."""
+    config = Config(os.path.join(APP_DIR, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(APP_DIR, 'migrations'))
+    return config
+
+def upgrade(revision='head'):
+    """Migrate the database to revision (creating any missing tables)."""
+    command.upgrade(_config(), revision)
+    print(f"Database migrated to {revision}")
+
+def downgrade(revision='base'):
+    """Migrate the database back to revision (base drops all tables)."""
+    command.downgrade(_config(), revision)
+    print(f"Database migrated back to {revision}")
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2 or sys.argv[1] not in ['upgrade', 'downgrade']:
-        print("Usage: python create_tables.py [upgrade|downgrade]")
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ['upgrade', 'downgrade']:
+        print("Usage: python create_tables.py [upgrade|downgrade] [revision]")
         sys.exit(1)
     
     if sys.argv[1] == 'upgrade':
-        upgrade()
+        upgrade(*sys.argv[2:])
     else:
-        downgrade() 
\ No newline at end of file
+        downgrade(*sys.argv[2:])
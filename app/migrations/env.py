@@ -0,0 +1,30 @@
+import os
+import sys
+from alembic import context
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, engine
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    """Emit the migration SQL without connecting (alembic upgrade --sql)."""
+    context.configure(url=engine.url.render_as_string(hide_password=False), target_metadata=target_metadata,
+                      literal_binds=True, render_as_batch=engine.dialect.name == 'sqlite')
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    """Run migrations on the application's engine (same pool settings and pragmas)."""
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata,
+                          # SQLite can only alter tables by copying them
+                          render_as_batch=connection.dialect.name == 'sqlite')
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,65 @@
+"""Helpers that let migrations run against databases in any earlier state.
+
+Databases created with Base.metadata.create_all before migrations existed
+already have some of the tables and columns, so every step checks first.
+Index and column changes on MySQL use online DDL so the API keeps serving
+reads and writes while a large table is altered.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+def _inspector():
+    """Inspector for the live database, or None when emitting SQL (--sql) with no connection."""
+    if op.get_context().as_sql:
+        return None
+    return sa.inspect(op.get_bind())
+
+def has_table(table):
+    """Whether a table exists."""
+    inspector = _inspector()
+    return inspector is not None and inspector.has_table(table)
+
+def has_column(table, column):
+    """Whether a table has a column."""
+    inspector = _inspector()
+    return inspector is not None and column in {c['name'] for c in inspector.get_columns(table)}
+
+def has_index(table, name):
+    """Whether a table has an index with this name."""
+    inspector = _inspector()
+    return inspector is not None and name in {i['name'] for i in inspector.get_indexes(table)}
+
+def is_mysql():
+    """Whether the migration runs against MySQL."""
+    return op.get_bind().dialect.name == 'mysql'
+
+def add_column(table, column):
+    """Add a nullable column if missing (instant/in-place on MySQL)."""
+    if has_column(table, column.name):
+        return
+    if is_mysql():
+        column_type = column.type.compile(dialect=op.get_bind().dialect)
+        op.execute(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type} NULL, "
+                   f"ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        op.add_column(table, column)
+
+def create_index(name, table, columns, unique=False):
+    """Create an index if missing without blocking writes on MySQL."""
+    if has_index(table, name):
+        return
+    if is_mysql():
+        kind = 'UNIQUE INDEX' if unique else 'INDEX'
+        op.execute(f"CREATE {kind} {name} ON {table} ({', '.join(columns)}) ALGORITHM=INPLACE LOCK=NONE")
+    else:
+        op.create_index(name, table, columns, unique=unique)
+
+def drop_index(name, table):
+    """Drop an index if present."""
+    if not has_index(table, name):
+        return
+    if is_mysql():
+        op.execute(f"DROP INDEX {name} ON {table} ALGORITHM=INPLACE LOCK=NONE")
+    else:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,103 @@
+"""Initial schema: users, tokens, devices, alarms and settings
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Tables that already exist (databases made by create_all) are left alone.
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations.schema import has_table
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def _timestamps():
+    return [sa.Column('created_at', sa.DateTime()), sa.Column('updated_at', sa.DateTime())]
+
+def upgrade():
+    if not has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('email', sa.String(255)),
+            sa.Column('username', sa.String(50)),
+            sa.Column('password_hash', sa.String(255)),
+            sa.Column('is_active', sa.Boolean()),
+            sa.Column('is_verified', sa.Boolean()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('last_login', sa.DateTime()),
+            sa.Column('google_id', sa.String(255), unique=True),
+            sa.Column('profile_picture', sa.String(255))
+        )
+        op.create_index('ix_users_id', 'users', ['id'])
+        op.create_index('ix_users_email', 'users', ['email'], unique=True)
+        op.create_index('ix_users_username', 'users', ['username'], unique=True)
+
+    for table in ('verification_tokens', 'password_reset_tokens'):
+        if not has_table(table):
+            op.create_table(
+                table,
+                sa.Column('id', sa.Integer(), primary_key=True),
+                sa.Column('token', sa.String(255)),
+                sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+                sa.Column('created_at', sa.DateTime()),
+                sa.Column('expires_at', sa.DateTime()),
+                sa.Column('is_used', sa.Boolean())
+            )
+            op.create_index(f'ix_{table}_id', table, ['id'])
+            op.create_index(f'ix_{table}_token', table, ['token'], unique=True)
+
+    if not has_table('devices'):
+        op.create_table(
+            'devices',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('device_id', sa.String(64)),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+            sa.Column('name', sa.String(100)),
+            sa.Column('model', sa.String(50)),
+            sa.Column('status', sa.String(20)),
+            sa.Column('last_seen', sa.DateTime()),
+            sa.Column('firmware_version', sa.String(20)),
+            *_timestamps()
+        )
+        op.create_index('ix_devices_id', 'devices', ['id'])
+        op.create_index('ix_devices_device_id', 'devices', ['device_id'], unique=True)
+
+    if not has_table('alarms'):
+        op.create_table(
+            'alarms',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+            sa.Column('title', sa.String(100)),
+            sa.Column('time', sa.String(5)),
+            sa.Column('days', sa.String(50)),
+            sa.Column('sound_file', sa.String(255)),
+            sa.Column('is_enabled', sa.Boolean()),
+            *_timestamps(),
+            sa.Column('device_id', sa.Integer(), sa.ForeignKey('devices.id'))
+        )
+        op.create_index('ix_alarms_id', 'alarms', ['id'])
+
+    if not has_table('user_settings'):
+        op.create_table(
+            'user_settings',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), unique=True),
+            sa.Column('theme', sa.String(20)),
+            sa.Column('time_format', sa.String(3)),
+            sa.Column('date_format', sa.String(10)),
+            sa.Column('temperature_unit', sa.String(1)),
+            sa.Column('default_sound', sa.String(255)),
+            sa.Column('rgb_enabled', sa.Boolean()),
+            sa.Column('rgb_pattern', sa.String(20)),
+            *_timestamps()
+        )
+        op.create_index('ix_user_settings_id', 'user_settings', ['id'])
+
+def downgrade():
+    for table in ('user_settings', 'alarms', 'devices', 'password_reset_tokens', 'verification_tokens', 'users'):
+        op.drop_table(table)
@@ -0,0 +1,44 @@
+"""Device locations, light patterns and alarm options
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Columns and tables added to the models after the initial schema.
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations.schema import has_table, add_column
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    add_column('devices', sa.Column('latitude', sa.Float()))
+    add_column('devices', sa.Column('longitude', sa.Float()))
+    add_column('alarms', sa.Column('options', sa.Text()))
+
+    if not has_table('light_patterns'):
+        op.create_table(
+            'light_patterns',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+            sa.Column('name', sa.String(100)),
+            sa.Column('spec', sa.Text()),
+            sa.Column('content_hash', sa.String(64)),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('updated_at', sa.DateTime())
+        )
+        op.create_index('ix_light_patterns_id', 'light_patterns', ['id'])
+        op.create_index('ix_light_patterns_user_id', 'light_patterns', ['user_id'])
+        op.create_index('ix_light_patterns_content_hash', 'light_patterns', ['content_hash'])
+
+def downgrade():
+    op.drop_table('light_patterns')
+    with op.batch_alter_table('alarms') as batch:
+        batch.drop_column('options')
+    with op.batch_alter_table('devices') as batch:
+        batch.drop_column('longitude')
+        batch.drop_column('latitude')
@@ -0,0 +1,49 @@
+"""Composite indexes for the hot device, alarm and token lookups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Each index leads with the equality columns of its query and carries the
+ORDER BY (alarms) or the remaining filter column (devices, tokens), so
+the lookup is answered from the index without a filesort. UserSettings
+by user_id is already served by its unique constraint. Indexes are built
+with online DDL on MySQL. See migrations/check_query_plans.py.
+"""
+from migrations.schema import create_index, drop_index
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # AlarmRepository.list_for_device and the device sync endpoints
+    ('ix_alarms_device_id_time', 'alarms', ['device_id', 'time', 'id']),
+    # AlarmRepository.list_for_user
+    ('ix_alarms_user_id_time', 'alarms', ['user_id', 'time', 'id']),
+    # Every /api/devices/<device_id>/... handler filters by device_id and user_id
+    ('ix_devices_device_id_user_id', 'devices', ['device_id', 'user_id']),
+    # Email verification and password reset look up unused tokens
+    ('ix_verification_tokens_token_is_used', 'verification_tokens', ['token', 'is_used']),
+    ('ix_password_reset_tokens_token_is_used', 'password_reset_tokens', ['token', 'is_used'])
+]
+
+# Single-column indexes the composites make redundant (from create_all databases)
+REPLACED = [
+    ('ix_alarms_device_id', 'alarms', ['device_id']),
+    ('ix_alarms_user_id', 'alarms', ['user_id'])
+]
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        create_index(name, table, columns)
+    # Safe only now: on MySQL the composites take over backing the foreign keys
+    for name, table, _ in REPLACED:
+        drop_index(name, table)
+
+def downgrade():
+    for name, table, columns in REPLACED:
+        create_index(name, table, columns)
+    for name, table, _ in reversed(INDEXES):
+        drop_index(name, table)
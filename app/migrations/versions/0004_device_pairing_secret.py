@@ -0,0 +1,24 @@
+"""Device pairing secrets
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+Stores a digest of the pairing code the owner enters when registering a
+device. The device exchanges the code for its change feed token.
+"""
+import sqlalchemy as sa
+from alembic import op
+from migrations.schema import add_column
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    add_column('devices', sa.Column('secret_hash', sa.String(64)))
+
+def downgrade():
+    with op.batch_alter_table('devices') as batch:
+        batch.drop_column('secret_hash')
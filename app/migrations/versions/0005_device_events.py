@@ -0,0 +1,33 @@
+"""Change feed events table
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+Change feed events are stored in the database so every API worker shares
+one event sequence (see change_feed.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations.schema import has_table
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not has_table('device_events'):
+        op.create_table(
+            'device_events',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('device_id', sa.String(64)),
+            sa.Column('event_type', sa.String(32)),
+            sa.Column('data', sa.Text()),
+            sa.Column('created_at', sa.DateTime())
+        )
+        op.create_index('ix_device_events_device_id_id', 'device_events', ['device_id', 'id'])
+        op.create_index('ix_device_events_created_at', 'device_events', ['created_at'])
+
+def downgrade():
+    op.drop_table('device_events')
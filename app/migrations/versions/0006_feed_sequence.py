@@ -0,0 +1,32 @@
+"""Change feed sequence counter
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+Event IDs come from a single counter row instead of the autoincrement
+column. Publishing updates the row, which locks it until the event is
+committed, so events become visible in ID order (see change_feed.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations.schema import has_table
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not has_table('feed_sequence'):
+        op.create_table(
+            'feed_sequence',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('value', sa.Integer(), nullable=False)
+        )
+    op.execute("INSERT INTO feed_sequence (id, value) "
+               "SELECT 1, COALESCE(MAX(id), 0) FROM device_events "
+               "WHERE NOT EXISTS (SELECT 1 FROM feed_sequence WHERE id = 1)")
+
+def downgrade():
+    op.drop_table('feed_sequence')
@@ -0,0 +1,244 @@
+"""Declarative LED patterns compiled to frame tables.
+
+A pattern spec is a JSON object describing one loop of an animation:
+
+    {
+        "fps": 30,              frames per second
+        "duration": 2.0,        seconds per loop
+        "loops": 0,             times to play (0 = until stopped)
+        "brightness": 255,      global scale, 0-255
+        "spread": 0.0,          phase shift across the whole strip, in loops
+        "offsets": [...],       optional extra phase per pixel, in loops
+        "keyframes": [
+            {"t": 0.0, "color": "#ff0000"},
+            {"t": 0.5, "gradient": ["#ff0000", "#0000ff"], "ease": "ease_in_out"},
+            {"t": 1.0, "color": [255, 0, 0]}
+        ]
+    }
+
+Keyframe times are fractions of the loop. A keyframe's "ease" shapes the
+transition into it. "gradient" stops are spread evenly along the strip.
+"""
+
+import json
+import math
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from led_patterns import pack_rgb
+
+logger = logging.getLogger(__name__)
+
+# Limits that keep a single compiled pattern to a few MB
+MAX_FPS = 100
+MAX_DURATION = 600.0
+MAX_FRAMES = 3000
+MAX_KEYFRAMES = 64
+MAX_STOPS = 32
+MAX_OFFSETS = 1024
+# Compiled frame tables kept in memory, keyed by (content hash, LED count)
+MAX_COMPILED = 32
+
+EASINGS = {
+    'linear': lambda u: u,
+    'ease_in': lambda u: u * u,
+    'ease_out': lambda u: 1 - (1 - u) ** 2,
+    'ease_in_out': lambda u: u * u * (3 - 2 * u),
+    'step': lambda u: np.where(u >= 1, 1.0, 0.0)
+}
+
+CompiledPattern = namedtuple('CompiledPattern', ['digest', 'frames', 'fps', 'loops'])
+
+def parse_color(value):
+    """Parse '#rrggbb', '#rgb' or [r, g, b] into an [r, g, b] list."""
+    if isinstance(value, str):
+        text = value.strip().lstrip('#')
+        if len(text) == 3:
+            text = ''.join(c * 2 for c in text)
+        if len(text) != 6:
+            raise ValueError(f"Invalid colour: {value}")
+        try:
+            return [int(text[i:i + 2], 16) for i in (0, 2, 4)]
+        except ValueError:
+            raise ValueError(f"Invalid colour: {value}")
+    if isinstance(value, (list, tuple)) and len(value) == 3:
+        return [min(max(int(_number(c, 'Colour channels')), 0), 255) for c in value]
+    raise ValueError(f"Invalid colour: {value}")
+
+def _number(value, name):
+    """A finite float from a spec field, or ValueError."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be finite")
+    return number
+
+def _scaled(color, factor):
+    """Colour with every channel scaled by factor."""
+    return [int(round(c * factor)) for c in parse_color(color)]
+
+def _duration_for_speed(speed):
+    """Map the website's 10-100 speed slider to seconds per loop."""
+    return 100.0 / min(max(_number(speed or 50, 'speed'), 10), 100)
+
+def from_legacy(pattern):
+    """Translate the website's preset/custom pattern objects into a spec."""
+    kind = pattern.get('type')
+    brightness = pattern.get('brightness', 255)
+    color = pattern.get('color', '#ff0000')
+
+    if kind == 'solid':
+        return {'fps': 2, 'duration': 0.5, 'brightness': brightness,
+                'keyframes': [{'t': 0.0, 'color': color}]}
+    if kind in ('pulse', 'custom'):
+        return {'fps': 50, 'duration': _duration_for_speed(pattern.get('speed')), 'brightness': brightness,
+                'keyframes': [{'t': 0.0, 'color': color},
+                              {'t': 0.5, 'color': _scaled(color, 0.2), 'ease': 'ease_in_out'},
+                              {'t': 1.0, 'color': color, 'ease': 'ease_in_out'}]}
+    if kind == 'chase':
+        colors = pattern.get('colors') or ['#ff0000', '#00ff00', '#0000ff']
+        if not isinstance(colors, list) or len(colors) > MAX_KEYFRAMES:
+            raise ValueError(f"Chase needs a list of up to {MAX_KEYFRAMES} colours")
+        return {'fps': 20, 'duration': 0.5 * len(colors), 'brightness': brightness,
+                'spread': -1.0 / len(colors),
+                'keyframes': [{'t': i / len(colors), 'color': c, 'ease': 'step'}
+                              for i, c in enumerate(colors)]}
+    if kind == 'rainbow_cycle':
+        return {'fps': 50, 'duration': _duration_for_speed(pattern.get('speed')) * 2.5, 'brightness': brightness,
+                'spread': 1.0,
+                'keyframes': [{'t': 0.0, 'color': '#ff0000'}, {'t': 1 / 3, 'color': '#00ff00'},
+                              {'t': 2 / 3, 'color': '#0000ff'}, {'t': 1.0, 'color': '#ff0000'}]}
+    raise ValueError(f"Unknown pattern type: {kind}")
+
+def normalize(spec):
+    """Validate a spec and return it in canonical form (all defaults filled in)."""
+    if not isinstance(spec, dict):
+        raise ValueError("Pattern must be an object")
+    if 'keyframes' not in spec:
+        spec = from_legacy(spec)
+
+    fps = _number(spec.get('fps', 30), 'fps')
+    duration = _number(spec.get('duration', 1.0), 'duration')
+    if not 0 < fps <= MAX_FPS:
+        raise ValueError(f"fps must be between 0 and {MAX_FPS}")
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"duration must be between 0 and {MAX_DURATION} seconds")
+    if duration * fps > MAX_FRAMES:
+        raise ValueError(f"Pattern is too long ({int(duration * fps)} frames, limit {MAX_FRAMES})")
+
+    keyframes = spec.get('keyframes')
+    if not isinstance(keyframes, list) or not 0 < len(keyframes) <= MAX_KEYFRAMES:
+        raise ValueError(f"Pattern needs between 1 and {MAX_KEYFRAMES} keyframes")
+
+    canonical_keyframes = []
+    for keyframe in keyframes:
+        if not isinstance(keyframe, dict):
+            raise ValueError("Keyframes must be objects")
+        stops = keyframe.get('gradient') or keyframe.get('colors') or [keyframe.get('color', '#000000')]
+        if not isinstance(stops, list) or len(stops) > MAX_STOPS:
+            raise ValueError(f"Gradients must be lists of up to {MAX_STOPS} stops")
+        ease = keyframe.get('ease', 'linear')
+        if not isinstance(ease, str) or ease not in EASINGS:
+            raise ValueError(f"Unknown easing: {ease}")
+        t = _number(keyframe.get('t', 0.0), 'Keyframe time')
+        if not 0.0 <= t <= 1.0:
+            raise ValueError("Keyframe times must be between 0 and 1")
+        canonical_keyframes.append({'t': t, 'colors': [parse_color(c) for c in stops], 'ease': ease})
+    canonical_keyframes.sort(key=lambda k: k['t'])
+
+    offsets = spec.get('offsets') or []
+    if not isinstance(offsets, list) or len(offsets) > MAX_OFFSETS:
+        raise ValueError(f"offsets must be a list of up to {MAX_OFFSETS} numbers")
+    return {
+        'fps': fps,
+        'duration': duration,
+        'loops': max(int(_number(spec.get('loops', 0), 'loops')), 0),
+        'brightness': min(max(int(_number(spec.get('brightness', 255), 'brightness')), 0), 255),
+        'spread': _number(spec.get('spread', 0.0), 'spread'),
+        'offsets': [_number(o, 'Offsets') for o in offsets],
+        'keyframes': canonical_keyframes
+    }
+
+def _digest(canonical_spec):
+    """SHA-256 of a canonical spec's JSON encoding."""
+    encoded = json.dumps(canonical_spec, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def pattern_hash(spec):
+    """Content hash of a spec; equivalent specs hash the same."""
+    return _digest(normalize(spec))
+
+def _keyframe_colors(keyframes, led_count):
+    """Per-pixel colour of every keyframe: (keyframes, led_count, 3) float32."""
+    positions = np.linspace(0.0, 1.0, led_count) if led_count > 1 else np.zeros(1)
+    colors = np.empty((len(keyframes), led_count, 3), dtype=np.float32)
+    for index, keyframe in enumerate(keyframes):
+        stops = np.asarray(keyframe['colors'], dtype=np.float32)
+        if len(stops) == 1:
+            colors[index] = stops[0]
+        else:
+            stop_positions = np.linspace(0.0, 1.0, len(stops))
+            for channel in range(3):
+                colors[index, :, channel] = np.interp(positions, stop_positions, stops[:, channel])
+    return colors
+
+def _render(spec, led_count):
+    """Render a canonical spec into a (frames, led_count) uint32 table."""
+    frame_count = max(int(round(spec['duration'] * spec['fps'])), 1)
+    keyframes = spec['keyframes']
+    times = np.array([k['t'] for k in keyframes], dtype=np.float32)
+    colors = _keyframe_colors(keyframes, led_count)
+
+    # Phase of every pixel in every frame, as a fraction of the loop
+    pixels = np.arange(led_count)
+    phase = np.arange(frame_count, dtype=np.float32)[:, np.newaxis] / frame_count
+    phase = phase + np.float32(spec['spread']) * pixels / led_count
+    if spec['offsets']:
+        phase = phase + np.resize(np.asarray(spec['offsets'], dtype=np.float32), led_count)
+    phase %= 1.0
+
+    if len(keyframes) == 1:
+        rgb = np.broadcast_to(colors[0], (frame_count, led_count, 3))
+    else:
+        # Segment each phase falls in; before the first / after the last keyframe holds
+        end = np.clip(np.searchsorted(times, phase, side='right'), 1, len(keyframes) - 1)
+        start = end - 1
+        span = np.maximum(times[end] - times[start], 1e-6)
+        u = np.clip((phase - times[start]) / span, 0.0, 1.0)
+        for index, keyframe in enumerate(keyframes[1:], start=1):
+            if keyframe['ease'] != 'linear':
+                mask = end == index
+                u[mask] = EASINGS[keyframe['ease']](u[mask])
+        rgb = colors[start, pixels] + (colors[end, pixels] - colors[start, pixels]) * u[..., np.newaxis]
+
+    rgb = np.clip(np.rint(rgb * (spec['brightness'] / 255.0)), 0, 255).astype(np.uint8)
+    return pack_rgb(rgb[..., 0], rgb[..., 1], rgb[..., 2])
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+def compile_spec(spec, led_count):
+    """Compile a spec for a strip, reusing the cached table for identical content."""
+    spec = normalize(spec)
+    digest = _digest(spec)
+    key = (digest, led_count)
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+
+    frames = np.ascontiguousarray(_render(spec, led_count), dtype=np.uint32)
+    frames.setflags(write=False)
+    compiled = CompiledPattern(digest, frames, spec['fps'], spec['loops'])
+    logger.info(f"Compiled light pattern {digest[:12]}: {frames.shape[0]} frames x {led_count} LEDs")
+
+    with _compiled_lock:
+        _compiled[key] = compiled
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
@@ -0,0 +1,150 @@
+import logging
+from datetime import datetime, date, time, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Index matches datetime.weekday(): Monday is bit 0, Sunday is bit 6
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+ALL_DAYS = 0b1111111
+
+def parse_days(days):
+    """Convert a list or comma-separated string of day names into a 7-bit mask."""
+    if not days:
+        return 0
+    if isinstance(days, str):
+        days = days.split(',')
+    mask = 0
+    for day in days:
+        prefix = day.strip().lower()[:3]
+        for index, name in enumerate(WEEKDAYS):
+            if prefix and name.startswith(prefix):
+                mask |= 1 << index
+                break
+        else:
+            logger.warning(f"Ignoring unknown day name: {day}")
+    return mask
+
+def mask_to_days(mask):
+    """Convert a 7-bit day mask back into a list of day names."""
+    return [name for index, name in enumerate(WEEKDAYS) if mask & (1 << index)]
+
+def _parse_date(value):
+    """Parse a YYYY-MM-DD string (or pass through a date)."""
+    if value is None or isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _build_offsets(mask):
+    """Precompute, for each weekday, the days until the next enabled weekday (inclusive)."""
+    offsets = []
+    for weekday in range(7):
+        offset = None
+        for step in range(7):
+            if mask & (1 << ((weekday + step) % 7)):
+                offset = step
+                break
+        offsets.append(offset)
+    return tuple(offsets)
+
+class Recurrence:
+    """Compiled alarm recurrence rule.
+
+    Holds the trigger time as minute-of-day, the weekdays as a bitmask and
+    optional date bounds, so next_occurrence() never re-parses strings.
+    """
+
+    __slots__ = ('minute_of_day', 'weekday_mask', 'start_date', 'end_date',
+                 'exdates', 'holidays', '_offsets', '_time')
+
+    def __init__(self, minute_of_day, weekday_mask=ALL_DAYS, start_date=None, end_date=None,
+                 exdates=None, holidays=None):
+        """Initialize a recurrence rule."""
+        if not 0 <= minute_of_day < 24 * 60:
+            raise ValueError(f"Invalid minute of day: {minute_of_day}")
+        self.minute_of_day = minute_of_day
+        self.weekday_mask = weekday_mask & ALL_DAYS
+        self.start_date = start_date
+        self.end_date = end_date
+        self.exdates = set(exdates or ())
+        # Shared reference so holiday updates apply to every rule that opts in
+        self.holidays = holidays
+        self._offsets = _build_offsets(self.weekday_mask)
+        self._time = time(minute_of_day // 60, minute_of_day % 60)
+
+    @classmethod
+    def from_alarm(cls, alarm, holidays=None):
+        """Compile a recurrence rule from an alarm dict."""
+        hour, minute = alarm['time'].split(':')
+        minute_of_day = int(hour) * 60 + int(minute)
+
+        if alarm.get('recurring', False):
+            mask = parse_days(alarm.get('days'))
+            start_date = _parse_date(alarm.get('start_date'))
+            end_date = _parse_date(alarm.get('end_date'))
+        elif alarm.get('date'):
+            # One-time alarm on a fixed date
+            mask = ALL_DAYS
+            start_date = end_date = _parse_date(alarm['date'])
+        else:
+            mask = ALL_DAYS
+            start_date = end_date = None
+
+        return cls(
+            minute_of_day,
+            weekday_mask=mask,
+            start_date=start_date,
+            end_date=end_date,
+            exdates={_parse_date(d) for d in alarm.get('exdates', [])},
+            holidays=holidays if alarm.get('skip_holidays', False) else None
+        )
+
+    @property
+    def time(self):
+        """Trigger time of day."""
+        return self._time
+
+    def occurs_on(self, day):
+        """Check whether the rule fires on the given date."""
+        if not self.weekday_mask & (1 << day.weekday()):
+            return False
+        if self.start_date and day < self.start_date:
+            return False
+        if self.end_date and day > self.end_date:
+            return False
+        return not self._is_excluded(day)
+
+    def _is_excluded(self, day):
+        """Check exception dates and holidays."""
+        return day in self.exdates or (self.holidays is not None and day in self.holidays)
+
+    def next_occurrence(self, after):
+        """Return the first fire datetime strictly after `after`, or None."""
+        if not self.weekday_mask:
+            return None
+
+        day = after.date()
+        if after.time() >= self._time:
+            day += timedelta(days=1)
+        if self.start_date and day < self.start_date:
+            day = self.start_date
+
+        while True:
+            day += timedelta(days=self._offsets[day.weekday()])
+            if self.end_date and day > self.end_date:
+                return None
+            if not self._is_excluded(day):
+                return datetime.combine(day, self._time)
+            # Only exception dates and holidays can make us loop
+            day += timedelta(days=1)
+
+    def skip_next(self, after):
+        """Exclude the next occurrence after `after` and return its date (or None)."""
+        occurrence = self.next_occurrence(after)
+        if occurrence is None:
+            return None
+        self.exdates.add(occurrence.date())
+        return occurrence.date()
+
+    def __repr__(self):
+        return (f"Recurrence({self._time.strftime('%H:%M')}, days={mask_to_days(self.weekday_mask)}, "
+                f"start={self.start_date}, end={self.end_date})")
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Event bus topics
+TOPIC_TICK = 'tick'
+TOPIC_WEATHER = 'weather'
+TOPIC_ALERTS = 'alerts'
+TOPIC_EVENTS = 'events'
+TOPIC_ALARM = 'alarm'
+TOPIC_SUNRISE = 'sunrise'
+
+ALERTS_INTERVAL = timedelta(minutes=5)
+RETRY_INTERVAL = timedelta(seconds=30)
+# Sounds of alarms due within the horizon are decoded ahead of time
+SOUND_PRELOAD_INTERVAL = timedelta(minutes=5)
+SOUND_PRELOAD_HORIZON = timedelta(hours=3)
+# Alarms are reloaded from the store when the change feed says so, and
+# at least this often in case a notification was missed
+ALARM_RELOAD_INTERVAL = timedelta(minutes=1)
+# Longest the alarm task sleeps without re-checking the wall clock (seconds)
+MAX_ALARM_WAIT = 60
+
+class EventBus:
+    """Minimal in-loop publish/subscribe bus."""
+
+    def __init__(self):
+        """Initialize the bus with no subscribers."""
+        self._subscribers = defaultdict(list)
+
+    def subscribe(self, *topics):
+        """Return a queue that receives (topic, payload) for the given topics."""
+        queue = asyncio.Queue()
+        for topic in topics:
+            self._subscribers[topic].append(queue)
+        return queue
+
+    def publish(self, topic, payload=None):
+        """Deliver a payload to every subscriber of topic."""
+        for queue in self._subscribers[topic]:
+            queue.put_nowait((topic, payload))
+
+class AlarmRuntime:
+    """Runs each Smart Alarm concern as an independent asyncio task.
+
+    Blocking work (HTTP, Google Calendar) runs in worker threads so a hung
+    call can delay only its own task, never the clock or the alarm check.
+    """
+
+    def __init__(self, display, alarm_manager, weather_manager, on_alarm, on_sunrise=None,
+                 preload_sounds=None):
+        """Initialize the runtime around the existing components."""
+        self.display = display
+        self.alarm_manager = alarm_manager
+        self.weather_manager = weather_manager
+        self.on_alarm = on_alarm
+        self.on_sunrise = on_sunrise
+        self.preload_sounds = preload_sounds
+        self.bus = EventBus()
+        self.loop = None
+        # Own pool, so shutdown never waits on a hung HTTP call
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='runtime')
+        self._alarms_changed = None
+        self._store_changed = None
+        self._stopped = None
+
+    async def run(self):
+        """Run every task until stop() is called."""
+        self.loop = asyncio.get_running_loop()
+        self._alarms_changed = asyncio.Event()
+        self._store_changed = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self.alarm_manager.on_schedule_change = self.notify_alarms_changed
+        self.weather_manager.on_refresh = self._weather_refreshed
+
+        tasks = [
+            asyncio.create_task(self._display_task(), name='display'),
+            asyncio.create_task(self._clock_task(), name='clock'),
+            asyncio.create_task(self._weather_task(), name='weather'),
+            asyncio.create_task(self._alerts_task(), name='alerts'),
+            asyncio.create_task(self._calendar_task(), name='calendar'),
+            asyncio.create_task(self._alarm_task(), name='alarm'),
+        ]
+        if self.alarm_manager.store:
+            tasks.append(asyncio.create_task(self._store_task(), name='store'))
+        if self.preload_sounds:
+            tasks.append(asyncio.create_task(self._sound_task(), name='sounds'))
+        try:
+            await self._stopped.wait()
+        finally:
+            self.alarm_manager.on_schedule_change = None
+            self.weather_manager.on_refresh = None
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        """Request shutdown; safe to call from any thread."""
+        if self.loop and self._stopped and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def notify_alarms_changed(self):
+        """Wake the alarm task after the schedule changed; safe from any thread."""
+        if self.loop and self._alarms_changed and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._alarms_changed.set)
+
+    def notify_store_changed(self):
+        """Reload alarms from the store now; safe from any thread."""
+        if self.loop and self._store_changed and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._store_changed.set)
+
+    def call_in_loop(self, func, *args):
+        """Run func(*args) on the event loop; safe from any thread."""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _weather_refreshed(self, location, data):
+        """Publish weather as soon as a fetch completes; called from the fetch thread.
+
+        The weather task is served the stale value while the background
+        revalidation runs, so without this the display would lag a full TTL.
+        """
+        if location != self.weather_manager.location or not self.loop or self.loop.is_closed():
+            return
+        for topic, name in ((TOPIC_WEATHER, 'current'), (TOPIC_ALERTS, 'alerts')):
+            if data.get(name):
+                self.loop.call_soon_threadsafe(self.bus.publish, topic, data[name])
+
+    def _in_thread(self, func):
+        """Run a blocking callable on the runtime's worker pool."""
+        return self.loop.run_in_executor(self.executor, func)
+
+    async def _periodic(self, name, interval, func, topic):
+        """Call a blocking func in a thread every interval and publish its result."""
+        while True:
+            try:
+                result = await self._in_thread(func)
+                if result:
+                    self.bus.publish(topic, result)
+                delay = interval
+            except Exception as e:
+                logger.error(f"Error in {name} task: {str(e)}")
+                delay = RETRY_INTERVAL
+            await asyncio.sleep(delay.total_seconds())
+
+    async def _clock_task(self):
+        """Redraw the clock on each minute boundary."""
+        while True:
+            now = datetime.now()
+            self.bus.publish(TOPIC_TICK, now)
+            await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
+
+    async def _weather_task(self):
+        """Refresh current weather once per cache TTL."""
+        await self._periodic('weather', self.weather_manager.cache_duration,
+                             self.weather_manager.get_current_weather, TOPIC_WEATHER)
+
+    async def _alerts_task(self):
+        """Refresh weather alerts."""
+        await self._periodic('alerts', ALERTS_INTERVAL,
+                             self.weather_manager.get_alerts, TOPIC_ALERTS)
+
+    async def _calendar_task(self):
+        """Sync the calendar; the fetch runs in a thread, the schedule is updated here."""
+        while True:
+            events = None
+            try:
+                events = await self._in_thread(self.alarm_manager.fetch_calendar_events)
+                if events is not None:
+                    self.alarm_manager.set_calendar_events(events)
+                    self.bus.publish(TOPIC_EVENTS, self.alarm_manager.get_upcoming_events())
+            except Exception as e:
+                logger.error(f"Error in calendar task: {str(e)}")
+            delay = self.alarm_manager.sync_interval if events is not None else RETRY_INTERVAL
+            await asyncio.sleep(delay.total_seconds())
+
+    async def _store_task(self):
+        """Reload this device's alarms; the query runs in a thread, the schedule is updated here."""
+        while True:
+            alarms = None
+            self._store_changed.clear()
+            try:
+                alarms = await self._in_thread(self.alarm_manager.fetch_alarms)
+                if alarms is not None:
+                    self.alarm_manager.set_alarms(alarms)
+            except Exception as e:
+                logger.error(f"Error in store task: {str(e)}")
+            delay = ALARM_RELOAD_INTERVAL if alarms is not None else RETRY_INTERVAL
+            waiter = asyncio.ensure_future(self._store_changed.wait())
+            try:
+                await asyncio.wait({waiter}, timeout=delay.total_seconds())
+            finally:
+                waiter.cancel()
+
+    async def _sound_task(self):
+        """Keep the sounds of upcoming alarms decoded; decoding runs in a thread."""
+        while True:
+            try:
+                sounds = self.alarm_manager.upcoming_sounds(SOUND_PRELOAD_HORIZON)
+                await self._in_thread(lambda: self.preload_sounds(sounds))
+            except Exception as e:
+                logger.error(f"Error in sounds task: {str(e)}")
+            await asyncio.sleep(SOUND_PRELOAD_INTERVAL.total_seconds())
+
+    async def _alarm_task(self):
+        """Sleep until the next scheduler deadline, then fire due alarms."""
+        while True:
+            timeout = self.alarm_manager.seconds_until_next_alarm()
+            # Wake at least every MAX_ALARM_WAIT so a wall-clock step (resume,
+            # NTP at boot) is noticed and the deadlines re-anchored in time
+            timeout = MAX_ALARM_WAIT if timeout is None else min(timeout, MAX_ALARM_WAIT)
+            self._alarms_changed.clear()
+            # asyncio.wait rather than wait_for: wait_for can swallow a cancel
+            # that races with the event being set
+            waiter = asyncio.ensure_future(self._alarms_changed.wait())
+            try:
+                changed, _ = await asyncio.wait({waiter}, timeout=timeout)
+            finally:
+                waiter.cancel()
+            if changed:
+                # Schedule changed: recompute the deadline
+                self.bus.publish(TOPIC_EVENTS, self.alarm_manager.get_upcoming_events())
+                continue
+            try:
+                if self.alarm_manager.check_alarms():
+                    self.bus.publish(TOPIC_ALARM, self.alarm_manager.get_current_alarm_config())
+                for sunrise in self.alarm_manager.take_sunrises():
+                    self.bus.publish(TOPIC_SUNRISE, sunrise)
+                self.bus.publish(TOPIC_EVENTS, self.alarm_manager.get_upcoming_events())
+            except Exception as e:
+                logger.error(f"Error checking alarms: {str(e)}")
+
+    async def _display_task(self):
+        """Apply bus events to the display; the only task that draws."""
+        queue = self.bus.subscribe(TOPIC_TICK, TOPIC_WEATHER, TOPIC_ALERTS, TOPIC_EVENTS,
+                                   TOPIC_ALARM, TOPIC_SUNRISE)
+        while True:
+            topic, payload = await queue.get()
+            try:
+                if topic == TOPIC_TICK:
+                    self.display.update_time()
+                elif topic == TOPIC_WEATHER:
+                    self.display.update_weather(payload)
+                elif topic == TOPIC_ALERTS:
+                    self.display.show_alerts(payload)
+                elif topic == TOPIC_EVENTS:
+                    self.display.update_events(payload)
+                elif topic == TOPIC_ALARM:
+                    self.on_alarm(payload)
+                elif topic == TOPIC_SUNRISE and self.on_sunrise:
+                    self.on_sunrise(payload)
+            except Exception as e:
+                logger.error(f"Error handling {topic} event: {str(e)}")
@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import logging
+from clock import SystemClock
+
+logger = logging.getLogger(__name__)
+
+# Wall/monotonic offset change (seconds) treated as a clock step or resume
+CLOCK_STEP_TOLERANCE = 2.0
+
+class AlarmScheduler:
+    """Min-heap of upcoming fire times keyed by alarm or event.
+
+    Each entry carries a monotonic deadline derived from its wall-clock fire
+    time. Deadlines are re-anchored whenever the wall clock steps (NTP,
+    manual change, suspend/resume), so waiting is immune to drift while
+    firing still follows the wall clock.
+    """
+
+    def __init__(self, clock=None):
+        """Initialize an empty scheduler."""
+        self.clock = clock or SystemClock()
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._offset = self.clock.time() - self.clock.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _deadline(self, fire_time):
+        """Convert a naive local fire time into a monotonic deadline."""
+        # timestamp() goes through the local timezone, so DST shifts are accounted for
+        return fire_time.timestamp() - self._offset
+
+    def schedule(self, key, fire_time):
+        """Schedule (or reschedule) key to fire at fire_time."""
+        self.cancel(key)
+        if fire_time is None:
+            return
+        entry = [self._deadline(fire_time), next(self._counter), key, fire_time, True]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, key):
+        """Remove key from the schedule if present."""
+        entry = self._entries.pop(key, None)
+        if entry:
+            # Lazy deletion: mark the heap entry stale instead of re-heapifying
+            entry[-1] = False
+
+    def clear(self):
+        """Remove every scheduled entry."""
+        self._heap = []
+        self._entries.clear()
+
+    def _check_clock_step(self):
+        """Re-anchor deadlines if the wall clock moved relative to monotonic time."""
+        offset = self.clock.time() - self.clock.monotonic()
+        if abs(offset - self._offset) <= CLOCK_STEP_TOLERANCE:
+            return
+        logger.info(f"Wall clock stepped by {offset - self._offset:+.1f}s, re-anchoring deadlines")
+        self._offset = offset
+        self._heap = []
+        for entry in self._entries.values():
+            entry[0] = self._deadline(entry[3])
+            self._heap.append(entry)
+        heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        """Discard cancelled entries sitting at the top of the heap."""
+        while self._heap and not self._heap[0][-1]:
+            heapq.heappop(self._heap)
+
+    def peek(self):
+        """Return (fire_time, key) for the next entry, or None."""
+        self._drop_stale()
+        if not self._heap:
+            return None
+        _, _, key, fire_time, _ = self._heap[0]
+        return fire_time, key
+
+    def next_fire_time(self, key):
+        """Return the scheduled fire time for key, or None."""
+        entry = self._entries.get(key)
+        return entry[3] if entry else None
+
+    def pop_due(self):
+        """Pop and return [(fire_time, key)] for every entry whose deadline has passed."""
+        self._check_clock_step()
+        now = self.clock.monotonic()
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            entry = heapq.heappop(self._heap)
+            del self._entries[entry[2]]
+            due.append((entry[3], entry[2]))
+        return due
+
+    def seconds_until_next(self):
+        """Seconds until the next entry is due (0 if overdue, None if empty)."""
+        self._check_clock_step()
+        self._drop_stale()
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock.monotonic())
+
+    def upcoming(self, limit=None):
+        """Return [(fire_time, key)] in fire order without consuming entries."""
+        entries = sorted(self._entries.values())
+        if limit is not None:
+            entries = entries[:limit]
+        return [(fire_time, key) for _, _, key, fire_time, _ in entries]
@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+import pygame
+
+logger = logging.getLogger(__name__)
+
+# Decoded PCM kept in memory; a 3 minute 44.1 kHz stereo track is ~30 MB
+DEFAULT_BUDGET_BYTES = int(os.getenv('SOUND_CACHE_MB', '64')) * 1024 * 1024
+
+class SoundCache:
+    """LRU cache of sounds decoded to PCM (pygame.mixer.Sound), bounded by bytes.
+
+    Decoding an MP3 on a Pi 3 takes far longer than starting playback of
+    PCM that is already in memory, so sounds that may be needed soon are
+    decoded ahead of time and alarms start from the cached copy.
+    """
+
+    def __init__(self, sounds_dir='sounds', max_bytes=DEFAULT_BUDGET_BYTES):
+        """Initialize the cache for sounds under sounds_dir."""
+        self.sounds_dir = sounds_dir
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One decode at a time; a second request for the same file waits for it
+        self._decode_lock = threading.Lock()
+
+    def _path(self, sound_file):
+        """Full path of a sound file."""
+        return os.path.join(self.sounds_dir, sound_file)
+
+    @staticmethod
+    def _pcm_bytes(sound):
+        """Bytes of PCM held by a decoded sound."""
+        frequency, sample_format, channels = pygame.mixer.get_init()
+        return int(sound.get_length() * frequency * channels * (abs(sample_format) // 8))
+
+    def cached(self, sound_file):
+        """Return the decoded sound if cached, without decoding."""
+        with self._lock:
+            entry = self._entries.get(sound_file)
+            if entry is not None:
+                self._entries.move_to_end(sound_file)
+                self.hits += 1
+                return entry[0]
+        return None
+
+    def get(self, sound_file):
+        """Return a decoded Sound, decoding it on a miss. Raises if it cannot be loaded."""
+        sound = self.cached(sound_file)
+        if sound is not None:
+            return sound
+
+        with self._decode_lock:
+            # Another thread may have decoded it while we waited
+            with self._lock:
+                entry = self._entries.get(sound_file)
+            if entry is not None:
+                return entry[0]
+
+            path = self._path(sound_file)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Sound file not found: {path}")
+            start = time.perf_counter()
+            sound = pygame.mixer.Sound(path)
+            size = self._pcm_bytes(sound)
+            logger.info(f"Decoded {sound_file}: {size / 1048576:.1f} MB PCM "
+                        f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+            with self._lock:
+                self.misses += 1
+                self._entries[sound_file] = (sound, size)
+                self.size_bytes += size
+                while self.size_bytes > self.max_bytes and len(self._entries) > 1:
+                    evicted, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.size_bytes -= evicted_size
+                    logger.info(f"Evicted {evicted} from sound cache")
+        return sound
+
+    def preload(self, sound_files):
+        """Decode each sound not already cached; failures are logged, not raised."""
+        for sound_file in sound_files:
+            if not sound_file:
+                continue
+            try:
+                with self._lock:
+                    if sound_file in self._entries:
+                        continue
+                self.get(sound_file)
+            except Exception as e:
+                logger.error(f"Error preloading sound {sound_file}: {str(e)}")
+
+    def play(self, sound_file, loops=-1, volume=1.0):
+        """Start a sound from cached PCM. Returns the Channel, or None if none was free."""
+        channel = self.get(sound_file).play(loops=loops)
+        if channel is not None:
+            channel.set_volume(volume)
+        return channel
+
+    def invalidate(self, sound_file=None):
+        """Drop one sound (e.g. after it was replaced on disk) or all of them."""
+        with self._lock:
+            for key in [k for k in self._entries if sound_file is None or k == sound_file]:
+                _, size = self._entries.pop(key)
+                self.size_bytes -= size
+
+def benchmark(sound_file='lofi-alarm.mp3', sounds_dir=None, runs=5):
+    """Measure trigger-to-playing latency for streamed, cold-decoded and cached sounds."""
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.mixer.init()
+    sounds_dir = sounds_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sounds')
+    path = os.path.join(sounds_dir, sound_file)
+
+    def wait_busy(is_busy):
+        while not is_busy():
+            time.sleep(0.0001)
+
+    def measure(start_playback, is_busy, stop):
+        start = time.perf_counter()
+        start_playback()
+        wait_busy(is_busy)
+        latency = (time.perf_counter() - start) * 1000
+        stop()
+        return latency
+
+    results = {'music.load (streamed)': [], 'Sound decode (cold)': [], 'SoundCache (cached)': []}
+    for _ in range(runs):
+        results['music.load (streamed)'].append(measure(
+            lambda: (pygame.mixer.music.load(path), pygame.mixer.music.play(-1)),
+            lambda: pygame.mixer.music.get_pos() > 0, pygame.mixer.music.stop))
+
+        cache = SoundCache(sounds_dir)
+        channels = []
+        results['Sound decode (cold)'].append(measure(
+            lambda: channels.append(cache.play(sound_file)),
+            lambda: channels[-1].get_busy(), lambda: channels[-1].stop()))
+
+        results['SoundCache (cached)'].append(measure(
+            lambda: channels.append(cache.play(sound_file)),
+            lambda: channels[-1].get_busy(), lambda: channels[-1].stop()))
+
+    print(f"{sound_file} ({os.path.getsize(path) / 1048576:.1f} MB), driver={os.environ['SDL_AUDIODRIVER']}")
+    for name, latencies in results.items():
+        latencies.sort()
+        print(f"{name:>22}: median {latencies[len(latencies) // 2]:8.2f} ms, worst {latencies[-1]:8.2f} ms")
+    pygame.mixer.quit()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'benchmark':
+        print("Usage: SDL_AUDIODRIVER=dummy python sound_cache.py benchmark [sound_file] [runs]")
+        sys.exit(1)
+
+    benchmark(
+        sound_file=sys.argv[2] if len(sys.argv) > 2 else 'lofi-alarm.mp3',
+        runs=int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    )
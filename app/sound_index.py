@@ -0,0 +1,387 @@
+import os
+import json
+import fcntl
+import shutil
+import struct
+import hashlib
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+import pygame
+
+logger = logging.getLogger(__name__)
+
+SOUND_EXTENSIONS = ('.mp3', '.wav', '.ogg')
+INDEX_FILE = '.sound_index.json'
+# Bump when the analysis changes so existing entries are recomputed
+INDEX_VERSION = 2
+# Loudness sounds are attenuated towards (RMS, dB full scale). Quieter sounds
+# are not boosted, and louder ones keep their rank among the others
+TARGET_RMS_DB = -20.0
+WAVEFORM_POINTS = 64
+# ffmpeg decodes for analysis at this rate; plenty for loudness and a preview
+ANALYSIS_SAMPLE_RATE = 22050
+DECODE_TIMEOUT = 60
+# Fields of a file that could not be decoded: listed, played at unit gain
+UNANALYSED = {'duration': None, 'peak_db': None, 'rms_db': None, 'gain': 1.0, 'waveform': []}
+
+# Bytes read from the start of a file (after any ID3v2 tag) to identify it
+PROBE_BYTES = 64 * 1024
+# Consecutive MPEG frames, each where the last one ends, before data is taken for an MP3
+MP3_MIN_FRAMES = 3
+
+# MPEG audio header tables: [version][index]
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MP3_BITRATES_V1_L3 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+MP3_BITRATES_V2_L3 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+
+def file_hash(path, chunk_size=64 * 1024):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _id3_size(header):
+    """Length of a leading ID3v2 tag, or 0 if there is none."""
+    if header[:3] != b'ID3' or len(header) < 10:
+        return 0
+    size = header[6:10]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + footer + ((size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3])
+
+def _mp3_frame(header, i):
+    """Parse the MPEG Layer III frame header at offset i. Returns (info, frame length) or None."""
+    if i + 4 > len(header) or header[i] != 0xFF or header[i + 1] & 0xE0 != 0xE0:
+        return None
+    version = (header[i + 1] >> 3) & 0x03
+    layer = (header[i + 1] >> 1) & 0x03
+    bitrate_index = header[i + 2] >> 4
+    rate_index = (header[i + 2] >> 2) & 0x03
+    if version == 1 or layer != 1 or rate_index == 3 or bitrate_index in (0, 15):
+        return None  # Reserved values: not a Layer III frame header
+    bitrates = MP3_BITRATES_V1_L3 if version == 3 else MP3_BITRATES_V2_L3
+    info = {
+        'format': 'mp3',
+        'sample_rate': MP3_SAMPLE_RATES[version][rate_index],
+        'channels': 1 if header[i + 3] >> 6 == 3 else 2,
+        'bitrate': bitrates[bitrate_index] * 1000
+    }
+    padding = (header[i + 2] >> 1) & 0x01
+    length = (144 if version == 3 else 72) * info['bitrate'] // info['sample_rate'] + padding
+    return info, length
+
+def _probe_mp3(header):
+    """Parse the MPEG audio frames that must start the data (right after any ID3v2 tag).
+
+    The first MP3_MIN_FRAMES frame headers must each sit where the previous
+    frame ends and agree on the sample rate, so arbitrary data that happens
+    to contain a plausible header is not taken for an MP3.
+    """
+    offset = _id3_size(header)
+    frame = _mp3_frame(header, offset)
+    if frame is None:
+        return None
+    info, length = frame
+    for _ in range(MP3_MIN_FRAMES - 1):
+        offset += length
+        frame = _mp3_frame(header, offset)
+        if frame is None or frame[0]['sample_rate'] != info['sample_rate']:
+            return None
+        length = frame[1]
+    return info
+
+def _probe_wav(header):
+    """Parse the fmt chunk of a RIFF/WAVE file."""
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id, chunk_size = header[offset:offset + 4], struct.unpack('<I', header[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ' and offset + 24 <= len(header):
+            _, channels, sample_rate, byte_rate = struct.unpack('<HHII', header[offset + 8:offset + 20])
+            return {'format': 'wav', 'sample_rate': sample_rate, 'channels': channels, 'bitrate': byte_rate * 8}
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+def _probe_ogg(header):
+    """Parse the Vorbis identification header of an Ogg file."""
+    if header[:4] != b'OggS':
+        return None
+    start = header.find(b'\x01vorbis')
+    if start < 0 or start + 24 > len(header):
+        return None
+    channels, sample_rate, _, nominal_bitrate = struct.unpack('<BIiI', header[start + 11:start + 24])
+    if not channels or not sample_rate:
+        return None
+    return {'format': 'ogg', 'sample_rate': sample_rate, 'channels': channels, 'bitrate': nominal_bitrate}
+
+def probe_audio(header):
+    """Identify audio from its first bytes (not its name). Returns a dict or None."""
+    for probe in (_probe_wav, _probe_ogg, _probe_mp3):
+        info = probe(header)
+        if info:
+            return info
+    return None
+
+def probe_file(path):
+    """Identify an audio file from its header, reading past an ID3v2 tag of any size."""
+    with open(path, 'rb') as f:
+        header = f.read(PROBE_BYTES)
+        tag = _id3_size(header)
+        if tag:
+            # Cover art can make the tag longer than the bytes read
+            f.seek(tag)
+            return _probe_mp3(f.read(PROBE_BYTES))
+    return probe_audio(header)
+
+def _decode_mixer(path):
+    """Decode with the running pygame mixer. Returns (samples, duration)."""
+    sound = pygame.mixer.Sound(path)
+    return pygame.sndarray.array(sound).astype(np.float32) / 32768.0, sound.get_length()
+
+def _decode_ffmpeg(path):
+    """Decode to 16-bit stereo PCM with ffmpeg. Returns (samples, duration)."""
+    result = subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', path, '-vn',
+         '-ac', '2', '-ar', str(ANALYSIS_SAMPLE_RATE), '-f', 's16le', '-'],
+        check=True, timeout=DECODE_TIMEOUT, capture_output=True
+    )
+    samples = np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, 2).astype(np.float32) / 32768.0
+    if not samples.size:
+        raise ValueError("No audio decoded")
+    return samples, len(samples) / ANALYSIS_SAMPLE_RATE
+
+def decode(path):
+    """Decode a sound for analysis. Returns (samples, duration), or None without a decoder.
+
+    The device uses its already running mixer. The API server has no audio
+    device to open a mixer on, so it decodes with ffmpeg instead.
+    """
+    if pygame.mixer.get_init():
+        return _decode_mixer(path)
+    if shutil.which('ffmpeg'):
+        return _decode_ffmpeg(path)
+    return None
+
+def analyze(path):
+    """Decode a sound and measure it: duration, peak/RMS, gain and a waveform preview.
+
+    Returns None when no decoder is available; raises if the file does not decode.
+    """
+    decoded = decode(path)
+    if decoded is None:
+        return None
+    samples, duration = decoded
+    if samples.ndim > 1:
+        samples = np.abs(samples).max(axis=1)
+    else:
+        samples = np.abs(samples)
+
+    peak = float(samples.max()) if samples.size else 0.0
+    rms = float(np.sqrt(np.mean(np.square(samples)))) if samples.size else 0.0
+    rms_db = 20 * np.log10(rms) if rms > 0 else -120.0
+    # Only ever attenuate: gain <= 1.0 can be applied as playback volume and
+    # never clips, and escalation can still switch to a louder sound
+    gain = min(10 ** ((TARGET_RMS_DB - rms_db) / 20), 1.0) if rms > 0 else 1.0
+
+    buckets = np.array_split(samples, WAVEFORM_POINTS) if samples.size >= WAVEFORM_POINTS else [samples]
+    waveform = [int(round(float(b.max()) * 100)) if b.size else 0 for b in buckets]
+
+    return {
+        'duration': round(duration, 3),
+        'peak_db': round(float(20 * np.log10(peak)), 2) if peak > 0 else -120.0,
+        'rms_db': round(float(rms_db), 2),
+        'gain': round(float(gain), 4),
+        'waveform': waveform
+    }
+
+class SoundIndex:
+    """Metadata for every sound in a directory, persisted next to the sounds.
+
+    Entries are keyed by filename and reanalysed only when a file's size or
+    mtime changes, so a refresh after the first build is a directory scan.
+
+    The file on disk is shared by every process serving the directory (API
+    workers and the device). Reads pick up a newer file by its mtime, and
+    writes are a locked reload-modify-save, so an upload handled by one
+    worker is visible to all of them.
+    """
+
+    def __init__(self, sounds_dir='sounds', path=None):
+        """Initialize the index and load the persisted copy."""
+        self.sounds_dir = sounds_dir
+        self.path = path or os.path.join(sounds_dir, INDEX_FILE)
+        self._entries = {}
+        self._lock = threading.RLock()
+        # mtime_ns of the file the entries were last loaded from or saved to
+        self._mtime = None
+        self.version = None
+        self._update_version()
+        self._load()
+
+    def _load(self):
+        """Load persisted entries (caller holds the lock or is __init__)."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading sound index: {str(e)}")
+            return
+        self._mtime = mtime
+        self._entries = data.get('sounds', {}) if data.get('version') == INDEX_VERSION else {}
+        self._update_version()
+
+    def _reload_if_changed(self):
+        """Pick up the file if another process saved it since we last read it."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load()
+
+    def _save(self):
+        """Persist the index atomically (caller holds the lock)."""
+        try:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'sounds': self._entries}, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.error(f"Error saving sound index: {str(e)}")
+
+    @contextmanager
+    def _writing(self):
+        """Reload, let the caller change the entries, then save; locked across processes."""
+        with self._lock, open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload_if_changed()
+                yield self._entries
+                self._update_version()
+                self._save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update_version(self):
+        """Recompute the content version used for ETags."""
+        digest = hashlib.sha256()
+        for filename in sorted(self._entries):
+            digest.update(f"{filename}:{self._entries[filename]['hash']};".encode())
+        self.version = digest.hexdigest()[:32]
+    def build_entry(self, path, strict=False):
+        """Build the entry for a sound file, which may still be outside the sounds directory.
+
+        A file that does not decode is still given an (unanalysed) entry,
+        unless strict, in which case the decoding error is raised.
+        """
+        stat = os.stat(path)
+        info = probe_file(path) or {}
+        entry = {
+            'hash': file_hash(path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'format': info.get('format'),
+            'sample_rate': info.get('sample_rate'),
+            'channels': info.get('channels'),
+            'bitrate': info.get('bitrate')
+        }
+        try:
+            analysis = analyze(path)
+        except Exception as e:
+            if strict:
+                raise
+            logger.warning(f"Could not analyse sound {os.path.basename(path)}: {str(e)}")
+            analysis = None
+        if analysis is None:
+            analysis = dict(UNANALYSED)
+            # Estimated from the header so the list still shows a length
+            if info.get('bitrate'):
+                analysis['duration'] = round(stat.st_size * 8 / info['bitrate'], 3)
+        entry.update(analysis)
+        return entry
+
+    def refresh(self):
+        """Add new or changed files and drop deleted ones. Returns True if anything changed."""
+        try:
+            filenames = {f for f in os.listdir(self.sounds_dir) if f.lower().endswith(SOUND_EXTENSIONS)}
+        except OSError as e:
+            logger.error(f"Error scanning sounds: {str(e)}")
+            return False
+
+        # Entries indexed without a decoder are analysed once one is available
+        decoder_available = bool(pygame.mixer.get_init() or shutil.which('ffmpeg'))
+        entries = self.entries()
+        analysed = {}
+        for filename in sorted(filenames):
+            entry = entries.get(filename)
+            try:
+                stat = os.stat(os.path.join(self.sounds_dir, filename))
+                if (entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+                        and (entry['rms_db'] is not None or not decoder_available)):
+                    continue
+                analysed[filename] = self.build_entry(os.path.join(self.sounds_dir, filename))
+            except Exception as e:
+                logger.error(f"Error indexing sound {filename}: {str(e)}")
+
+        removed = set(entries) - filenames
+        if not analysed and not removed:
+            return False
+        with self._writing() as current:
+            for filename in removed:
+                current.pop(filename, None)
+            current.update(analysed)
+        logger.info(f"Sound index updated: {len(self._entries)} sounds")
+        return True
+
+    def update(self, filename):
+        """(Re)analyse one file in the sounds directory. Returns its entry."""
+        entry = self.build_entry(os.path.join(self.sounds_dir, filename))
+        self.add(filename, entry)
+        return entry
+
+    def add(self, filename, entry):
+        """Store an entry built with build_entry(), e.g. for an upload moved into place."""
+        with self._writing() as current:
+            current[filename] = entry
+
+    def remove(self, filename):
+        """Drop a file from the index."""
+        if self.get(filename) is None:
+            return
+        with self._writing() as current:
+            current.pop(filename, None)
+
+    def get(self, filename):
+        """Entry for a file, or None."""
+        self._reload_if_changed()
+        with self._lock:
+            return self._entries.get(filename)
+
+    def find_by_hash(self, content_hash):
+        """Filename of an indexed file with this content (or uploaded source) hash, or None."""
+        self._reload_if_changed()
+        with self._lock:
+            return next((f for f, e in self._entries.items()
+                         if content_hash in (e['hash'], e.get('source_hash'))), None)
+
+    def gain(self, filename):
+        """Normalisation gain (at most 1.0) for a file; 1.0 when it is not indexed."""
+        entry = self.get(filename)
+        return entry['gain'] if entry else 1.0
+
+    def entries(self):
+        """All entries as {filename: entry}, sorted by filename."""
+        self._reload_if_changed()
+        with self._lock:
+            return {f: dict(self._entries[f]) for f in sorted(self._entries)}
@@ -0,0 +1,171 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.utils import secure_filename
+from sound_index import probe_file
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv('SOUND_UPLOAD_MB', '10')) * 1024 * 1024
+# What the device's mixer plays without resampling
+PLAYBACK_FORMAT = os.getenv('SOUND_PLAYBACK_FORMAT', 'ogg')
+PLAYBACK_SAMPLE_RATE = 44100
+CHUNK_SIZE = 64 * 1024
+TRANSCODE_TIMEOUT = 120
+# Finished jobs remembered for status queries
+MAX_JOBS = 100
+
+FFMPEG_CODECS = {
+    'ogg': ['-c:a', 'libvorbis', '-q:a', '5'],
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    'wav': ['-c:a', 'pcm_s16le']
+}
+
+class UploadError(ValueError):
+    """An upload was rejected; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class SoundUploads:
+    """Receives sound uploads and finishes them on a background worker.
+
+    The request thread only streams the body to a temp file, hashing and
+    size-checking as it goes, and probes the header. Transcoding, moving
+    the file into place and indexing it happen on a single worker thread.
+    """
+
+    def __init__(self, sounds_dir, index, cache=None, max_bytes=MAX_UPLOAD_BYTES):
+        """Initialize the pipeline for sounds_dir and its SoundIndex."""
+        self.sounds_dir = sounds_dir
+        self.index = index
+        self.cache = cache
+        self.max_bytes = max_bytes
+        # Inside the sounds directory so finished files move with a rename
+        self.tmp_dir = os.path.join(sounds_dir, '.uploads')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sound-upload')
+        self.jobs = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def receive(self, stream, filename):
+        """Stream an upload to disk and queue it. Returns the job (or the existing sound's job)."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadError(f"File exceeds {self.max_bytes // (1024 * 1024)} MB", 413)
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            info = probe_file(tmp_path)
+            if info is None:
+                raise UploadError("Not a supported audio file (MP3, Ogg Vorbis or WAV)", 415)
+
+            content_hash = digest.hexdigest()
+            with self._lock:
+                existing = self.index.find_by_hash(content_hash)
+                if existing:
+                    os.unlink(tmp_path)
+                    return {'id': None, 'status': 'done', 'filename': existing, 'duplicate': True}
+                if content_hash in self._pending:
+                    os.unlink(tmp_path)
+                    return dict(self._pending[content_hash], duplicate=True)
+
+                job = {
+                    'id': uuid.uuid4().hex,
+                    'status': 'queued',
+                    'filename': self._target_name(filename, info),
+                    'hash': content_hash,
+                    'size': size,
+                    'format': info['format'],
+                    'duplicate': False
+                }
+                self.jobs[job['id']] = job
+                self._pending[content_hash] = job
+                while len(self.jobs) > MAX_JOBS:
+                    self.jobs.pop(next(iter(self.jobs)))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self.executor.submit(self._process, job, tmp_path, info)
+        logger.info(f"Queued sound upload {job['filename']} ({size} bytes, {info['format']})")
+        return dict(job)
+
+    def _needs_transcode(self, info):
+        """Whether an upload should be converted to the playback format."""
+        return ((info['format'] != PLAYBACK_FORMAT or info['sample_rate'] != PLAYBACK_SAMPLE_RATE)
+                and PLAYBACK_FORMAT in FFMPEG_CODECS and shutil.which('ffmpeg') is not None)
+
+    def _target_name(self, filename, info):
+        """A safe, unused filename with the extension of the stored format."""
+        stem = os.path.splitext(secure_filename(filename or ''))[0] or 'sound'
+        extension = PLAYBACK_FORMAT if self._needs_transcode(info) else info['format']
+        reserved = {job['filename'] for job in self._pending.values()}
+        name, counter = f"{stem}.{extension}", 1
+        while os.path.exists(os.path.join(self.sounds_dir, name)) or name in reserved:
+            counter += 1
+            name = f"{stem}-{counter}.{extension}"
+        return name
+
+    def _transcode(self, source, target):
+        """Convert source to the playback format and sample rate with ffmpeg."""
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', source,
+             '-vn', '-ar', str(PLAYBACK_SAMPLE_RATE)] + FFMPEG_CODECS[PLAYBACK_FORMAT] + [target],
+            check=True, timeout=TRANSCODE_TIMEOUT, capture_output=True
+        )
+
+    def _process(self, job, tmp_path, info):
+        """Worker: transcode if needed, analyse, then move into place and index.
+
+        The file only enters the sounds directory once it has decoded, so a
+        failed upload leaves nothing behind.
+        """
+        job['status'] = 'processing'
+        converted = None
+        try:
+            source = tmp_path
+            if self._needs_transcode(info):
+                converted = f"{tmp_path}.{PLAYBACK_FORMAT}"
+                self._transcode(tmp_path, converted)
+                source = converted
+
+            # A rename keeps size and mtime, so the entry stays valid once moved
+            entry = self.index.build_entry(source, strict=True)
+            entry['source_hash'] = job['hash']
+            os.replace(source, os.path.join(self.sounds_dir, job['filename']))
+            self.index.add(job['filename'], entry)
+            if self.cache:
+                self.cache.invalidate(job['filename'])
+            job['status'] = 'done'
+            logger.info(f"Processed sound upload {job['filename']}")
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"Error processing sound upload {job['filename']}: {str(e)}")
+        finally:
+            for path in (tmp_path, converted):
+                if path and os.path.exists(path):
+                    os.unlink(path)
+            with self._lock:
+                self._pending.pop(job['hash'], None)
+
+    def status(self, job_id):
+        """A copy of a job's state, or None."""
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
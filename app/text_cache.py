@@ -0,0 +1,81 @@
+import logging
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+# Characters pre-rasterised as tiles for the clock face
+CLOCK_CHARACTERS = '0123456789:'
+
+class TextCache:
+    """LRU cache of rasterised text masks, bounded by total pixel bytes.
+
+    Masks are 8-bit coverage images, so the same entry is reused for any
+    colour: drawing pastes the colour through the mask, which gives the
+    same anti-aliased result as ImageDraw.text without calling FreeType.
+    """
+
+    def __init__(self, fonts, max_bytes=4 * 1024 * 1024):
+        """Initialize the cache for a dict of named fonts."""
+        self.fonts = fonts
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def _key(self, font_name, text):
+        """Cache key: font name, point size and text."""
+        return font_name, getattr(self.fonts[font_name], 'size', None), text
+
+    def get(self, font_name, text):
+        """Return (mask, (dx, dy), advance) for text, rasterising it on a miss."""
+        key = self._key(font_name, text)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = self._render(self.fonts[font_name], text)
+        self._entries[key] = entry
+        self.size_bytes += entry[0].width * entry[0].height
+        while self.size_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (mask, _, _) = self._entries.popitem(last=False)
+            self.size_bytes -= mask.width * mask.height
+        return entry
+
+    @staticmethod
+    def _render(font, text):
+        """Rasterise text into a tight coverage mask."""
+        left, top, right, bottom = font.getbbox(text)
+        mask = Image.new('L', (max(right - left, 1), max(bottom - top, 1)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        return mask, (left, top), font.getlength(text)
+
+    def draw(self, image, xy, text, font_name, fill):
+        """Draw text onto image at xy, like ImageDraw.text."""
+        mask, (dx, dy), _ = self.get(font_name, text)
+        x, y = int(xy[0]) + dx, int(xy[1]) + dy
+        image.paste(fill, (x, y, x + mask.width, y + mask.height), mask)
+
+    def draw_tiled(self, image, xy, text, font_name, fill):
+        """Draw text from per-character tiles (for the clock's digits)."""
+        x, y = xy
+        for char in text:
+            mask, (dx, dy), advance = self.get(font_name, char)
+            left, top = int(round(x)) + dx, int(y) + dy
+            image.paste(fill, (left, top, left + mask.width, top + mask.height), mask)
+            x += advance
+
+    def warm(self, font_name, characters=CLOCK_CHARACTERS):
+        """Pre-rasterise single-character tiles."""
+        for char in characters:
+            self.get(font_name, char)
+
+    def invalidate(self, font_name=None):
+        """Drop entries for one font (or all fonts)."""
+        for key in [k for k in self._entries if font_name is None or k[0] == font_name]:
+            mask, _, _ = self._entries.pop(key)
+            self.size_bytes -= mask.width * mask.height
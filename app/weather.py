@@ -1,176 +1,198 @@
-import os
 import json
 import logging
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from weather_cache import FileWeatherCache
 
 logger = logging.getLogger(__name__)
 
+# Longest forecast the weather API serves
+MAX_FORECAST_DAYS = 14
+
 class WeatherManager:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None, location='auto:ip', request_timeout=10):
         """Initialize the weather manager."""
         self.api_key = api_key
         self.base_url = "http://api.weatherapi.com/v1"
-        self.cache = {}
+        self.cache = cache if cache is not None else FileWeatherCache()
+        self.location = location  # Default query: IP-based location
         self.cache_duration = timedelta(minutes=15)  # Cache weather data for 15 minutes
+        self.forecast_cache_duration = timedelta(minutes=15)
+        self.alerts_cache_duration = timedelta(minutes=5)  # Shorter cache for alerts
+        self.forecast_days = 3  # Days fetched alongside current weather and alerts
+        self.request_timeout = request_timeout
+
+        # Stale-while-revalidate: expired entries are served while a single
+        # background fetch per location refreshes every key at once
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='weather')
+        # Called as on_refresh(location, {name: data}) from the fetch thread
+        # after every successful fetch, so callers can show fresh data as
+        # soon as a background revalidation lands
+        self.on_refresh = None
+
         logger.info("Weather manager initialized")
 
-    def get_current_weather(self):
-        """Get current weather data."""
+    def _ttls(self, keys):
+        """Map cache keys to their freshness policy."""
+        ttls = {}
+        for key in keys:
+            name = key.rsplit('|', 1)[-1]
+            if name == 'alerts':
+                ttls[key] = self.alerts_cache_duration
+            elif name.startswith('forecast_'):
+                ttls[key] = self.forecast_cache_duration
+            else:
+                ttls[key] = self.cache_duration
+        return ttls
+
+    def _get_cached(self, location, name, ttl, days=None):
+        """Return cached data, refreshing it in the background once stale."""
+        location = location or self.location
+        key = f"{location}|{name}"
+        entry = self.cache.get(key)
+
+        fetch_days = max(days or 0, self.forecast_days)
+        if entry:
+            cache_time, cache_data = entry
+            # Other processes sharing the cache may already be revalidating
+            if (datetime.now() - cache_time >= ttl and
+                    self.cache.claim_refresh(location, self.request_timeout * 2)):
+                self._refresh(location, fetch_days)
+            return cache_data
+
+        # Nothing cached yet: wait on the (shared) fetch
+        entries = self._refresh(location, fetch_days).result()
+        return entries.get(key) if entries else None
+
+    def _refresh(self, location, days):
+        """Start a combined fetch unless one is already in flight; return its future."""
+        with self._lock:
+            future = self._in_flight.get((location, days))
+            if future is None:
+                future = self._executor.submit(self._run_fetch, location, days)
+                self._in_flight[(location, days)] = future
+            return future
+
+    def _run_fetch(self, location, days):
+        """Fetch fresh data and fan it out to every cache key; returns None on failure."""
         try:
-            # Check cache first
-            if 'current' in self.cache:
-                cache_time, cache_data = self.cache['current']
-                if datetime.now() - cache_time < self.cache_duration:
-                    return cache_data
-
-            # Make API request
-            url = f"{self.base_url}/current.json"
-            params = {
-                'key': self.api_key,
-                'q': 'auto:ip',  # Use IP-based location
-                'aqi': 'no'  # We don't need air quality data
-            }
-            
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            
-            # Extract relevant weather data
-            data = response.json()
-            weather_data = {
-                'temp_c': data['current']['temp_c'],
-                'humidity': data['current']['humidity'],
-                'condition': {
-                    'text': data['current']['condition']['text'],
-                    'code': data['current']['condition']['code']
-                },
-                'wind_kph': data['current']['wind_kph'],
-                'precip_mm': data['current']['precip_mm'],
-                'location': {
-                    'name': data['location']['name'],
-                    'region': data['location']['region']
-                }
-            }
-            
-            # Update cache
-            self.cache['current'] = (datetime.now(), weather_data)
-            
-            return weather_data
-            
+            fetched = self._fetch_all(location, days)
+            entries = {f"{location}|{name}": data for name, data in fetched.items()}
+            self.cache.set_many(entries, self._ttls(entries))
+            if self.on_refresh:
+                self.on_refresh(location, fetched)
+            return entries
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching weather data: {str(e)}")
             return None
         except (KeyError, json.JSONDecodeError) as e:
             logger.error(f"Error parsing weather data: {str(e)}")
             return None
+        finally:
+            with self._lock:
+                self._in_flight.pop((location, days), None)
 
-    def get_forecast(self, days=3):
-        """Get weather forecast for specified number of days."""
-        try:
-            # Check cache first
-            cache_key = f'forecast_{days}'
-            if cache_key in self.cache:
-                cache_time, cache_data = self.cache[cache_key]
-                if datetime.now() - cache_time < self.cache_duration:
-                    return cache_data
-
-            # Make API request
-            url = f"{self.base_url}/forecast.json"
-            params = {
-                'key': self.api_key,
-                'q': 'auto:ip',
-                'days': days,
-                'aqi': 'no'
+    def _request(self, endpoint, params):
+        """Call the weather API and return the decoded JSON."""
+        params = dict(params, key=self.api_key)
+        response = requests.get(f"{self.base_url}/{endpoint}", params=params,
+                                timeout=self.request_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch_all(self, location, days):
+        """Fetch current weather, a days-long forecast and alerts in one request."""
+        data = self._request('forecast.json', {
+            'q': location,
+            'days': days,
+            'alerts': 'yes',
+            'aqi': 'no'  # We don't need air quality data
+        })
+
+        forecast_data = self._parse_forecast(data)
+        entries = {
+            'current': self._parse_current_weather(data),
+            'alerts': self._parse_alerts(data)
+        }
+        # Shorter forecasts are prefixes of the longer one. Every requested
+        # length gets a key, even when upstream returned fewer days, so a
+        # short answer is cached rather than refetched on every call
+        for count in range(days + 1):
+            entries[f'forecast_{count}'] = forecast_data[:count]
+        return entries
+
+    def get_current_weather(self, location=None):
+        """Get current weather data."""
+        return self._get_cached(location, 'current', self.cache_duration)
+
+    def _parse_current_weather(self, data):
+        """Extract relevant current weather data."""
+        return {
+            'temp_c': data['current']['temp_c'],
+            'humidity': data['current']['humidity'],
+            'condition': {
+                'text': data['current']['condition']['text'],
+                'code': data['current']['condition']['code']
+            },
+            'wind_kph': data['current']['wind_kph'],
+            'precip_mm': data['current']['precip_mm'],
+            'location': {
+                'name': data['location']['name'],
+                'region': data['location']['region']
             }
-            
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            
-            # Extract forecast data
-            data = response.json()
-            forecast_data = []
-            
-            for day in data['forecast']['forecastday']:
-                forecast_data.append({
-                    'date': day['date'],
-                    'max_temp_c': day['day']['maxtemp_c'],
-                    'min_temp_c': day['day']['mintemp_c'],
-                    'condition': {
-                        'text': day['day']['condition']['text'],
-                        'code': day['day']['condition']['code']
-                    },
-                    'chance_of_rain': day['day']['daily_chance_of_rain']
-                })
-            
-            # Update cache
-            self.cache[cache_key] = (datetime.now(), forecast_data)
-            
-            return forecast_data
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching forecast data: {str(e)}")
-            return None
-        except (KeyError, json.JSONDecodeError) as e:
-            logger.error(f"Error parsing forecast data: {str(e)}")
-            return None
+        }
+
+    def get_forecast(self, days=3, location=None):
+        """Get weather forecast for specified number of days."""
+        days = min(max(int(days), 0), MAX_FORECAST_DAYS)
+        return self._get_cached(location, f'forecast_{days}', self.forecast_cache_duration, days=days)
+
+    def _parse_forecast(self, data):
+        """Extract forecast data."""
+        forecast_data = []
+        for day in data['forecast']['forecastday']:
+            forecast_data.append({
+                'date': day['date'],
+                'max_temp_c': day['day']['maxtemp_c'],
+                'min_temp_c': day['day']['mintemp_c'],
+                'condition': {
+                    'text': day['day']['condition']['text'],
+                    'code': day['day']['condition']['code']
+                },
+                'chance_of_rain': day['day']['daily_chance_of_rain']
+            })
+        return forecast_data
 
-    def get_alerts(self):
+    def get_alerts(self, location=None):
         """Get current weather alerts."""
-        try:
-            # Check cache first
-            if 'alerts' in self.cache:
-                cache_time, cache_data = self.cache['alerts']
-                if datetime.now() - cache_time < timedelta(minutes=5):  # Shorter cache for alerts
-                    return cache_data
-
-            # Make API request
-            url = f"{self.base_url}/forecast.json"
-            params = {
-                'key': self.api_key,
-                'q': 'auto:ip',
-                'days': 1,
-                'alerts': 'yes'
-            }
-            
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            
-            # Extract alerts
-            data = response.json()
-            alerts = data.get('alerts', {}).get('alert', [])
-            
-            # Process and filter alerts
-            processed_alerts = []
-            for alert in alerts:
-                processed_alerts.append({
-                    'headline': alert['headline'],
-                    'severity': alert['severity'],
-                    'urgency': alert['urgency'],
-                    'areas': alert['areas'],
-                    'category': alert['category'],
-                    'event': alert['event'],
-                    'effective': alert['effective'],
-                    'expires': alert['expires'],
-                    'desc': alert['desc']
-                })
-            
-            # Sort alerts by severity
-            severity_order = {'Extreme': 0, 'Severe': 1, 'Moderate': 2, 'Minor': 3}
-            processed_alerts.sort(key=lambda x: severity_order.get(x['severity'], 999))
-            
-            # Update cache
-            self.cache['alerts'] = (datetime.now(), processed_alerts)
-            
-            return processed_alerts
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching weather alerts: {str(e)}")
-            return None
-        except (KeyError, json.JSONDecodeError) as e:
-            logger.error(f"Error parsing weather alerts: {str(e)}")
-            return None
+        return self._get_cached(location, 'alerts', self.alerts_cache_duration)
+
+    def _parse_alerts(self, data):
+        """Extract weather alerts, most severe first."""
+        processed_alerts = []
+        for alert in data.get('alerts', {}).get('alert', []):
+            processed_alerts.append({
+                'headline': alert['headline'],
+                'severity': alert['severity'],
+                'urgency': alert['urgency'],
+                'areas': alert['areas'],
+                'category': alert['category'],
+                'event': alert['event'],
+                'effective': alert['effective'],
+                'expires': alert['expires'],
+                'desc': alert['desc']
+            })
+
+        # Sort alerts by severity
+        severity_order = {'Extreme': 0, 'Severe': 1, 'Moderate': 2, 'Minor': 3}
+        processed_alerts.sort(key=lambda x: severity_order.get(x['severity'], 999))
+        return processed_alerts
 
     def clear_cache(self):
         """Clear the weather data cache."""
         self.cache.clear()
-        logger.info("Weather cache cleared") 
\ No newline at end of file
+        logger.info("Weather cache cleared")
@@ -0,0 +1,221 @@
+import os
+import json
+import math
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Grid cell size in degrees (~11 km of latitude); devices in one cell share a fetch
+LOCATION_GRID_DEGREES = 0.1
+# Entries are kept this long past their TTL so stale data can still be served
+STALE_GRACE_SECONDS = 24 * 60 * 60
+# Minimum interval between last-access updates for one key
+ACCESS_UPDATE_SECONDS = 60
+
+def _grid_cell(value, limit, grid):
+    """Centre of the grid cell holding value, clamped to [-limit, limit]."""
+    value = min(max(value, -limit), limit)
+    # Rounding first keeps points on a grid line (0.3 / 0.1 = 2.9999...) in their own cell
+    cell = math.floor(round(value / grid, 9))
+    cell = min(cell, math.ceil(round(limit / grid, 9)) - 1)
+    return (cell + 0.5) * grid
+
+def quantize_location(lat, lon, grid=LOCATION_GRID_DEGREES):
+    """Snap coordinates to the centre of their grid cell as a 'lat,lon' query string.
+
+    Raises ValueError for coordinates that are not finite numbers.
+    """
+    lat, lon = float(lat), float(lon)
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise ValueError(f"Invalid coordinates: {lat}, {lon}")
+    return f"{_grid_cell(lat, 90.0, grid):.3f},{_grid_cell(lon, 180.0, grid):.3f}"
+
+class FileWeatherCache:
+    """In-process LRU weather cache persisted to a JSON file.
+
+    Suited to a single device: last-good data survives restarts so boot never
+    waits on the network.
+    """
+
+    def __init__(self, path='weather_cache.json', max_entries=64):
+        """Initialize the cache and load any persisted entries."""
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Load persisted entries."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            for key, entry in data.items():
+                self._entries[key] = (datetime.fromisoformat(entry['time']), entry['data'])
+            logger.info(f"Loaded {len(self._entries)} cached weather entries")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading weather cache: {str(e)}")
+
+    def _save(self):
+        """Persist the cache atomically."""
+        if not self.path:
+            return
+        try:
+            # Held through the replace: concurrent fetch threads would otherwise
+            # share the temp file, or land an older snapshot last
+            with self._lock:
+                data = {key: {'time': cache_time.isoformat(), 'data': cache_data}
+                        for key, (cache_time, cache_data) in self._entries.items()}
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving weather cache: {str(e)}")
+
+    def get(self, key):
+        """Return (fetched_at, data) for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set_many(self, entries, ttls=None):
+        """Store {key: data} fetched now. TTLs are not needed in-process."""
+        now = datetime.now()
+        with self._lock:
+            for key, data in entries.items():
+                self._entries[key] = (now, data)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._save()
+
+    def claim_refresh(self, location, hold_seconds):
+        """Single process: in-flight fetches are already deduplicated by the caller."""
+        return True
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+        self._save()
+
+class SQLiteWeatherCache:
+    """Weather cache shared between processes through a local SQLite file.
+
+    Used by the API server so every worker (and every device in the same
+    grid cell) shares one upstream fetch per TTL window.
+    """
+
+    def __init__(self, path='weather_cache.db', max_entries=10000):
+        """Initialize the cache database."""
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS weather_cache (
+                    key TEXT PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_weather_cache_last_access ON weather_cache (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_weather_cache_expires_at ON weather_cache (expires_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS weather_refresh (
+                    location TEXT PRIMARY KEY,
+                    until REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        """Return this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (fetched_at, data) for key, or None."""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT fetched_at, last_access, data FROM weather_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            # Coarse LRU bookkeeping keeps hot reads from turning into writes
+            if now - row[1] > ACCESS_UPDATE_SECONDS:
+                with conn:
+                    conn.execute("UPDATE weather_cache SET last_access = ? WHERE key = ?", (now, key))
+            return datetime.fromtimestamp(row[0]), json.loads(row[2])
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Error reading weather cache: {str(e)}")
+            return None
+
+    def set_many(self, entries, ttls=None):
+        """Store {key: data} fetched now, each expiring after ttls[key] (timedelta)."""
+        ttls = ttls or {}
+        now = time.time()
+        rows = [(key, now, now + ttls[key].total_seconds() if key in ttls else now, now, json.dumps(data))
+                for key, data in entries.items()]
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO weather_cache (key, fetched_at, expires_at, last_access, data) "
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.error(f"Error writing weather cache: {str(e)}")
+
+    def claim_refresh(self, location, hold_seconds):
+        """Claim the right to revalidate a location; False if another process holds it."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute("""
+                    INSERT INTO weather_refresh (location, until) VALUES (?, ?)
+                    ON CONFLICT (location) DO UPDATE SET until = excluded.until
+                    WHERE weather_refresh.until < ?
+                """, (location, now + hold_seconds, now))
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error(f"Error claiming weather refresh: {str(e)}")
+            return True
+
+    def _evict(self, conn, now):
+        """Drop long-expired entries, then least recently used ones over the cap."""
+        conn.execute("DELETE FROM weather_cache WHERE expires_at < ?", (now - STALE_GRACE_SECONDS,))
+        conn.execute("""
+            DELETE FROM weather_cache WHERE key IN (
+                SELECT key FROM weather_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def clear(self):
+        """Remove every entry."""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM weather_cache")
+                conn.execute("DELETE FROM weather_refresh")
+        except sqlite3.Error as e:
+            logger.error(f"Error clearing weather cache: {str(e)}")
@@ -0,0 +1,33 @@
+import os
+import sys
+import time
+import pytest
+
+# The app modules import each other by plain name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from clock import FakeClock
+from alarm import AlarmManager
+
+@pytest.fixture
+def timezone(monkeypatch):
+    """Switch the process timezone, e.g. timezone('America/New_York')."""
+    def set_zone(name):
+        monkeypatch.setenv('TZ', name)
+        time.tzset()
+    yield set_zone
+    monkeypatch.undo()
+    time.tzset()
+
+@pytest.fixture
+def make_manager(monkeypatch):
+    """An AlarmManager on a FakeClock starting at the given local time, without Google Calendar."""
+    monkeypatch.setattr(AlarmManager, '_get_google_credentials', lambda self: None)
+
+    def make(start, *alarms):
+        clock = FakeClock(start)
+        manager = AlarmManager(clock=clock)
+        for alarm in alarms:
+            manager.add_alarm(dict(alarm))
+        return manager, clock
+    return make
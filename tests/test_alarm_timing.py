@@ -0,0 +1,89 @@
+from datetime import datetime
+
+def run_loop(manager, clock, seconds, max_wait=60):
+    """Drive the manager like the runtime's alarm task for `seconds` of monotonic time.
+
+    Returns the local times at which an alarm fired.
+    """
+    fired = []
+    end = clock.monotonic() + seconds
+    while clock.monotonic() < end:
+        if manager.check_alarms():
+            fired.append(clock.now())
+        wait = manager.seconds_until_next_alarm()
+        wait = max_wait if wait is None else min(wait, max_wait)
+        clock.advance(max(min(wait, end - clock.monotonic()), 0.001))
+    if manager.check_alarms():
+        fired.append(clock.now())
+    return fired
+
+def daily(alarm_id, at):
+    """A daily alarm dict at 'HH:MM'."""
+    return {'id': alarm_id, 'title': f"Alarm {alarm_id}", 'time': at, 'enabled': True}
+
+def test_fires_on_time_exactly_once(make_manager):
+    manager, clock = make_manager(datetime(2026, 6, 1, 6, 55), daily(1, '07:00'))
+    fired = run_loop(manager, clock, 3600)
+    assert fired == [datetime(2026, 6, 1, 7, 0)]
+
+def test_stall_past_deadline_fires_once(make_manager):
+    manager, clock = make_manager(datetime(2026, 6, 1, 6, 58), daily(1, '07:00'))
+    # The loop blocks (e.g. a hung HTTP call) across the alarm time
+    clock.stall(5 * 60)
+    assert manager.check_alarms()
+    assert manager.active_alarm['id'] == 1
+    # Later checks in the same minute and hour do not retrigger
+    assert run_loop(manager, clock, 3600) == []
+    assert manager.scheduler.next_fire_time(('alarm', 1)) == datetime(2026, 6, 2, 7, 0)
+
+def test_stall_beyond_catch_up_window_is_skipped(make_manager):
+    manager, clock = make_manager(datetime(2026, 6, 1, 6, 58), daily(1, '07:00'))
+    clock.stall(manager.catch_up_window.total_seconds() + 5 * 60)
+    assert not manager.check_alarms()
+    assert manager.scheduler.next_fire_time(('alarm', 1)) == datetime(2026, 6, 2, 7, 0)
+
+def test_suspend_across_alarm_time_fires_on_resume(make_manager):
+    manager, clock = make_manager(datetime(2026, 6, 1, 6, 55), daily(1, '07:00'))
+    # Deadline is 5 minutes away on the monotonic clock when the system suspends
+    assert manager.seconds_until_next_alarm() == 300
+    clock.suspend(8 * 60)
+    # Monotonic time did not move, but the wall-clock step is noticed and the alarm is overdue
+    assert manager.seconds_until_next_alarm() == 0
+    fired = run_loop(manager, clock, 3600)
+    assert fired == [datetime(2026, 6, 1, 7, 3)]
+
+def test_long_suspend_skips_missed_alarm(make_manager):
+    manager, clock = make_manager(datetime(2026, 6, 1, 6, 55), daily(1, '07:00'))
+    clock.suspend(3 * 3600)
+    assert run_loop(manager, clock, 3600) == []
+    assert manager.scheduler.next_fire_time(('alarm', 1)) == datetime(2026, 6, 2, 7, 0)
+
+def test_wall_clock_step_while_waiting(make_manager):
+    # Boot without an RTC: the clock starts in the past, then NTP steps it forward
+    manager, clock = make_manager(datetime(2026, 6, 1, 6, 0), daily(1, '07:00'))
+    clock.advance(60)
+    clock.set_wall(datetime(2026, 6, 1, 6, 59, 30))
+    fired = run_loop(manager, clock, 120)
+    assert fired == [datetime(2026, 6, 1, 7, 0)]
+
+def test_dst_spring_forward(make_manager, timezone):
+    timezone('America/New_York')
+    # 2026-03-08 02:00 EST jumps to 03:00 EDT: only 5 real hours from 01:00 to 07:00
+    manager, clock = make_manager(datetime(2026, 3, 8, 1, 0), daily(1, '07:00'))
+    assert manager.seconds_until_next_alarm() == 5 * 3600
+    # A day later the alarm is back on a 24-hour cycle
+    fired = run_loop(manager, clock, 30 * 3600)
+    assert fired == [datetime(2026, 3, 8, 7, 0), datetime(2026, 3, 9, 7, 0)]
+
+def test_dst_fall_back(make_manager, timezone):
+    timezone('America/New_York')
+    # 2026-11-01 02:00 EDT falls back to 01:00 EST, so 01:30 happens twice
+    manager, clock = make_manager(datetime(2026, 11, 1, 0, 0), daily(1, '01:30'), daily(2, '07:00'))
+    fired = run_loop(manager, clock, 24 * 3600)
+    assert fired == [datetime(2026, 11, 1, 1, 30), datetime(2026, 11, 1, 7, 0)]
+
+def test_dst_fall_back_real_interval(make_manager, timezone):
+    timezone('America/New_York')
+    # 00:00 EDT to 07:00 EST is 8 real hours
+    manager, clock = make_manager(datetime(2026, 11, 1, 0, 0), daily(1, '07:00'))
+    assert manager.seconds_until_next_alarm() == 8 * 3600
@@ -1,3 +1,6 @@
+// API endpoint
+const API_BASE_URL = 'http://192.168.1.49:5000/api';
+
 // QR Scanner instance
 let qrScanner = null;
 
@@ -10,8 +13,30 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('startScan').addEventListener('click', toggleQRScanner);
     document.getElementById('submitDeviceId').addEventListener('click', handleManualDeviceId);
     document.getElementById('deviceSetupForm').addEventListener('submit', handleDeviceSetup);
+
+    // Opened from the device's QR code: /devices/register/<device_id>?code=<pairing code>
+    const link = parseRegistrationLink(window.location.href);
+    if (link) {
+        connectDevice(link.deviceId, link.pairingCode);
+    }
 });
 
+// Device ID and pairing code from a registration link, or null
+function parseRegistrationLink(text) {
+    let url;
+    try {
+        url = new URL(text);
+    } catch (error) {
+        return null;
+    }
+    const match = url.pathname.match(/\/devices\/register\/([^/]+)/);
+    const pairingCode = url.searchParams.get('code');
+    if (!match || !pairingCode) {
+        return null;
+    }
+    return { deviceId: decodeURIComponent(match[1]), pairingCode };
+}
+
 // Populate timezone select with options
 function populateTimezones() {
     const select = document.getElementById('timezone');
@@ -72,44 +97,32 @@ function stopScanner() {
 // Handle QR scan result
 function handleQRResult(result) {
     stopScanner();
-    connectDevice(result);
+    const link = parseRegistrationLink(result.data || result);
+    if (!link) {
+        showNotification('This QR code is not a device registration code', 'error');
+        return;
+    }
+    connectDevice(link.deviceId, link.pairingCode);
 }
 
 // Handle manual device ID submission
 function handleManualDeviceId() {
     const deviceId = document.getElementById('deviceId').value.trim();
-    if (!deviceId) {
-        showNotification('Please enter a device ID', 'error');
+    const pairingCode = document.getElementById('pairingCode').value.trim();
+    if (!deviceId || !pairingCode) {
+        showNotification('Please enter the device ID and pairing code shown on the device', 'error');
         return;
     }
-    connectDevice(deviceId);
+    connectDevice(deviceId, pairingCode);
 }
 
-// Connect to device
-async function connectDevice(deviceId) {
-    try {
-        const response = await fetch(`${API_BASE_URL}/device/connect`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'Authorization': `Bearer ${localStorage.getItem('token')}`
-            },
-            body: JSON.stringify({ device_id: deviceId })
-        });
-        
-        const data = await response.json();
-        if (data.success) {
-            // Store device ID for setup
-            localStorage.setItem('registering_device_id', deviceId);
-            // Move to setup step
-            showStep(2);
-        } else {
-            showNotification(data.message || 'Failed to connect to device', 'error');
-        }
-    } catch (error) {
-        console.error('Device connection error:', error);
-        showNotification('Error connecting to device. Please try again.', 'error');
-    }
+// Connect to device (registered when the setup form is submitted)
+function connectDevice(deviceId, pairingCode) {
+    // Stored for setup
+    localStorage.setItem('registering_device_id', deviceId);
+    localStorage.setItem('registering_pairing_code', pairingCode);
+    // Move to setup step
+    showStep(2);
 }
 
 // Handle device setup form submission
@@ -117,7 +130,8 @@ async function handleDeviceSetup(event) {
     event.preventDefault();
     
     const deviceId = localStorage.getItem('registering_device_id');
-    if (!deviceId) {
+    const pairingCode = localStorage.getItem('registering_pairing_code');
+    if (!deviceId || !pairingCode) {
         showNotification('Device ID not found. Please start over.', 'error');
         showStep(1);
         return;
@@ -125,13 +139,14 @@ async function handleDeviceSetup(event) {
     
     const setupData = {
         device_id: deviceId,
+        pairing_code: pairingCode,
         name: document.getElementById('deviceName').value,
         timezone: document.getElementById('timezone').value,
         location: document.getElementById('location').value
     };
     
     try {
-        const response = await fetch(`${API_BASE_URL}/device/setup`, {
+        const response = await fetch(`${API_BASE_URL}/devices/register`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -142,8 +157,9 @@ async function handleDeviceSetup(event) {
         
         const data = await response.json();
         if (data.success) {
-            // Clear stored device ID
+            // Clear stored device ID and pairing code
             localStorage.removeItem('registering_device_id');
+            localStorage.removeItem('registering_pairing_code');
             // Show success step
             showStep('success');
         } else {
@@ -113,7 +113,8 @@ function toggleSound(sound, button) {
     }
     
     // Play new sound
-    const audio = new Audio(`${API_BASE_URL}/sounds/${sound.file}`);
+    // Versioned by content hash so the browser can cache it indefinitely
+    const audio = new Audio(`${API_BASE_URL}/sounds/${sound.file}?v=${sound.hash}`);
     audio.addEventListener('ended', () => {
         button.innerHTML = '<i class="material-icons">play_arrow</i>';
         currentlyPlaying = null;